@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Throughput and memory benchmarks of the lcheapo entry points
+
+Each entry point is run once, in its own process, on a synthetic LCHEAPO
+file (lcheapo.lcsynth) containing BUG1, BUG1a, BUG2 and BUG3 faults.  The
+reported values are blocks/s, samples/s, MB/s (of input file) and peak RSS.
+
+With airspeed velocity (https://asv.readthedocs.io), to follow the values
+from one release to the next:
+
+    asv run v2.1..master        # or: asv run --skip-existing-commits ALL
+    asv compare v2.1 master
+    asv publish
+
+Without asv:
+
+    python benchmarks/benchmarks.py [--size_mb 2048] [--json out.json]
+                                    [--compare previous.json]
+
+The synthetic file size is set by --size_mb or the LCHEAPO_BENCH_MB
+environment variable (default 64, minimum 12 to hold the faults).
+
+The file is written and each entry point is run in its own process, so that
+the peak RSS of one does not include the others' (on Linux, a child process
+starts with its parent's peak RSS).
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout, redirect_stderr
+from pathlib import Path
+
+FILE_MB = float(os.environ.get('LCHEAPO_BENCH_MB', 64))
+FILE_NAME = 'BENCH.raw.lch'
+FAULTS = dict(bug1=10, bug1a=1, bug2=10, bug3=1)
+MIN_FILE_MB = 12  # smallest file that FAULTS fit in
+OBS_TYPE = 'SPOBS2'
+# Entry point: (console script, arguments).  {path}, {in_dir}, {name},
+# {out_dir}, {n_blocks} and {half} are replaced
+ENTRY_POINTS = {
+    'lcread': (None, []),
+    'lcfix': ('lcfix', ['-i', '{in_dir}', '-o', '{out_dir}', '{name}']),
+    'lccut': ('lccut', ['-i', '{in_dir}', '-o', '{out_dir}', '--quiet',
+                        '--end', '{half}', '{name}']),
+    'lcdump': ('lcdump', ['{path}', '0', '{n_blocks}', '-x',
+                          '{out_dir}/headers.npy']),
+    'lcinfo': ('lcinfo', ['-t', '-i', '{in_dir}', '{name}']),
+    'lcverify': ('lcverify', ['-f', 'json', '-i', '{in_dir}', '{name}']),
+    'lc2ms': ('lc2ms', ['-t', OBS_TYPE, '-i', '{in_dir}', '-o', '{out_dir}',
+                        '{name}']),
+    'lc2SDS': ('lc2SDS', ['-t', OBS_TYPE, '-i', '{in_dir}', '-o',
+                          '{out_dir}', '{name}']),
+    'lc2npy': ('lc2npy', ['-t', OBS_TYPE, '-i', '{in_dir}', '-o',
+                          '{out_dir}', '{name}']),
+}
+RESULTS_FILE = 'results.json'
+
+
+def make_file(directory, size_mb=FILE_MB):
+    """
+    Write the synthetic benchmark file, in a new process
+
+    :returns: path, info (see lcsynth.write_synthetic())
+    """
+    if size_mb < MIN_FILE_MB:
+        raise ValueError(f'size_mb must be at least {MIN_FILE_MB}')
+    path = Path(directory) / FILE_NAME
+    info_file = Path(directory) / 'info.json'
+    subprocess.run([sys.executable, __file__, '--make', str(size_mb),
+                    str(path), str(info_file)], check=True)
+    info = json.loads(info_file.read_text())
+    info_file.unlink()
+    return str(path), info
+
+
+def write_file(size_mb, path, info_file):
+    """
+    Write the synthetic benchmark file and its information, in this process
+    """
+    from lcheapo.lcsynth import write_synthetic, size_duration
+
+    info = write_synthetic(path, n_chans=4, sample_rate=125,
+                           duration=size_duration(float(size_mb), 4, 125),
+                           faults=FAULTS)
+    Path(info_file).write_text(json.dumps(info))
+
+
+def measure(name, path, info):
+    """
+    Run an entry point in a new process and return its performance
+
+    :param name: key of ENTRY_POINTS
+    :param path: synthetic file
+    :param info: synthetic file information
+    :returns: dict(seconds, blocks_per_s, samples_per_s, MB_per_s,
+        peak_rss_MB)
+    """
+    with tempfile.TemporaryDirectory() as out_dir:
+        result_file = Path(out_dir) / 'result.json'
+        subprocess.run([sys.executable, __file__, '--run', name, path,
+                        str(info['n_blocks']), out_dir, str(result_file)],
+                       check=True)
+        result = json.loads(result_file.read_text())
+    seconds = result['seconds']
+    n_blocks = info['n_blocks']
+    return dict(seconds=seconds,
+                blocks_per_s=n_blocks / seconds,
+                samples_per_s=n_blocks * 166 / seconds,
+                MB_per_s=os.path.getsize(path) / 2**20 / seconds,
+                peak_rss_MB=result['peak_rss_MB'])
+
+
+def run_entry_point(name, path, n_blocks, out_dir):
+    """
+    Run an entry point in this process
+
+    :returns: dict(seconds, peak_rss_MB)
+    """
+    script, arguments = ENTRY_POINTS[name]
+    path = Path(path)
+    fields = dict(path=path, in_dir=path.parent, name=path.name,
+                  out_dir=out_dir, n_blocks=n_blocks,
+                  half=int(n_blocks) // 2)
+    argv = [script] + [a.format(**fields) for a in arguments]
+    if script is None:
+        from lcheapo.lcread import read
+
+        def func():
+            read(str(path), starttime=0, endtime=0, obs_type=OBS_TYPE)
+    else:
+        main = _console_script(script)
+
+        def func():
+            sys.argv = argv
+            try:
+                main()
+            except SystemExit:
+                pass
+    with open(os.devnull, 'w') as null, redirect_stdout(null), \
+            redirect_stderr(null):
+        start = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - start
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss_MB = rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+    return dict(seconds=seconds, peak_rss_MB=rss_MB)
+
+
+def _console_script(script):
+    import importlib
+    return importlib.import_module(f'lcheapo.{script}').main
+
+
+class EntryPoints:
+    """
+    asv benchmarks: one set of values per entry point
+    """
+    params = list(ENTRY_POINTS)
+    param_names = ['entry_point']
+    timeout = 3600
+    number = 1
+    repeat = 1
+
+    def setup_cache(self):
+        path, info = make_file('.')
+        return dict(path=str(Path(path).resolve()), info=info)
+
+    def _result(self, cache, name):
+        """ Measure each entry point once, for all of the track_ values """
+        results_file = Path(cache['path']).parent / RESULTS_FILE
+        results = (json.loads(results_file.read_text())
+                   if results_file.exists() else {})
+        if name not in results:
+            results[name] = measure(name, cache['path'], cache['info'])
+            results_file.write_text(json.dumps(results))
+        return results[name]
+
+    def track_blocks_per_s(self, cache, name):
+        return self._result(cache, name)['blocks_per_s']
+    track_blocks_per_s.unit = 'blocks/s'
+
+    def track_samples_per_s(self, cache, name):
+        return self._result(cache, name)['samples_per_s']
+    track_samples_per_s.unit = 'samples/s'
+
+    def track_MB_per_s(self, cache, name):
+        return self._result(cache, name)['MB_per_s']
+    track_MB_per_s.unit = 'MB/s'
+
+    def track_peak_rss(self, cache, name):
+        return self._result(cache, name)['peak_rss_MB']
+    track_peak_rss.unit = 'MB'
+
+
+def main():
+    args = _get_args()
+    if args.run:
+        name, path, n_blocks, out_dir, result_file = args.run
+        result = run_entry_point(name, path, n_blocks, out_dir)
+        Path(result_file).write_text(json.dumps(result))
+        return 0
+    if args.make:
+        write_file(*args.make)
+        return 0
+    if args.size_mb < MIN_FILE_MB:
+        sys.exit(f'--size_mb must be at least {MIN_FILE_MB}')
+    names = args.only or list(ENTRY_POINTS)
+    previous = json.loads(Path(args.compare).read_text()) \
+        if args.compare else {}
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path, info = make_file(tmp, args.size_mb)
+        print(f'{Path(path).name}: {os.path.getsize(path) / 2**20:.0f} MB, '
+              f'{info["n_blocks"]:d} blocks')
+        print('{:10s} {:>9s} {:>12s} {:>12s} {:>9s} {:>9s}'.format(
+            'entry', 'seconds', 'blocks/s', 'samples/s', 'MB/s', 'RSS MB'))
+        for name in names:
+            r = results[name] = measure(name, path, info)
+            line = '{:10s} {:9.2f} {:12.0f} {:12.0f} {:9.1f} {:9.0f}'.format(
+                name, r['seconds'], r['blocks_per_s'], r['samples_per_s'],
+                r['MB_per_s'], r['peak_rss_MB'])
+            if name in previous:
+                line += '  ({:+.0%} MB/s, {:+.0%} RSS)'.format(
+                    r['MB_per_s'] / previous[name]['MB_per_s'] - 1,
+                    r['peak_rss_MB'] / previous[name]['peak_rss_MB'] - 1)
+            print(line)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    return 0
+
+
+def _get_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size_mb", type=float, default=FILE_MB,
+                        help=f"synthetic file size (MB, at least {MIN_FILE_MB})")
+    parser.add_argument("--only", nargs='+', choices=list(ENTRY_POINTS),
+                        help="entry points to benchmark")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare",
+                        help="results file (--json) to compare against")
+    parser.add_argument("--run", nargs=5, help=argparse.SUPPRESS)
+    parser.add_argument("--make", nargs=3, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
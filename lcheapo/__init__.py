@@ -7,11 +7,13 @@ LCHEAPO-specific command-line programs:
      lcdump: Dump data, header and/or directory from an LCHEAPO data file
      lccut: Cut an LCHEAPO data file into pieces
      lcinfo: Print basic information about LCHEAPO data files
+     lcverify: Check LCHEAPO files for bad headers/data, and CRC32s of copies
      lcheader: Create an LCHEAPO data file header
      lcplot: Plot data in LCHEAPO data files
      lc2obstest: Prepare files for obstest
      lc2SDS_py: Convert LCHEAPO data to an SDS database (update drift daily)
      lc2ms_py: Convert LCHEAPO data to uncorrected miniSEED data
+     lc2npy: Convert LCHEAPO data to a fast NumPy archive
      lctest: Plot various graphics to evaluate OBSs (needs an input YAML file)
      lc_examples: ???
 
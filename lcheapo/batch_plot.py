@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Headless batch plotting
+
+Each plot is described by a small, picklable PlotSpec: a module-level
+rendering function, the output file and the data to plot.  render_all()
+renders the specs in worker processes, with the Agg backend.
+
+Renderers should draw on a figure from new_figure(), which is not
+registered with pyplot, so nothing accumulates in pyplot's figure manager:
+
+>>> def render_line(filename, x, y):
+...     fig = new_figure()
+...     fig.add_subplot().plot(x, y)
+...     fig.savefig(filename)
+>>> specs = [PlotSpec(render_line, f'{i}.png', x=[0, 1], y=[0, i])
+...          for i in range(100)]
+>>> render_all(specs, jobs=8)                          # doctest: +SKIP
+"""
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+class PlotSpec:
+    """
+    Description of one plot
+    """
+    def __init__(self, func, filename, **kwargs):
+        """
+        :parm func: module-level function, called as
+            func(filename, **kwargs), that draws and saves the plot
+        :parm filename: output file
+        :parm kwargs: data and options for func (must be picklable to be
+            rendered in worker processes)
+        """
+        self.func = func
+        self.filename = str(filename)
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return 'PlotSpec({}, {!r}, {})'.format(
+            self.func.__name__, self.filename, ', '.join(self.kwargs))
+
+    def render(self):
+        """
+        Draw and save the plot
+
+        :returns: filename
+        """
+        self.func(self.filename, **self.kwargs)
+        return self.filename
+
+
+def new_figure(figsize=None):
+    """
+    Return a Figure drawn with the Agg canvas, outside of pyplot
+
+    The figure is freed as soon as it is no longer referenced
+    """
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def render_all(specs, jobs=1, verbose=True):
+    """
+    Render plots, in parallel
+
+    :param specs: PlotSpecs
+    :param jobs: number of worker processes (1: render in this process)
+    :param verbose: print progress as plots are saved
+    :returns: list of the rendered files, in completion order
+    """
+    specs = list(specs)
+    n_specs = len(specs)
+    done = []
+    if jobs <= 1 or n_specs <= 1:
+        for spec in specs:
+            done.append(render(spec))
+            _progress(verbose, len(done), n_specs, done[-1])
+        return done
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=_init_worker) as executor:
+        futures = [executor.submit(render, spec) for spec in specs]
+        for future in as_completed(futures):
+            done.append(future.result())
+            _progress(verbose, len(done), n_specs, done[-1])
+    return done
+
+
+def render(spec):
+    """
+    Render one PlotSpec, closing any pyplot figure that it left open
+    """
+    plt = sys.modules.get('matplotlib.pyplot')
+    before = set(plt.get_fignums()) if plt else set()
+    try:
+        return spec.render()
+    finally:
+        plt = sys.modules.get('matplotlib.pyplot')
+        if plt:
+            for num in set(plt.get_fignums()) - before:
+                plt.close(num)
+
+
+def _init_worker():
+    matplotlib.use('Agg', force=True)
+
+
+def _progress(verbose, i, n, filename):
+    if verbose:
+        print(f'[{i:d}/{n:d}] {filename}')
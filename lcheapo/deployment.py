@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Read a deployment split over sequential LCHEAPO files as one data set
+
+The first file has the disk header, the others are headerless continuations
+(as handled by lcfix).  A file whose name contains '.header.' is used as the
+header and put first.  The files are memory-mapped and indexed once (time
+and sample offset of each file), then time windows are read across file
+boundaries, only touching the blocks that are needed.
+"""
+from pathlib import Path
+
+import numpy as np
+from obspy.core import UTCDateTime, Stream, Trace
+
+from .lcheapo_utils import LCDiskHeader
+from .lcread import _stuff_info
+from .lcscan import (map_blocks, header_times, decode_samples,
+                     first_mux0_block, SAMPLES_PER_BLOCK)
+from . import profiling
+
+CHUNK_BLOCKS = 2048  # blocks per channel yielded by Deployment.iter_streams()
+TIME_BLOCKS = 100  # channel-0 blocks searched for a file's start time
+
+
+class Deployment:
+    """
+    Random access by time to sequential LCHEAPO files
+    """
+    def __init__(self, files, network='XX', station='SSSSS',
+                 obs_type='SPOBS2'):
+        """
+        Args:
+            files (list of str or Path): LCHEAPO files, in recording order.
+                The first one (or the '.header.' one) must have a header
+            network (str): network code
+            station (str): station code
+            obs_type (str): OBS type (must match a key in chan_maps)
+        """
+        files = [Path(f) for f in files]
+        for f in files:
+            if '.header.' in f.name:
+                files.remove(f)
+                files.insert(0, f)
+                break
+        if not files:
+            raise ValueError('No files')
+        self.network = network
+        self.station = station
+        self.obs_type = obs_type
+        self.header = LCDiskHeader()
+        with open(files[0], 'rb') as fp:
+            if self.header.readHeader(fp) == 0:
+                raise ValueError(f'{files[0]} has no valid header')
+        self.sampling_rate = self.header.realSampleRate
+        self.n_channels = self.header.numberOfChannels
+        if '.header.' in files[0].name:
+            self.header_file, files = files[0], files[1:]
+        else:
+            self.header_file = files[0]
+        self.files, self._blocks, starttimes, offsets = [], [], [], [0]
+        for f in files:
+            first_block = self.header.dataStart if f == self.header_file else 0
+            blocks = map_blocks(f, first_block)
+            if len(blocks) < self.n_channels:
+                continue
+            blocks = blocks[first_mux0_block(f, first_block) - first_block:]
+            blocks = blocks[:len(blocks) // self.n_channels * self.n_channels]
+            if len(blocks) == 0:
+                continue
+            self.files.append(f)
+            self._blocks.append(blocks)
+            starttimes.append(self._file_starttime(f, blocks))
+            offsets.append(offsets[-1] + len(blocks) // self.n_channels
+                           * SAMPLES_PER_BLOCK)
+        if not self.files:
+            raise ValueError('No data in ' + ', '.join(str(f) for f in files))
+        self.file_starttimes = np.array(starttimes, dtype='datetime64[ms]')
+        self.file_offsets = np.array(offsets, dtype=np.int64)
+        self._file_starts = self.file_starttimes.astype(np.int64) / 1000.
+
+    def _file_starttime(self, filename, blocks):
+        """
+        Return the time of a file's first sample, from the first valid time
+        of its first TIME_BLOCKS channel-0 blocks
+
+        Raises:
+            ValueError: if none of these times is valid
+        """
+        times = header_times(blocks[:TIME_BLOCKS * self.n_channels
+                                    :self.n_channels])
+        valid = np.flatnonzero(~np.isnat(times))
+        if len(valid) == 0:
+            raise ValueError(f'{filename}: no valid block time in the first '
+                             f'{len(times)} channel 0 blocks')
+        k = int(valid[0])
+        return times[k] - np.timedelta64(
+            int(round(k * SAMPLES_PER_BLOCK * 1000 / self.sampling_rate)),
+            'ms')
+
+    def __repr__(self):
+        return (f'Deployment({len(self.files)} files) <{self.n_channels} '
+                f'channels, {self.sampling_rate:g} sps, {self.starttime} - '
+                f'{self.endtime}>')
+
+    @property
+    def starttime(self):
+        return UTCDateTime(self._file_starts[0])
+
+    @property
+    def endtime(self):
+        """Time of the last sample"""
+        return self.sample_time(int(self.file_offsets[-1]) - 1)
+
+    @property
+    def n_samples(self):
+        return int(self.file_offsets[-1])
+
+    @property
+    def seed_ids(self):
+        """SEED ids of the channels, as set by `read()`"""
+        stats = {'sampling_rate': self.sampling_rate}
+        stream = Stream([Trace(header=stats)
+                         for _ in range(self.n_channels)])
+        _stuff_info(stream, self.network, self.station, self.obs_type,
+                    responses=False)
+        return [tr.id for tr in stream]
+
+    def sample_index(self, time):
+        """
+        Return the index of the first sample at or after time
+        """
+        t = float(UTCDateTime(time).timestamp)
+        k = max(np.searchsorted(self._file_starts, t, side='right') - 1, 0)
+        file_len = self.file_offsets[k + 1] - self.file_offsets[k]
+        i = np.ceil((t - self._file_starts[k]) * self.sampling_rate - 1e-6)
+        return int(self.file_offsets[k] + np.clip(i, 0, file_len))
+
+    def sample_time(self, index):
+        """
+        Return the time of the sample at index
+        """
+        k = max(np.searchsorted(self.file_offsets, index, side='right') - 1,
+                0)
+        k = min(k, len(self._file_starts) - 1)
+        return UTCDateTime(self._file_starts[k] + (index
+                           - self.file_offsets[k]) / self.sampling_rate)
+
+    def get_data(self, starttime=None, endtime=None, channels=None):
+        """
+        Return raw samples between starttime (inclusive) and endtime
+        (exclusive)
+
+        Samples of successive files are concatenated, even if there is a gap
+        between the files (read() splits the traces at gaps)
+
+        Args:
+            starttime (UTCDateTime, str or number): start time.  If a number,
+                seconds after the deployment start.  If None, the start
+            endtime (UTCDateTime, str or number): end time.  If a number,
+                seconds after starttime.  If None, the end
+            channels (list of int): channels to return (default: all)
+        Returns:
+            (tuple):
+                first_time (:class:`obspy.UTCDateTime`): time of first sample
+                data (:class:`numpy.ndarray`): int32 (n_channels, n_samples)
+        """
+        i0, i1 = self._index_bounds(starttime, endtime)
+        return self.sample_time(i0), self._samples(i0, i1, channels)
+
+    def read(self, starttime=None, endtime=None, responses=True):
+        """
+        Read data into an obspy stream
+
+        Arguments are as for `get_data()`.  Channel codes and responses are
+        attached as in `lcread.read()`.  Traces are split where a file does
+        not start when the previous one ends
+
+        Args:
+            responses (bool): attach instrument responses
+        Returns:
+            stream (:class:`~obspy.core.stream.Stream`): read data
+        """
+        i0, i1 = self._index_bounds(starttime, endtime)
+        return self._stream(i0, i1, responses)
+
+    def iter_streams(self, starttime=None, endtime=None,
+                     chunk_blocks=CHUNK_BLOCKS, responses=False):
+        """
+        Iterate through the data, a chunk at a time
+
+        Chunks follow each other without gaps or overlaps, across file
+        boundaries.  Memory use depends on chunk_blocks, not on the
+        deployment length
+
+        Args:
+            starttime, endtime: as for `get_data()`
+            chunk_blocks (int): number of blocks per channel in each chunk
+            responses (bool): attach instrument responses
+        Yields:
+            stream (:class:`~obspy.core.stream.Stream`): one chunk
+        """
+        i0, i1 = self._index_bounds(starttime, endtime)
+        chunk = chunk_blocks * SAMPLES_PER_BLOCK
+        for i in range(i0, i1, chunk):
+            yield self._stream(i, min(i + chunk, i1), responses)
+
+    def iter_data(self, starttime=None, endtime=None,
+                  chunk_blocks=CHUNK_BLOCKS, channels=None):
+        """
+        Iterate through the raw samples, a chunk at a time
+
+        As `iter_streams()`, without creating Traces.  A chunk also ends
+        where a file does not continue the previous one, so a gap is always
+        between two chunks.  Use `sample_time()` to get the time of a sample
+        (and to find the gaps)
+
+        Args:
+            starttime, endtime: as for `get_data()`
+            chunk_blocks (int): number of blocks per channel in each chunk
+            channels (list of int): channels to return (default: all)
+        Yields:
+            (tuple):
+                first (int): index of the first sample
+                data (:class:`numpy.ndarray`): int32 (n_channels, n_samples)
+        """
+        i0, i1 = self._index_bounds(starttime, endtime)
+        chunk = chunk_blocks * SAMPLES_PER_BLOCK
+        for r0, r1 in self._runs(i0, i1):
+            for i in range(r0, r1, chunk):
+                yield i, self._samples(i, min(i + chunk, r1), channels)
+
+    def _index_bounds(self, starttime, endtime):
+        if starttime is None:
+            starttime = self.starttime
+        elif isinstance(starttime, (float, int)):
+            starttime = self.starttime + starttime
+        else:
+            starttime = UTCDateTime(starttime)
+        i0 = self.sample_index(starttime)
+        if endtime is None:
+            return i0, self.n_samples
+        if isinstance(endtime, (float, int)):
+            endtime = starttime + endtime
+        return i0, max(self.sample_index(endtime), i0)
+
+    def _runs(self, i0, i1):
+        """
+        Split [i0, i1) where a file does not continue the previous one
+
+        Yields:
+            (tuple): first sample index, last sample index + 1
+        """
+        tolerance = 0.5 / self.sampling_rate
+        for k in range(1, len(self.files)):
+            boundary = int(self.file_offsets[k])
+            if not i0 < boundary < i1:
+                continue
+            expected = self._file_starts[k - 1] + (
+                boundary - self.file_offsets[k - 1]) / self.sampling_rate
+            if abs(self._file_starts[k] - expected) > tolerance:
+                yield i0, boundary
+                i0 = boundary
+        if i1 > i0:
+            yield i0, i1
+
+    def _stream(self, i0, i1, responses):
+        stream = Stream()
+        for r0, r1 in self._runs(i0, i1):
+            stats = {'sampling_rate': self.sampling_rate,
+                     'starttime': self.sample_time(r0)}
+            stream += Stream([Trace(data=d, header=stats)
+                              for d in self._samples(r0, r1)])
+        # Set the codes of each run's traces
+        for k in range(0, len(stream), self.n_channels):
+            _stuff_info(stream[k:k + self.n_channels], self.network,
+                        self.station, self.obs_type, responses)
+        return stream
+
+    def _samples(self, i0, i1, channels=None):
+        """
+        Return samples [i0, i1) of each channel, decoding only the blocks
+        that contain them
+        """
+        if channels is None:
+            channels = range(self.n_channels)
+        data = np.empty((len(channels), i1 - i0), dtype=np.int32)
+        k0 = max(np.searchsorted(self.file_offsets, i0, side='right') - 1, 0)
+        for k in range(k0, len(self.files)):
+            f0, f1 = self.file_offsets[k], self.file_offsets[k + 1]
+            if f0 >= i1:
+                break
+            s0, s1 = max(i0, f0) - f0, min(i1, f1) - f0
+            if s1 <= s0:
+                continue
+            g0 = s0 // SAMPLES_PER_BLOCK
+            g1 = -(-s1 // SAMPLES_PER_BLOCK)
+            blocks = self._blocks[k]
+            out = slice(f0 + s0 - i0, f0 + s1 - i0)
+            for row, ch in enumerate(channels):
+                with profiling.stage('decode', (g1 - g0) * 3
+                                     * SAMPLES_PER_BLOCK):
+                    samples = decode_samples(
+                        blocks[g0 * self.n_channels + ch:
+                               g1 * self.n_channels:self.n_channels])
+                data[row, out] = samples.ravel()[
+                    s0 - g0 * SAMPLES_PER_BLOCK:s1 - g0 * SAMPLES_PER_BLOCK]
+        return data
+
+
+def read(files, starttime=None, endtime=None, network='XX',
+         station='SSSSS', obs_type='SPOBS2'):
+    """
+    Read sequential LCHEAPO files into an obspy stream
+
+    Args:
+        files (list of str or Path): LCHEAPO files (see `Deployment`)
+        starttime, endtime: as for `Deployment.get_data()`
+        network (str): network code
+        station (str): station code
+        obs_type (str): OBS type (must match a key in chan_maps)
+    Returns:
+        stream (:class:`~obspy.core.stream.Stream`): read data
+    """
+    return Deployment(files, network, station, obs_type).read(starttime,
+                                                               endtime)
@@ -21,8 +21,10 @@ from progress.bar import IncrementalBar
 from .instrument_metadata import chan_maps, load_station
 from .lcread import read as lcread, get_data_timelimits
 from .version import __version__
+from . import profiling
 
 
+@profiling.profile_main
 def main():
     """
     Convert fixed LCHEAPO data to SeisComp Data Structure
@@ -155,7 +157,7 @@ def _verify_network_code(s):
 
 def _get_args():
     parser = argparse.ArgumentParser(
-        description=inspect.cleandoc(lc2SDS.__doc__),
+        description=inspect.cleandoc(main.__doc__),
         formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument("input_files", nargs='+',
                         help="Input filename(s).  If there are captured "
@@ -202,11 +204,13 @@ def _get_args():
                         help="verbose output")
     parser.add_argument("--version", action='store_true',
                         help="Print version number and quit")
+    profiling.add_arguments(parser)
     args = parser.parse_args()
     parameters = vars(args).copy()
     if args.version is True:
         print(f"Version {__version__}")
         sys.exit(0)
+    profiling.start(args)
 
     # SETUP FOR PROCESS-STEPS
     process_step = ProcessStep('lc2SDS',
@@ -258,8 +262,9 @@ def _write_daily(inst_offset, stime, infile, args, ls_times, ls_types,
             s.network, s.station, s.location, s.channel,
             stime.year, stime.julday)
         dirname.mkdir(parents=True, exist_ok=True)
-        tr.write(str(dirname / fname), format='MSEED',
-                 encoding='STEIM1', reclen=4096)
+        with profiling.TimedFile(dirname / fname) as fp, \
+                profiling.stage('mseed_encode', tr.data.nbytes):
+            tr.write(fp, format='MSEED', encoding='STEIM1', reclen=4096)
     return sampling_rate
 
 
@@ -4,18 +4,198 @@
 create miniSEED file(s) from LCHEAPO file(s)
 """
 import argparse
+import math
 # import os
 import sys
 # import datetime
 import inspect
+import warnings
 from pathlib import Path
 
+import numpy as np
+from obspy.core import UTCDateTime, Stream, Trace
 from sdpchainpy import ProcessStep
 
 # from .sdpchain import ProcessStep
 from .instrument_metadata import chan_maps
-from .lcread import read as lcread
+from .lcheapo_utils import LCDiskHeader, BLOCK_SIZE
+from .lcread import _stuff_info
+from .lcscan import (BLOCK_DTYPE, DATA_BYTES, SAMPLES_PER_BLOCK,
+                     channel_samples, first_mux0_block, header_times,
+                     n_file_blocks)
 from .version import __version__
+from . import profiling
+
+ROLLOVERS = {'none': None, 'hour': 3600, 'day': 86400}
+CHUNK_BLOCKS = 2048  # blocks per channel read and written at a time
+
+
+def convert(infile, out_dir='.', network='XX', station='SSSSS',
+            obs_type='SPOBS2', rollover='none', chunk_blocks=CHUNK_BLOCKS,
+            verbose=False):
+    """
+    Convert an LCHEAPO file to miniSEED files
+
+    The input file is streamed chunk by chunk and each chunk is appended to
+    the output files, so memory use does not depend on the file size.
+    Sample times follow from the first block's time and the sampling rate,
+    as in `lcread.read()`.
+
+    Args:
+        infile (str or Path): LCHEAPO file (must have a header)
+        out_dir (str or Path): output directory
+        network (str): network code
+        station (str): station code
+        obs_type (str): OBS type (must match a key in chan_maps)
+        rollover (str): start new files every 'hour' or 'day', or only
+            write one file per trace ('none')
+        chunk_blocks (int): number of blocks per channel in each chunk
+        verbose (bool): print a summary
+    Returns:
+        out_files (list): names of the written files, in out_dir
+    """
+    if rollover not in ROLLOVERS:
+        raise ValueError(f'{rollover=} not in {list(ROLLOVERS)}')
+    infile = Path(infile)
+    lcHeader = LCDiskHeader()
+    with open(infile, 'rb') as fp:
+        with profiling.stage('header_read', BLOCK_SIZE):
+            status = lcHeader.readHeader(fp)
+        if status == 0:
+            raise ValueError(f'{infile} has no valid header')
+        n_chans = lcHeader.numberOfChannels
+        sampling_rate = lcHeader.realSampleRate
+        first_block = first_mux0_block(infile, lcHeader.dataStart)
+        n_groups = (n_file_blocks(fp) - first_block) // n_chans
+        fp.seek(first_block * BLOCK_SIZE)
+        writer = _MSEEDWriter(out_dir, ROLLOVERS[rollover])
+        starttime, n_samples = None, 0
+        try:
+            for g in range(0, n_groups, chunk_blocks):
+                n_blocks = min(chunk_blocks, n_groups - g) * n_chans
+                with profiling.stage('block_read', n_blocks * BLOCK_SIZE):
+                    blocks = np.fromfile(fp, dtype=BLOCK_DTYPE,
+                                         count=n_blocks)
+                chunk_time = _chunk_time(blocks, n_chans, sampling_rate)
+                if starttime is None:
+                    if chunk_time is None:
+                        raise ValueError(f'{infile}: no valid block time in '
+                                         f'the first {n_blocks} blocks')
+                    starttime = chunk_time
+                if chunk_time is not None:
+                    _check_time(chunk_time,
+                                starttime + n_samples / sampling_rate,
+                                sampling_rate)
+                stats = {'sampling_rate': sampling_rate,
+                         'starttime': starttime + n_samples / sampling_rate}
+                stream = Stream()
+                for ch in range(n_chans):
+                    with profiling.stage('decode',
+                                         n_blocks // n_chans * DATA_BYTES):
+                        data = channel_samples(blocks, n_chans, ch)
+                    stream.append(Trace(data=data, header=stats))
+                _stuff_info(stream, network, station, obs_type,
+                            responses=False)
+                for tr in stream:
+                    writer.write(tr)
+                n_samples += n_blocks // n_chans * SAMPLES_PER_BLOCK
+        finally:
+            writer.close()
+    if verbose:
+        print(f'{infile.name}: wrote {n_samples} samples x {n_chans} '
+              f'channels to {len(writer.files)} files')
+    return writer.files
+
+
+def _chunk_time(blocks, n_chans, sampling_rate):
+    """
+    Return the time of a chunk's first sample, from its first valid block
+    time (None if no block time is valid)
+    """
+    times = header_times(blocks[::n_chans])
+    valid = np.flatnonzero(~np.isnat(times))
+    if len(valid) == 0:
+        return None
+    k = int(valid[0])
+    return (UTCDateTime(times[k].astype(np.int64) / 1000.)
+            - k * SAMPLES_PER_BLOCK / sampling_rate)
+
+
+def _check_time(block_time, expected, sampling_rate):
+    """
+    Warn if a chunk's first block is not where the sampling rate puts it
+    """
+    offset = block_time - expected
+    if abs(offset) > 0.1 / sampling_rate:
+        warnings.warn("Block at {} {} by {:g} seconds! ({:g} samples)"
+                      .format(block_time, 'late' if offset > 0 else 'early',
+                              abs(offset), abs(offset) * sampling_rate))
+
+
+class _MSEEDWriter:
+    """
+    Append traces to miniSEED files, one per trace id (and rollover period)
+    """
+    def __init__(self, out_dir, period=None, encoding='STEIM1',
+                 reclen=4096):
+        """
+        Args:
+            out_dir (str or Path): output directory
+            period (int): seconds between rollovers (None: no rollover)
+            encoding (str): miniSEED encoding
+            reclen (int): miniSEED record length
+        """
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.period = period
+        self.encoding = encoding
+        self.reclen = reclen
+        self.files = []
+        self._open = {}  # trace id: (period number, file)
+
+    def write(self, tr):
+        """
+        Append a trace, starting new files at period boundaries
+        """
+        sr = tr.stats.sampling_rate
+        start = tr.stats.starttime
+        i, n = 0, len(tr.data)
+        while i < n:
+            t = start.timestamp + i / sr
+            if self.period is None:
+                number, j = 0, n
+            else:
+                number = math.floor(t / self.period)
+                j = math.ceil(((number + 1) * self.period - start.timestamp)
+                              * sr - 1e-6)
+                j = min(max(j, i + 1), n)
+            self._append(tr, i, j, number)
+            i = j
+
+    def close(self):
+        for _, fp in self._open.values():
+            fp.close()
+        self._open = {}
+
+    def _append(self, tr, i, j, number):
+        sr = tr.stats.sampling_rate
+        starttime = tr.stats.starttime + i / sr
+        current = self._open.get(tr.id)
+        if current is None or current[0] != number:
+            if current is not None:
+                current[1].close()
+            fname = '{}_{}.mseed'.format(tr.id,
+                                         starttime.strftime('%Y%m%dT%H%M'))
+            current = (number, profiling.TimedFile(self.out_dir / fname))
+            self._open[tr.id] = current
+            self.files.append(fname)
+        stats = tr.stats.copy()
+        stats.npts = j - i
+        stats.starttime = starttime
+        piece = Trace(data=tr.data[i:j], header=stats)
+        with profiling.stage('mseed_encode', piece.data.nbytes):
+            piece.write(current[1], format='MSEED', encoding=self.encoding,
+                        reclen=self.reclen)
 
 
 def _verify_station_code(s):
@@ -33,10 +213,12 @@ def _verify_network_code(s):
     return s
 
 
+@profiling.profile_main
 def main():
     """
     Convert LCHEAPO data to basic miniSEED files for Epos-France SMM A-node
-    One file per trace, filenames are {seed.id}.{YYYYmmdd}T{HHMM}.mseed
+    One file per trace (or per trace and hour/day, with --rollover),
+    filenames are {seed.id}_{YYYYmmdd}T{HHMM}.mseed
     No drift or leapsecond correction:
     """
     print(main.__doc__)
@@ -65,15 +247,24 @@ def main():
     parser.add_argument("-o", dest="out_dir", metavar="OUT_DIR", default='.',
                         help="output file directory (absolute, " +
                              "or relative to base_dir)")
+    parser.add_argument("-r", "--rollover", default='none',
+                        choices=list(ROLLOVERS),
+                        help="start new files every hour or day "
+                             "(default=%(default)s)")
+    parser.add_argument("--chunk_blocks", type=int, default=CHUNK_BLOCKS,
+                        help="blocks per channel read and written at a time "
+                             "(default=%(default)s)")
     parser.add_argument("-v", "--verbose", action='store_true',
                         help="verbose output")
     parser.add_argument("--version", action='store_true',
                         help="Print version number and quit")
+    profiling.add_arguments(parser)
     args = parser.parse_args()
     parameters = vars(args).copy()
     if args.version is True:
         print(f"Version {__version__}")
         sys.exit(0)
+    profiling.start(args)
 
     # ADJUST INPUT PARAMETERS
     process_step = ProcessStep('lc2ms_py',
@@ -86,21 +277,18 @@ def main():
     # args.input_files = [x.name for f in args.infiles
     #                 for x in Path(args.in_dir).glob(f)]
 
-    for infile in args.input_files:
-        stream = lcread(Path(args.in_dir) / infile, network=args.network,
-                        station=args.station, obs_type=args.obs_type,
-                        starttime=0,
-                        endtime=1*86400*365.25)  # For up to 1 year of data
-        out_dir = Path(args.out_dir)
-        out_dir.mkdir(parents=True, exist_ok=True)
-        out_files = []
-        for tr in stream:
-            s = tr.stats
-            out_files.append('{}_{}.mseed'.format(
-                tr.id, s.starttime.strftime("%Y%m%dT%H%M")))
-            fname = str(out_dir / out_files[-1])
-            tr.write(fname, format='MSEED', encoding='STEIM1', reclen=4096)
+    out_files = []
     return_code = 0
+    for infile in args.input_files:
+        try:
+            out_files.extend(convert(
+                Path(args.in_dir) / infile, args.out_dir,
+                network=args.network, station=args.station,
+                obs_type=args.obs_type, rollover=args.rollover,
+                chunk_blocks=args.chunk_blocks, verbose=args.verbose))
+        except ValueError as e:
+            print(f'Could not convert {infile}: {e}')
+            return_code = 2
     process_step.output_files = out_files
     process_step.exit_code = return_code
     process_step.write(args.in_dir, args.out_dir)
@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Convert LCHEAPO file(s) to a fast NumPy archive, and read them back
+
+Each archive is a directory ({root}.lcnpy) containing:
+    - header.json: LCHEAPO disk header and station information
+    - index.npz: start time and sample offset of each chunk
+    - ch{N}.npy: int32 samples of channel N (compression='none'), or
+    - ch{N}.npz: one zlib-compressed array per chunk (compression='zlib')
+
+Uncompressed archives are memory-mapped, so reading a time window only
+touches the requested samples.
+"""
+import argparse
+import json
+import sys
+import zipfile
+from pathlib import Path
+
+import numpy as np
+from obspy.core import UTCDateTime, Stream, Trace
+from sdpchainpy import ProcessStep
+
+from .instrument_metadata import chan_maps
+from .lcheapo_utils import LCDiskHeader
+from .lcread import _stuff_info
+from .lcscan import (map_blocks, header_times, channel_samples,
+                     first_mux0_block, SAMPLES_PER_BLOCK)
+from .version import __version__
+
+ARCHIVE_SUFFIX = '.lcnpy'
+FORMAT_VERSION = 1
+COMPRESSIONS = ('none', 'zlib')
+CHUNK_BLOCKS = 1024  # blocks per channel in each archive chunk
+
+
+def convert(infile, out_dir='.', network='XX', station='SSSSS',
+            obs_type='SPOBS2', chunk_blocks=CHUNK_BLOCKS, compression='none',
+            verbose=False):
+    """
+    Convert an LCHEAPO file to a NumPy archive
+
+    The input file is streamed chunk by chunk, so memory use does not
+    depend on the file size.
+
+    Each chunk's start time is that of its first block with a valid time,
+    or follows from the previous chunk's if none is valid.
+
+    Args:
+        infile (str or Path): LCHEAPO file (must have a header)
+        out_dir (str or Path): directory in which to create the archive
+        network (str): network code
+        station (str): station code
+        obs_type (str): OBS type (must match a key in chan_maps)
+        chunk_blocks (int): number of blocks per channel in each chunk
+        compression (str): 'none' or 'zlib'
+    Returns:
+        archive_path (:class:`pathlib.Path`): path of the created archive
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'{compression=} not in {COMPRESSIONS}')
+    infile = Path(infile)
+    lcHeader = LCDiskHeader()
+    with open(infile, 'rb') as fp:
+        if lcHeader.readHeader(fp) == 0:
+            raise ValueError(f'{infile} has no valid header')
+    n_chans = lcHeader.numberOfChannels
+    first_block = first_mux0_block(infile, lcHeader.dataStart)
+    blocks = map_blocks(infile, first_block)
+    n_groups = len(blocks) // n_chans
+    if n_groups == 0:
+        raise ValueError(f'{infile} has no complete block group')
+    blocks = blocks[:n_groups * n_chans]
+    sampling_rate = lcHeader.realSampleRate
+    n_samples = n_groups * SAMPLES_PER_BLOCK
+
+    archive = Path(out_dir) / (infile.stem + ARCHIVE_SUFFIX)
+    archive.mkdir(parents=True, exist_ok=True)
+    writers = [_ChannelWriter(archive, i, n_samples, compression)
+               for i in range(n_chans)]
+    starttimes, offsets = [], [0]
+    chunk_len = chunk_blocks * n_chans
+    for i in range(0, len(blocks), chunk_len):
+        chunk = blocks[i:i + chunk_len]
+        starttimes.append(_chunk_starttime(chunk, n_chans, sampling_rate,
+                                           starttimes, offsets))
+        for ch, writer in enumerate(writers):
+            writer.write(channel_samples(chunk, n_chans, ch))
+        offsets.append(offsets[-1] + (len(chunk) // n_chans)
+                       * SAMPLES_PER_BLOCK)
+    for writer in writers:
+        writer.close()
+    np.savez(archive / 'index.npz',
+             starttimes=np.array(starttimes, dtype='datetime64[ms]'),
+             offsets=np.array(offsets, dtype=np.int64))
+    info = dict(format_version=FORMAT_VERSION,
+                source=infile.name,
+                network=network, station=station, obs_type=obs_type,
+                compression=compression,
+                sampling_rate=sampling_rate,
+                n_channels=n_chans,
+                n_samples=n_samples,
+                header={k: v for k, v in vars(lcHeader).items()})
+    with open(archive / 'header.json', 'w') as f:
+        json.dump(info, f, indent=2)
+    if verbose:
+        print(f'{infile.name}: wrote {n_samples} samples x {n_chans} '
+              f'channels in {len(starttimes)} chunks to {archive}')
+    return archive
+
+
+def _chunk_starttime(chunk, n_chans, sampling_rate, starttimes, offsets):
+    """
+    Return the time of a chunk's first sample
+
+    Args:
+        chunk (:class:`numpy.ndarray`): BLOCK_DTYPE array, starting with
+            channel 0
+        n_chans (int): number of channels
+        sampling_rate (float): sampling rate
+        starttimes (list): start times of the previous chunks
+        offsets (list): sample offsets of the previous chunks, and of this
+            one
+    Returns:
+        starttime (:class:`numpy.datetime64`): in ms
+    """
+    times = header_times(chunk[::n_chans])
+    valid = np.flatnonzero(~np.isnat(times))
+    if len(valid):
+        k = int(valid[0])
+        return times[k] - np.timedelta64(
+            int(round(k * SAMPLES_PER_BLOCK * 1000 / sampling_rate)), 'ms')
+    if not starttimes:
+        raise ValueError('No valid block time in the first chunk')
+    return starttimes[-1] + np.timedelta64(
+        int(round((offsets[-1] - offsets[-2]) * 1000 / sampling_rate)), 'ms')
+
+
+class NpyArchive:
+    """
+    Random access by time to an archive written by `convert()`
+    """
+    def __init__(self, path):
+        """
+        Args:
+            path (str or Path): archive directory
+        """
+        self.path = Path(path)
+        with open(self.path / 'header.json', 'r') as f:
+            info = json.load(f)
+        if info['format_version'] != FORMAT_VERSION:
+            raise ValueError(f"{path}: unknown archive format version "
+                             f"{info['format_version']}")
+        self.info = info
+        self.network = info['network']
+        self.station = info['station']
+        self.obs_type = info['obs_type']
+        self.sampling_rate = info['sampling_rate']
+        self.n_channels = info['n_channels']
+        self.compression = info['compression']
+        with np.load(self.path / 'index.npz') as index:
+            self.chunk_starttimes = index['starttimes']
+            self.chunk_offsets = index['offsets']
+        self._chunk_starts = self.chunk_starttimes.astype(np.int64) / 1000.
+        if self.compression == 'none':
+            self._channels = [np.load(self.path / f'ch{i}.npy', mmap_mode='r')
+                              for i in range(self.n_channels)]
+        else:
+            self._channels = [np.load(self.path / f'ch{i}.npz')
+                              for i in range(self.n_channels)]
+
+    def __repr__(self):
+        return (f'NpyArchive("{self.path}") <{self.n_channels} channels, '
+                f'{self.sampling_rate:g} sps, {self.starttime} - '
+                f'{self.endtime}>')
+
+    @property
+    def starttime(self):
+        return UTCDateTime(self._chunk_starts[0])
+
+    @property
+    def endtime(self):
+        """Time of the last sample"""
+        return UTCDateTime(self._chunk_starts[-1]
+                           + (self.chunk_offsets[-1] - self.chunk_offsets[-2]
+                              - 1) / self.sampling_rate)
+
+    def sample_index(self, time):
+        """
+        Return the index of the first sample at or after time
+        """
+        t = float(UTCDateTime(time).timestamp)
+        k = max(np.searchsorted(self._chunk_starts, t, side='right') - 1, 0)
+        chunk_len = self.chunk_offsets[k + 1] - self.chunk_offsets[k]
+        i = np.ceil((t - self._chunk_starts[k]) * self.sampling_rate - 1e-6)
+        return int(self.chunk_offsets[k] + np.clip(i, 0, chunk_len))
+
+    def sample_time(self, index):
+        """
+        Return the time of the sample at index
+        """
+        k = max(np.searchsorted(self.chunk_offsets, index, side='right') - 1,
+                0)
+        k = min(k, len(self._chunk_starts) - 1)
+        return UTCDateTime(self._chunk_starts[k] + (index
+                           - self.chunk_offsets[k]) / self.sampling_rate)
+
+    def get_data(self, starttime=None, endtime=None, channels=None):
+        """
+        Return raw samples between starttime (inclusive) and endtime
+        (exclusive)
+
+        Args:
+            starttime (UTCDateTime, str or number): start time.  If a number,
+                seconds after the archive start.  If None, the archive start
+            endtime (UTCDateTime, str or number): end time.  If a number,
+                seconds after starttime.  If None, the archive end
+            channels (list of int): channels to return (default: all)
+        Returns:
+            (tuple):
+                first_time (:class:`obspy.UTCDateTime`): time of first sample
+                data (:class:`numpy.ndarray`): int32 (n_channels, n_samples)
+        """
+        starttime, endtime = self._time_bounds(starttime, endtime)
+        i0 = self.sample_index(starttime)
+        if endtime is None:
+            i1 = int(self.chunk_offsets[-1])
+        else:
+            i1 = max(self.sample_index(endtime), i0)
+        if channels is None:
+            channels = range(self.n_channels)
+        data = np.empty((len(channels), i1 - i0), dtype=np.int32)
+        for row, ch in enumerate(channels):
+            data[row] = self._channel_slice(ch, i0, i1)
+        return self.sample_time(i0), data
+
+    def read(self, starttime=None, endtime=None):
+        """
+        Read archived data into an obspy stream
+
+        Arguments are as for `get_data()`.  Channel codes and responses are
+        attached as in `lcread.read()`
+
+        Returns:
+            stream (:class:`~obspy.core.stream.Stream`): read data
+        """
+        first_time, data = self.get_data(starttime, endtime)
+        stats = {'sampling_rate': self.sampling_rate,
+                 'starttime': first_time}
+        stream = Stream([Trace(data=d, header=stats) for d in data])
+        return _stuff_info(stream, self.network, self.station, self.obs_type)
+
+    def _time_bounds(self, starttime, endtime):
+        if starttime is None:
+            starttime = self.starttime
+        elif isinstance(starttime, (float, int)):
+            starttime = self.starttime + starttime
+        else:
+            starttime = UTCDateTime(starttime)
+        if isinstance(endtime, (float, int)):
+            endtime = starttime + endtime
+        elif endtime is not None:
+            endtime = UTCDateTime(endtime)
+        return starttime, endtime
+
+    def _channel_slice(self, channel, i0, i1):
+        source = self._channels[channel]
+        if self.compression == 'none':
+            return source[i0:i1]
+        k0 = np.searchsorted(self.chunk_offsets, i0, side='right') - 1
+        k1 = np.searchsorted(self.chunk_offsets, i1, side='left')
+        if k1 <= k0:
+            return np.zeros(0, dtype=np.int32)
+        data = np.concatenate([source[f'c{k:06d}'] for k in range(k0, k1)])
+        return data[i0 - self.chunk_offsets[k0]:i1 - self.chunk_offsets[k0]]
+
+
+def read(path, starttime=None, endtime=None):
+    """
+    Read a NumPy archive into an obspy stream
+
+    Args:
+        path (str or Path): archive directory
+        starttime, endtime: as for `NpyArchive.get_data()`
+    Returns:
+        stream (:class:`~obspy.core.stream.Stream`): read data
+    """
+    return NpyArchive(path).read(starttime, endtime)
+
+
+class _ChannelWriter:
+    """
+    Write one channel's samples, chunk by chunk
+    """
+    def __init__(self, archive, channel, n_samples, compression):
+        self.compression = compression
+        self.n_written = 0
+        self.n_chunks = 0
+        if compression == 'none':
+            self.out = np.lib.format.open_memmap(
+                archive / f'ch{channel}.npy', mode='w+', dtype='<i4',
+                shape=(n_samples,))
+        else:
+            self.out = zipfile.ZipFile(archive / f'ch{channel}.npz', 'w',
+                                       compression=zipfile.ZIP_DEFLATED)
+
+    def write(self, samples):
+        if self.compression == 'none':
+            self.out[self.n_written:self.n_written + len(samples)] = samples
+        else:
+            with self.out.open(f'c{self.n_chunks:06d}.npy', 'w') as f:
+                np.lib.format.write_array(f, samples.astype('<i4'))
+        self.n_written += len(samples)
+        self.n_chunks += 1
+
+    def close(self):
+        if self.compression == 'none':
+            self.out.flush()
+            del self.out
+        else:
+            self.out.close()
+
+
+def main():
+    """
+    Convert LCHEAPO files to NumPy archives ({root}.lcnpy directories)
+
+    The archives can be read with lcheapo.lc2npy.read() or NpyArchive(),
+    much faster than the original LCHEAPO files
+    """
+    parser = argparse.ArgumentParser(
+        description=main.__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_files", nargs='+',
+                        help="Input filename(s).  If there are captured "
+                             "wildcards (put in '' so that they aren't "
+                             "interpreted by the shell), will expand them "
+                             "in the input directory")
+    parser.add_argument("-t", "--obs_type", default='SPOBS2',
+                        help="obs type.  Controls channel and location codes",
+                        choices=[s for s in chan_maps])
+    parser.add_argument("--station", default='SSSSS',
+                        help="station code for this instrument (default=SSSSS)")
+    parser.add_argument("--network", default='XX',
+                        help="network code for this instrument (default=XX)")
+    parser.add_argument("-c", "--compression", default='none',
+                        choices=COMPRESSIONS,
+                        help="chunk compression (default=none, which allows "
+                             "memory-mapping)")
+    parser.add_argument("--chunk_blocks", type=int, default=CHUNK_BLOCKS,
+                        help="blocks per channel in each chunk "
+                             "(default=%(default)s)")
+    parser.add_argument("-d", dest="base_dir", metavar="BASE_DIR",
+                        default='.', help="base directory for files")
+    parser.add_argument("-i", dest="in_dir", metavar="IN_DIR", default='.',
+                        help="input file directory (absolute, " +
+                             "or relative to base_dir)")
+    parser.add_argument("-o", dest="out_dir", metavar="OUT_DIR", default='.',
+                        help="output file directory (absolute, " +
+                             "or relative to base_dir)")
+    parser.add_argument("-v", "--verbose", action='store_true',
+                        help="verbose output")
+    parser.add_argument("--version", action='version',
+                        version='%(prog)s {:s}'.format(__version__))
+    args = parser.parse_args()
+    process_step = ProcessStep('lc2npy',
+                               " ".join(sys.argv),
+                               app_description=__doc__,
+                               app_version=__version__,
+                               parameters=vars(args).copy())
+    args.in_dir, args.out_dir, args.input_files = ProcessStep.setup_paths(args)
+
+    out_files = []
+    return_code = 0
+    for infile in args.input_files:
+        try:
+            archive = convert(Path(args.in_dir) / infile, args.out_dir,
+                              network=args.network, station=args.station,
+                              obs_type=args.obs_type,
+                              chunk_blocks=args.chunk_blocks,
+                              compression=args.compression,
+                              verbose=args.verbose)
+        except ValueError as e:
+            print(f'Could not convert {infile}: {e}')
+            return_code = 2
+            continue
+        out_files.append(archive.name)
+    process_step.output_files = out_files
+    process_step.exit_code = return_code
+    process_step.write(args.in_dir, args.out_dir)
+    sys.exit(return_code)
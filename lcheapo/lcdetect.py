@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+STA/LTA event detection on raw LCHEAPO data
+
+The data are read a chunk at a time (deployment.Deployment.iter_data()) and
+all channels of a chunk are filtered and detected at once, as numpy arrays
+(no obspy Traces).  Filter, STA/LTA and trigger states carry over from one
+chunk to the next, so the results do not depend on the chunk size.  They
+are reset after a gap between files.
+"""
+import argparse
+import csv
+import inspect
+import sys
+from pathlib import Path
+
+import numpy as np
+import scipy.signal as ssig
+from obspy.core.event import (Catalog, Event, Pick, WaveformStreamID,
+                              Comment, CreationInfo)
+from sdpchainpy import ProcessStep
+
+from .deployment import Deployment, CHUNK_BLOCKS
+from .instrument_metadata import chan_maps
+from .version import __version__
+from . import profiling
+
+METHODS = ('recursive', 'classic')
+CSV_FIELDS = ('seed_id', 'on_time', 'off_time', 'duration_s', 'peak_ratio')
+
+
+class StaLta:
+    """
+    STA/LTA characteristic function of multichannel data, chunk by chunk
+
+    'recursive' is obspy's recursive_sta_lta() (exponentially-weighted
+    averages), 'classic' is classic_sta_lta() (moving averages of the
+    signal energy).  The ratio is 0 for the first lta seconds
+    """
+    def __init__(self, n_chans, sampling_rate, sta=1., lta=10.,
+                 method='recursive', freqmin=None, freqmax=None):
+        """
+        Args:
+            n_chans (int): number of channels
+            sampling_rate (float): sampling rate (sps)
+            sta (float): short-term average length (s)
+            lta (float): long-term average length (s)
+            method (str): 'recursive' or 'classic'
+            freqmin (float): high-pass (or band-pass) corner (Hz)
+            freqmax (float): low-pass (or band-pass) corner (Hz)
+        """
+        if method not in METHODS:
+            raise ValueError(f'{method=} not in {METHODS}')
+        self.n_chans = n_chans
+        self.nsta = max(int(round(sta * sampling_rate)), 1)
+        self.nlta = max(int(round(lta * sampling_rate)), self.nsta + 1)
+        self.method = method
+        self.sos = _filter_sos(sampling_rate, freqmin, freqmax)
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the previous data (start again from zero)
+        """
+        self._warmup = self.nlta
+        if self.sos is not None:
+            self._zi = np.zeros((len(self.sos), self.n_chans, 2))
+        if self.method == 'recursive':
+            self._zi_sta = np.zeros((self.n_chans, 1))
+            self._zi_lta = np.zeros((self.n_chans, 1))
+        else:
+            self._tail = np.zeros((self.n_chans, self.nlta - 1))
+
+    def process(self, data):
+        """
+        Return the STA/LTA ratio of the next chunk
+
+        Args:
+            data (:class:`numpy.ndarray`): (n_chans, n_samples) samples
+        Returns:
+            ratio (:class:`numpy.ndarray`): (n_chans, n_samples)
+        """
+        x = data.astype(np.float64)
+        if self.sos is not None:
+            x, self._zi = ssig.sosfilt(self.sos, x, axis=-1, zi=self._zi)
+        energy = x * x
+        if self.method == 'recursive':
+            c_sta, c_lta = 1. / self.nsta, 1. / self.nlta
+            sta, self._zi_sta = ssig.lfilter([c_sta], [1, c_sta - 1], energy,
+                                             axis=-1, zi=self._zi_sta)
+            lta, self._zi_lta = ssig.lfilter([c_lta], [1, c_lta - 1], energy,
+                                             axis=-1, zi=self._zi_lta)
+        else:
+            e = np.concatenate([self._tail, energy], axis=1)
+            c = np.zeros((self.n_chans, e.shape[1] + 1))
+            np.cumsum(e, axis=1, out=c[:, 1:])
+            end = c[:, self.nlta:]
+            sta = (end - c[:, self.nlta - self.nsta:-self.nsta]) / self.nsta
+            lta = (end - c[:, :-self.nlta]) / self.nlta
+            self._tail = e[:, e.shape[1] - self.nlta + 1:]
+        ratio = np.divide(sta, lta, out=np.zeros_like(sta), where=lta > 0)
+        if self._warmup:
+            n = min(self._warmup, ratio.shape[1])
+            ratio[:, :n] = 0.
+            self._warmup -= n
+        return ratio
+
+
+class Trigger:
+    """
+    On/off triggering of STA/LTA ratios, chunk by chunk
+
+    A channel triggers when its ratio rises above `on` and stops when it
+    falls below `off`
+    """
+    def __init__(self, n_chans, on=3.5, off=1.):
+        self.on = on
+        self.off = off
+        self._on = [None] * n_chans  # sample index of the open triggers
+        self._peak = [0.] * n_chans
+
+    def process(self, ratio, first):
+        """
+        Return the triggers that end in this chunk
+
+        Args:
+            ratio (:class:`numpy.ndarray`): (n_chans, n_samples) ratios
+            first (int): sample index of ratio[:, 0]
+        Returns:
+            triggers (list): (channel, on index, off index, peak ratio)
+        """
+        triggers = []
+        for ch, r in enumerate(ratio):
+            pos = 0
+            while pos < len(r):
+                if self._on[ch] is None:
+                    above = np.flatnonzero(r[pos:] > self.on)
+                    if len(above) == 0:
+                        break
+                    pos += int(above[0])
+                    self._on[ch], self._peak[ch] = first + pos, 0.
+                below = np.flatnonzero(r[pos:] < self.off)
+                end = pos + int(below[0]) if len(below) else len(r)
+                if end > pos:
+                    self._peak[ch] = max(self._peak[ch],
+                                         float(r[pos:end].max()))
+                if len(below) == 0:
+                    break
+                triggers.append((ch, self._on[ch], first + end,
+                                 self._peak[ch]))
+                self._on[ch] = None
+                pos = end
+        return triggers
+
+    def flush(self, last):
+        """
+        Close the open triggers at sample index last
+
+        Returns:
+            triggers (list): (channel, on index, off index, peak ratio)
+        """
+        triggers = [(ch, on, last, self._peak[ch])
+                    for ch, on in enumerate(self._on) if on is not None]
+        self._on = [None] * len(self._on)
+        return triggers
+
+
+def detect(deployment, sta=1., lta=10., on=3.5, off=1., method='recursive',
+           freqmin=None, freqmax=None, channels=None, starttime=None,
+           endtime=None, chunk_blocks=CHUNK_BLOCKS):
+    """
+    Run an STA/LTA detector on a deployment
+
+    Args:
+        deployment (:class:`lcheapo.deployment.Deployment`): data
+        sta, lta, method, freqmin, freqmax: see `StaLta`
+        on, off: see `Trigger`
+        channels (list of int): channels to process (default: all)
+        starttime, endtime: as for `Deployment.get_data()`
+        chunk_blocks (int): blocks per channel processed at a time
+    Returns:
+        triggers (list of dict): seed_id, on_time, off_time, duration_s
+            and peak_ratio of each trigger, by on_time
+    """
+    if channels is None:
+        channels = list(range(deployment.n_channels))
+    seed_ids = deployment.seed_ids
+    ids = [seed_ids[c] for c in channels]
+    sr = deployment.sampling_rate
+    stalta = StaLta(len(channels), sr, sta, lta, method, freqmin, freqmax)
+    trigger = Trigger(len(channels), on, off)
+    found, end = [], None
+    for first, data in deployment.iter_data(starttime, endtime, chunk_blocks,
+                                            channels):
+        if end is not None and abs(deployment.sample_time(first)
+                                   - deployment.sample_time(end - 1)
+                                   - 1 / sr) > 0.5 / sr:
+            # Gap between files
+            found.extend(trigger.flush(end - 1))
+            stalta.reset()
+        with profiling.stage('detect', data.nbytes):
+            found.extend(trigger.process(stalta.process(data), first))
+        end = first + data.shape[1]
+    if end is not None:
+        found.extend(trigger.flush(end - 1))
+    triggers = []
+    for ch, i_on, i_off, peak in found:
+        on_time = deployment.sample_time(i_on)
+        off_time = deployment.sample_time(i_off)
+        triggers.append(dict(seed_id=ids[ch], on_time=on_time,
+                             off_time=off_time,
+                             duration_s=off_time - on_time, peak_ratio=peak))
+    return sorted(triggers, key=lambda t: t['on_time'])
+
+
+def coincidence(triggers, min_channels=2):
+    """
+    Group overlapping triggers into events
+
+    Args:
+        triggers (list of dict): output of `detect()`
+        min_channels (int): minimum number of channels in an event
+    Returns:
+        events (list of lists): triggers of each event
+    """
+    events, current, current_off = [], [], None
+    for t in triggers:
+        if current and t['on_time'] > current_off:
+            events.append(current)
+            current = []
+        if not current:
+            current_off = t['off_time']
+        current.append(t)
+        current_off = max(current_off, t['off_time'])
+    if current:
+        events.append(current)
+    return [e for e in events
+            if len({t['seed_id'] for t in e}) >= min_channels]
+
+
+def write_csv(triggers, filename):
+    """
+    Write triggers to a CSV file
+    """
+    with open(filename, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+        for t in triggers:
+            writer.writerow({**t, 'on_time': str(t['on_time']),
+                             'off_time': str(t['off_time']),
+                             'duration_s': f"{t['duration_s']:.3f}",
+                             'peak_ratio': f"{t['peak_ratio']:.2f}"})
+
+
+def write_quakeml(events, filename):
+    """
+    Write events as QuakeML: one Event per event, one Pick per trigger
+
+    Args:
+        events (list of lists): triggers of each event (see
+            `coincidence()`)
+    """
+    catalog = Catalog(creation_info=CreationInfo(
+        author=f'lcdetect {__version__}'))
+    for triggers in events:
+        event = Event(event_type='not reported')
+        for t in triggers:
+            net, sta, loc, cha = t['seed_id'].split('.')
+            event.picks.append(Pick(
+                time=t['on_time'], evaluation_mode='automatic',
+                waveform_id=WaveformStreamID(net, sta, loc, cha),
+                comments=[Comment(
+                    text=f"duration={t['duration_s']:.3f}s, "
+                         f"peak_ratio={t['peak_ratio']:.2f}")]))
+        catalog.events.append(event)
+    catalog.write(str(filename), format='QUAKEML')
+
+
+@profiling.profile_main
+def main():
+    """
+    Detect events in LCHEAPO data with an STA/LTA detector
+
+    The input files are read as one deployment (the first file, or the one
+    with '.header.' in its name, has the header).  Writes the triggers to
+    {root}.triggers.csv and the events (triggers on at least --coincidence
+    channels) to {root}.events.xml (QuakeML)
+    """
+    args, process_step = _get_args()
+    deployment = Deployment([Path(args.in_dir) / f for f in args.input_files],
+                            args.network, args.station, args.obs_type)
+    channels = args.channels
+    if channels is not None:
+        channels = [i for i, s in enumerate(deployment.seed_ids)
+                    if s.split('.')[-1] in channels]
+    triggers = detect(deployment, args.sta, args.lta, args.on, args.off,
+                      args.method, args.freqmin, args.freqmax, channels,
+                      args.starttime, args.endtime, args.chunk_blocks)
+    events = coincidence(triggers, args.coincidence)
+    root = Path(args.out_dir) / Path(args.input_files[0]).name.split('.')[0]
+    root.parent.mkdir(parents=True, exist_ok=True)
+    out_files = [root.name + '.triggers.csv', root.name + '.events.xml']
+    write_csv(triggers, root.parent / out_files[0])
+    write_quakeml(events, root.parent / out_files[1])
+    if args.verbose:
+        print(f'{deployment}: {len(triggers)} triggers, {len(events)} events')
+    process_step.output_files = out_files
+    process_step.exit_code = 0
+    process_step.write(args.in_dir, args.out_dir)
+    return 0
+
+
+def _get_args():
+    parser = argparse.ArgumentParser(
+        description=inspect.cleandoc(main.__doc__),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_files", nargs='+',
+                        help="Input filename(s), in recording order")
+    parser.add_argument("-t", "--obs_type", default='SPOBS2',
+                        help="obs type.  Controls channel and location codes",
+                        choices=[s for s in chan_maps])
+    parser.add_argument("--station", default='SSSSS',
+                        help="station code for this instrument "
+                             "(default=SSSSS)")
+    parser.add_argument("--network", default='XX',
+                        help="network code for this instrument (default=XX)")
+    parser.add_argument("--channels", nargs='+', metavar='CHAN',
+                        help="SEED channel codes to process (default: all)")
+    parser.add_argument("-s", "--start", dest="starttime", default=None,
+                        help="start time (ISO8601) (default: data start)")
+    parser.add_argument("-e", "--end", dest="endtime", default=None,
+                        help="end time (ISO8601) (default: data end)")
+    parser.add_argument("-m", "--method", default='recursive',
+                        choices=METHODS,
+                        help="STA/LTA method (default=%(default)s)")
+    parser.add_argument("--sta", type=float, default=1.,
+                        help="short-term average length in seconds "
+                             "(default=%(default)s)")
+    parser.add_argument("--lta", type=float, default=10.,
+                        help="long-term average length in seconds "
+                             "(default=%(default)s)")
+    parser.add_argument("--on", type=float, default=3.5,
+                        help="trigger-on STA/LTA ratio (default=%(default)s)")
+    parser.add_argument("--off", type=float, default=1.,
+                        help="trigger-off STA/LTA ratio (default=%(default)s)")
+    parser.add_argument("--freqmin", type=float,
+                        help="high-pass corner frequency (Hz)")
+    parser.add_argument("--freqmax", type=float,
+                        help="low-pass corner frequency (Hz)")
+    parser.add_argument("-c", "--coincidence", type=int, default=1,
+                        help="minimum number of triggered channels in an "
+                             "event (default=%(default)s)")
+    parser.add_argument("--chunk_blocks", type=int, default=CHUNK_BLOCKS,
+                        help="blocks per channel processed at a time "
+                             "(default=%(default)s)")
+    parser.add_argument("-d", dest="base_dir", metavar="BASE_DIR",
+                        default='.', help="base directory for files")
+    parser.add_argument("-i", dest="in_dir", metavar="IN_DIR", default='.',
+                        help="input file directory (absolute, " +
+                             "or relative to base_dir)")
+    parser.add_argument("-o", dest="out_dir", metavar="OUT_DIR", default='.',
+                        help="output file directory (absolute, " +
+                             "or relative to base_dir)")
+    parser.add_argument("-v", "--verbose", action='store_true',
+                        help="verbose output")
+    parser.add_argument("--version", action='version',
+                        version='%(prog)s {:s}'.format(__version__))
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    profiling.start(args)
+    process_step = ProcessStep('lcdetect',
+                               " ".join(sys.argv),
+                               app_description=__doc__,
+                               app_version=__version__,
+                               parameters=vars(args).copy())
+    args.in_dir, args.out_dir, args.input_files = ProcessStep.setup_paths(args)
+    return args, process_step
+
+
+def _filter_sos(sampling_rate, freqmin, freqmax, corners=4):
+    """
+    Return the Butterworth filter (second-order sections), or None
+    """
+    nyquist = sampling_rate / 2
+    if freqmax is not None and freqmax >= nyquist:
+        freqmax = None
+    if freqmin and freqmax:
+        return ssig.butter(corners, [freqmin, freqmax], 'bandpass',
+                           fs=sampling_rate, output='sos')
+    if freqmin:
+        return ssig.butter(corners, freqmin, 'highpass', fs=sampling_rate,
+                           output='sos')
+    if freqmax:
+        return ssig.butter(corners, freqmax, 'lowpass', fs=sampling_rate,
+                           output='sos')
+    return None
@@ -2,27 +2,49 @@
 # -*- coding: utf-8 -*-
 """
 Dump record information from an LCHEAPO file
+
+Headers are scanned in bulk (numpy structured arrays) and formatted a chunk
+at a time, so that large dumps take seconds.  They can also be exported to
+a CSV or .npy file.
 """
 from pathlib import Path
 
 import sys
 import argparse
-import datetime as dt
 
-from .lcheapo_utils import (LCDiskHeader, LCDirEntry, LCDataBlock)
+import numpy as np
+
+from .lcheapo_utils import (LCDiskHeader, LCDirEntry)
+from .lcscan import (map_blocks, headers_of, header_times, HEADER_DTYPE,
+                     CHUNK_BLOCKS)
 
 
 # ------------------------------------
 # Global Variable Declarations
 # ------------------------------------
 PROGRAM_NAME = "lcdump"
-VERSION = "0.2.3"
+VERSION = "0.3"
 version_notes = """
     v0.2 (2015/01): WCC added format options
     v0.2.1 (2017/01): WCC added possibility to compare time with theoretical
     v0.2.2 (2017/03): WCC added directory printing
     v0.2.3 (2017/03): Added "--from_end" option
+    v0.3 (2026/10): Bulk header scans, "--export" option, format 3 uses the
+                    real number of channels
     """
+# Same output as LCDataBlock.prettyPrintHeader() and
+# LCDataBlock.printDecimalDumpOfHeader(True), preceded by the block number
+PRETTY_FMT = ("%8d: %02d/%02d/%02d-%02d:%02d:%02d.%03d"
+              "  F%03d CH%02d %4d samps U1=%03d U2=%03d")
+PRETTY_FIELDS = ('year', 'month', 'day', 'hour', 'minute', 'second', 'msec',
+                 'blockFlag', 'muxChannel', 'numberOfSamples', 'U1', 'U2')
+DECIMAL_FMT = ("%8d: ms:%4d s:%02d mn:%02d hr:%02d dy:%02d mo:%02d yr:%02d"
+               " Flag:%03d Chan:%02d Samples:%4d")
+DECIMAL_FIELDS = ('msec', 'second', 'minute', 'hour', 'day', 'month', 'year',
+                  'blockFlag', 'muxChannel', 'numberOfSamples')
+TIME_VERIFY_FMT = "%8d: %2d | %s | %s | %8.3f"
+EXPORT_DTYPE = np.dtype([('block', '<i8'), ('time', '<M8[ms]')]
+                        + HEADER_DTYPE.descr)
 
 
 def getOptions():
@@ -47,6 +69,9 @@ def getOptions():
                         choices=[0, 1, 2, 3],
                         help="Output format: 0=pretty [default], 1=decimal,\
                         2=hex, 3=time_verify")
+    parser.add_argument("-x", "--export", metavar="FILE", default=None,
+                        help="write the block headers to FILE (.csv or .npy) "
+                             "instead of printing them")
     args = parser.parse_args()
 
     # Get the filename (the arguments)
@@ -88,61 +113,141 @@ def main():
         firstBlock = lcHeader.dataStart
         if firstBlock == 0:   # normal start block
             firstBlock = 2393
-        lcStartData = LCDataBlock()
-        lcStartData.seekBlock(fp, firstBlock)
-        lcStartData.readBlock(fp)
-        firstTime = dt.datetime(lcStartData.year+2000,
-                                lcStartData.month,
-                                lcStartData.day,
-                                lcStartData.hour,
-                                lcStartData.minute,
-                                lcStartData.second,
-                                lcStartData.msec*1000)
-        print("First block = {:d}: Time = {} ".format(firstBlock,
-              firstTime.strftime('%Y/%m/%d-%H:%M:%S.%f')[:-3]))
+        firstTime = header_times(map_blocks(fp, firstBlock, 1))[0]
+        print("First block = {:d}: Time = {} ".format(
+              firstBlock, _time_strings(firstTime)[0]))
         sampRate = lcHeader.realSampleRate
         if sampRate == 0:
             sampRate = 62.5
             print("Sample rate not in directory header, assuming 62.5")
+        nChans = getattr(lcHeader, 'numberOfChannels', 0)
+        if nChans not in (1, 2, 4, 8):
+            nChans = 4
+            print("Number of channels not in disk header, assuming 4")
         print(" {:>7s}: {:^2s} | {:^23s} | {:^23s} | {:>8s} ".format(
               "BLOCK", "CH", "EXPECTED TIME", "FOUND TIME", "DELTA"))
         print("-{:->7s}:-{:-^2s}-|-{:-^23s}-|-{:-^23s}-|-{:->8s}-".format(
               "-", "-", "-", "-", "-"))
 
-    block = args.startBlock
-    lcData = LCDataBlock()
-    lcData.seekBlock(fp, block)
-
-    for i in range(0, args.nBlocks):
-        lcData.readBlock(fp)
-        print("{:8d}:".format(args.startBlock + i), end=' ')
+    blocks = map_blocks(fp, args.startBlock, args.nBlocks)
+    if args.export:
+        export_headers(blocks, args.startBlock, args.export)
+        return
+    out = sys.stdout
+    for i in range(0, len(blocks), CHUNK_BLOCKS):
+        chunk = blocks[i:i + CHUNK_BLOCKS]
+        block_nums = args.startBlock + i + np.arange(len(chunk))
         if args.format == 3:
-            time = dt.datetime(lcData.year + 2000,
-                               lcData.month,
-                               lcData.day,
-                               lcData.hour,
-                               lcData.minute,
-                               lcData.second,
-                               lcData.msec * 1000)
-            rec_offset = int((args.startBlock + i - firstBlock) / 4)
-            calcTime = firstTime + dt.timedelta(
-                       seconds=rec_offset*lcData.numberOfSamples/sampRate)
-            print("{:2d} | {} | {} | {:8.3f}".format(
-                lcData.muxChannel,
-                calcTime.strftime('%Y/%m/%d-%H:%M:%S.%f')[:-3],
-                time.strftime('%Y/%m/%d-%H:%M:%S.%f')[:-3],
-                (time-calcTime).total_seconds())
-            )
+            _write_time_verify(out, headers_of(chunk), block_nums,
+                               firstBlock, firstTime, sampRate, nChans)
         elif args.format == 1:
-            lcData.printDecimalDumpOfHeader(True)
+            _write_lines(out, DECIMAL_FMT, block_nums, headers_of(chunk),
+                         DECIMAL_FIELDS)
         elif args.format == 2:
-            lcData.printHexDumpOfData()
+            _write_hex_data(out, chunk, block_nums)
         elif args.format == 0:
-            lcData.prettyPrintHeader()
+            _write_lines(out, PRETTY_FMT, block_nums, headers_of(chunk),
+                         PRETTY_FIELDS)
         else:
             print("ERROR! Shouldn't get here!")
 
 
+def export_headers(blocks, first_block, filename):
+    """
+    Write block headers to a CSV or .npy file
+
+    Args:
+        blocks (:class:`numpy.ndarray`): BLOCK_DTYPE array
+        first_block (int): block number of blocks[0]
+        filename (str or Path): output file.  A '.npy' suffix writes an
+            EXPORT_DTYPE structured array, anything else writes CSV
+    """
+    filename = Path(filename)
+    if filename.suffix == '.npy':
+        out = np.lib.format.open_memmap(filename, mode='w+',
+                                        dtype=EXPORT_DTYPE,
+                                        shape=(len(blocks),))
+        for i in range(0, len(blocks), CHUNK_BLOCKS):
+            chunk = blocks[i:i + CHUNK_BLOCKS]
+            rows = out[i:i + len(chunk)]
+            rows['block'] = first_block + i + np.arange(len(chunk))
+            rows['time'] = header_times(chunk)
+            for name in HEADER_DTYPE.names:
+                rows[name] = chunk[name]
+        out.flush()
+        del out
+        return
+    with open(filename, 'w') as fp:
+        fp.write(','.join(EXPORT_DTYPE.names) + '\n')
+        for i in range(0, len(blocks), CHUNK_BLOCKS):
+            chunk = blocks[i:i + CHUNK_BLOCKS]
+            times = np.datetime_as_string(header_times(chunk), unit='ms')
+            columns = [first_block + i + np.arange(len(chunk)), times]
+            columns += [chunk[name] for name in HEADER_DTYPE.names]
+            fp.writelines(
+                ','.join(str(x) for x in row) + '\n'
+                for row in zip(*[c.tolist() for c in columns]))
+
+
+def _write_lines(out, fmt, block_nums, headers, fields):
+    """
+    Write one formatted line per header
+
+    Args:
+        out (file-like): output stream
+        fmt (str): %-format, with the block number as the first field
+        block_nums (:class:`numpy.ndarray`): block numbers
+        headers (:class:`numpy.ndarray`): HEADER_DTYPE array
+        fields (list of str): header fields corresponding to the rest of fmt
+    """
+    columns = [block_nums.tolist()] + [headers[f].tolist() for f in fields]
+    out.writelines([fmt % row + '\n' for row in zip(*columns)])
+
+
+def _write_time_verify(out, headers, block_nums, firstBlock, firstTime,
+                       sampRate, nChans):
+    """
+    Write block times compared to those expected from the first block's time
+    """
+    rec_offset = np.trunc((block_nums - firstBlock) / nChans)
+    offset_us = np.round(rec_offset * headers['numberOfSamples'] / sampRate
+                         * 1e6).astype(np.int64)
+    calcTime = firstTime.astype('M8[us]') + offset_us.astype('m8[us]')
+    time = header_times(headers)
+    delta = (time.astype('M8[us]') - calcTime) / np.timedelta64(1, 's')
+    out.writelines([
+        TIME_VERIFY_FMT % row + '\n'
+        for row in zip(block_nums.tolist(), headers['muxChannel'].tolist(),
+                       _time_strings(calcTime).tolist(),
+                       _time_strings(time).tolist(), delta.tolist())])
+
+
+def _write_hex_data(out, blocks, block_nums):
+    """
+    Write hex dumps of block data, as LCDataBlock.printHexDumpOfData()
+
+    Two-byte groups separated by 2 spaces, 16 groups per line
+    """
+    for block_num, data in zip(block_nums.tolist(), blocks['data']):
+        hexa = data.tobytes().hex()
+        groups = [hexa[j:j + 4] + '  ' for j in range(0, len(hexa), 4)]
+        lines = [''.join(groups[j:j + 16]) for j in range(0, len(groups), 16)]
+        out.write('{:8d}: '.format(block_num) + '\n'.join(lines) + '\n')
+
+
+def _time_strings(times):
+    """
+    Format datetime64 values as "YYYY/mm/dd-HH:MM:SS.fff" ("NaT" if invalid)
+    """
+    times = np.atleast_1d(times).astype('M8[ms]')
+    s = np.datetime_as_string(times, unit='ms').astype('U23')
+    chars = s.view(np.uint32).reshape(-1, 23)
+    valid = ~np.isnat(times)
+    chars[valid, 4] = chars[valid, 7] = ord('/')
+    chars[valid, 10] = ord('-')
+    return s
+
+
 # Run 'main' if the script is not imported as a module
 if __name__ == '__main__':
     main()
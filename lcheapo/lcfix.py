@@ -12,20 +12,30 @@ import queue
 import os
 import textwrap
 import logging      # for logging information
-from datetime import timedelta
+from datetime import datetime, timedelta
 from pathlib import Path
 
+import numpy as np
 from sdpchainpy import ProcessStep
 from progress.bar import IncrementalBar
 
-from .lcheapo_utils import (LCDataBlock, LCDiskHeader, LCDirEntry)
+from .lcheapo_utils import (LCDataBlock, LCDiskHeader, BLOCK_SIZE)
+from .lcscan import (DIR_ENTRY_DTYPE, read_directory, header_times,
+                     set_times)
 # from .sdpchain import ProcessStep
 from .version import __version__
+from . import profiling
 
 # ------------------------------------
 # Global Variable Declarations
 # ------------------------------------
 warnings = 0  # count # of warnings
+lcDir = None  # last directory entry written, template for created entries
+# LCHEAPO DIRECTORY ENTRIES ARE EVERY 14336 blocks BY DEFAULT
+DIRBLOCKS = 14336
+BAD_DIRBLOCKS = 16384
+# Time given to directory entries pointing to blocks that were not written
+BOGUS_TIME = datetime(1900, 1, 1)
 
 
 class BugCounters():
@@ -88,6 +98,7 @@ class BugCounters():
         return "\n".join(lines)
 
 
+@profiling.profile_main
 def main():
     global warnings
     # Prepare variables
@@ -244,7 +255,9 @@ def _get_options():
                         help="Force timetags to be consecutive (USE ONLY IF"
                              "YOU HAVE TIME TEARS AND YOU ARE SURE THE DATA"
                              "ARE, IN FACT, CONSECUTIVE)")
+    profiling.add_arguments(parser)
     args = parser.parse_args()
+    profiling.start(args)
     global process_step
     process_step = ProcessStep(
         'lcfix',
@@ -356,7 +369,8 @@ def __findFirstMux0Block(firstBlock, ifp1):
 def __readLCHeader(ifp1):
     lcHeader = LCDiskHeader()
     lcHeader.seekHeaderPosition(ifp1)
-    lcHeader.readHeader(ifp1)
+    with profiling.stage('header_read', BLOCK_SIZE):
+        lcHeader.readHeader(ifp1)
     # firstInpBlock = lcHeader.dataStart
     return (lcHeader, lcHeader.dataStart)
 
@@ -461,7 +475,7 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
         (tuple): counters, message, fname_timetears
     """
     # Declare variables
-    global startBUG1A, printHeader, lcDir, warnings
+    global startBUG1A, printHeader, warnings
     i = 0
     counters = BugCounters()
     lastBUG1s = [0, 0, 0, 0]
@@ -475,8 +489,8 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
     consecIdentTimeErrors, oldDiff = 0, 0
     lcData = LCDataBlock()
 
+    outfilename = outFileRoot + ".fix.lch"
     if not args.dryrun:
-        outfilename = outFileRoot + ".fix.lch"
         if os.path.exists(outfilename):
             print(f"output file {outfilename} exists already! Quitting")
             sys.exit(2)
@@ -496,6 +510,26 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
     if __stopProcess(commandQ):
         return
 
+    # -----------------------------
+    # Lay out the output directory.  The times of the blocks it points to
+    # are recorded during the block loop
+    # -----------------------------
+    if hasHeader:
+        lastOutBlock = lastInpBlock
+        with profiling.stage('directory_read') as timer:
+            inDir = read_directory(ifp1, lcHeader.dirStart,
+                                   lcHeader.dirCount)
+            timer.nbytes = inDir.nbytes
+    else:
+        lastOutBlock = lastInpBlock - firstInpBlock + lcHeader.dataStart
+        inDir = np.zeros(0, dtype=DIR_ENTRY_DTYPE)
+    outOffset = lastOutBlock - lastInpBlock
+    dirEntries, nDir, origDirTimes, dirNotes, counters.bug3 = \
+        _plan_directory(inDir, lcHeader, lastOutBlock, hasHeader)
+    dirIndex = {b: k for k, b in
+                enumerate(dirEntries['blockNumber'][:nDir].tolist())}
+    dirTimes = np.full(nDir, BOGUS_TIME, dtype='datetime64[ms]')
+
     blockTime = int((166 * (1.0 / lcHeader.realSampleRate)) * 1000)
     blockTimeDelta = t = timedelta(0, 0, 0, blockTime, 0, 0)
 
@@ -529,12 +563,17 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
 
     bar = IncrementalBar(f'Processing {fname}', index=firstInpBlock,
                          max=lastInpBlock)
+    read_block = profiling.instrument('block_read', lcData.readBlock,
+                                      BLOCK_SIZE)
+    write_block = profiling.instrument('file_write', lcData.writeBlock,
+                                       BLOCK_SIZE)
+    block_time = profiling.instrument('decode', lcData.getDateTime, 8)
     # Loop over blocks, comparing expected and actual times.
     for i in range(firstInpBlock, lastInpBlock+1):
         bar.next()
         if debug and (i > lastInpBlock-10):
             logging.info("  BLOCK {:d}".format(i))
-        lcData.readBlock(ifp1)
+        read_block(ifp1)
         if debug and (i > lastInpBlock - 10):
             logging.info("  READ")
         currBlock = int(ifp1.tell() / 512) - 1
@@ -556,7 +595,7 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
         # Handle bad chan numbers without crashing
         # iCh = lcData.muxChannel % lcHeader.numberOfChannels
         expect_time = lastTime[lcData.muxChannel] + blockTimeDelta
-        t = lcData.getDateTime()
+        t = block_time()
         diff = abs(_to_msec(t - expect_time))
         if diff:
             if args.forceTime or (i > lastInpBlock
@@ -682,9 +721,13 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
                 logging.info(forceTimeErrorStr +
                              "{:d} blocks".format(consecIdentTimeErrors))
                 consecIdentTimeErrors = 0
+        # Record the time of blocks pointed to by the directory
+        iDir = dirIndex.get(i + outOffset)
+        if iDir is not None:
+            dirTimes[iDir] = lcData.getDateTime()
         # Write out the block of data and report status (if necessary)
         if not args.dryrun:
-            lcData.writeBlock(ofp1)
+            write_block(ofp1)
         if (i % 5000 == 0):
             if __stopProcess(commandQ):
                 return
@@ -706,117 +749,16 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
         responseQ.put((i, lastInpBlock, counters.bug1, counters.time_tear))
 
     # ----------------------------------------------------------------------
-    # Copy over the directory entries and modify the block time to correspond
-    # to the actual time in the data block.
+    # Write the directory entries, with the times of the blocks they point to
     # ----------------------------------------------------------------------
-
-    # Open the output datafile for reading
-    if not args.dryrun:
-        ofp_data = open(outfilename, 'rb')  # generally the output file
-    else:
-        # if no output file, read block data from input file
-        ofp_data = open(fname, 'rb')
-    lcData2 = LCDataBlock()
-
-    # Point input and output file ptrs to the directory
-    # (reads one, updates the other?)
-    if hasHeader:  # In input file
-        lcDir = LCDirEntry()
-        lcDir.seekBlock(ifp1, lcHeader.dirStart)
-    if not args.dryrun:  # In output file
-        lcDir.seekBlock(ofp1, lcHeader.dirStart)
-
-    # Copy directory but change  time to correspond to that in the data block.
-    # ifp1 points to the start of the input file's directory
-    # ofp1 points to the start of the output file's directory
-    # ofp_data points to the output file's data block.
     if verbosity:
         if hasHeader:
             logging.info("  COPYING/CORRECTING DIRECTORY")
         else:
             logging.info("  CREATING DIRECTORY")
-        logging.info("   {:4s} | {:9s} | {:26s} | {:28s} | {}".format(
-            "DIR#", "BLOCK#", "ORIG DIRTIME", "NEW DIRTIME (BLOCKTIME)",
-            "DIFF (SECS)"))
-        logging.info("   {:-<5s}|{:-<11s}|{:-<28s}|{:-<30s}|{:-<10s}".format(
-                     "", "", "", "", ""))
-    iDir = 0
-    if hasHeader:
-        lastOutBlock = lastInpBlock
-    else:
-        lastOutBlock = lastInpBlock + lcHeader.dataStart
-    # LCHEAPO DIRECTORY ENTRIES ARE EVERY 14336 blocks BY DEFAULT
-    DIRBLOCKS = 14336
-    BAD_DIRBLOCKS = 16384
-    # Loop through the directory
-    while True:
-        # If the input file had a directory, read in the next entry
-        # (or add one if we're beyond original end)
-        if hasHeader:
-            if iDir < lcHeader.dirCount:
-                lcDir.readDirEntry(ifp1)
-                origDirTime = lcDir.getDateTime()
-                if not lcDir.numBlocks == DIRBLOCKS:
-                    if lcDir.numBlocks == BAD_DIRBLOCKS:
-                        lcDir.numBlocks = DIRBLOCKS
-                        counters.bug3 += 1
-                    else:
-                        fmt = "DIR{:10d}: Expected {:d} blocks, found {:d}"
-                        logging.info(fmt.format(iDir, DIRBLOCKS,
-                                                lcDir.numBlocks))
-            else:
-                nextDirBlock = lcDir.blockNumber + lcDir.numBlocks
-                if iDir <= lcHeader.dirSize and nextDirBlock <= lastOutBlock:
-                    # ADD DIRECTORY ENTRIES
-                    lcDir.blockNumber += lcDir.numBlocks
-                    origDirTime = 'None'
-                else:
-                    break
-        # If it did not have a directory, make up the next entry
-        else:
-            lcDir.numBlocks = DIRBLOCKS
-            nextDirBlock = lcHeader.dataStart + iDir * lcDir.numBlocks
-            if iDir < lcHeader.dirSize and nextDirBlock <= lastOutBlock:
-                lcDir.blockNumber = nextDirBlock
-                origDirTime = 'None'
-            else:
-                break
-        verboselogtext = "   {:4d} | {:9d} | {:26s} |".format(
-            iDir + 1, lcDir.blockNumber, origDirTime)
-        # Jump out if directory start block number is beyond end of file
-        if lcDir.blockNumber > lastOutBlock:
-            if verbosity:
-                logging.info(verboselogtext)
-            break
-
-        # Put start time of block pointed to by the directory entry into the
-        # directory entry
-        # ofp_data has a header unless dryrun on a headerless file
-        if hasHeader or not args.dryrun:
-            lcData2.seekBlock(ofp_data, lcDir.blockNumber)
-        else:  # ofp_data is headerless
-            lcData2.seekBlock(ofp_data, lcDir.blockNumber - lcHeader.dataStart)
-        lcData2.readBlock(ofp_data)
-        blockTime = lcData2.getDateTime()
-        if verbosity:
-            if hasHeader:  # Compare directory times to block times
-                diff = abs(_to_msec(blockTime - lcDir.getDateTime()))
-                logging.info(verboselogtext + "   {:26s} | {:14.1f}".format(
-                             str(blockTime), diff/1000))
-            else:
-                logging.info(verboselogtext + "   {:26s} | {:<14s}".format(
-                             str(blockTime), "N/A"))
-        lcDir.changeTime(blockTime)
-        # If directory entry goes beyond end of data, write and break out
-        if lcDir.blockNumber + lcDir.numBlocks >= lastOutBlock:
-            lcDir.numBlocks = lastOutBlock - lcDir.blockNumber + 1
-            if not args.dryrun:
-                lcDir.writeDirEntry(ofp1)
-            iDir += 1
-            break
-        if not args.dryrun:
-            lcDir.writeDirEntry(ofp1)
-        iDir += 1
+    _write_directory(None if args.dryrun else ofp1, dirEntries, nDir,
+                     origDirTimes, dirNotes, dirTimes, lcHeader, verbosity)
+    iDir = nDir
 
     messages = _print_blockloop_message(fname, outfilename, args.forceTime, i,
                                        counters)
@@ -825,8 +767,9 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
             if iDir < lcHeader.dirCount:
                 txt = "\n  DIR{:d}, LAST BLOCK ({:d}) IS BEYOND THE " +\
                       "END OF FILE!"
-                logging.info(txt.format(iDir + 1,
-                                        lcDir.blockNumber + lcDir.numBlocks))
+                logging.info(txt.format(
+                    iDir + 1, int(dirEntries['blockNumber'][-1])
+                    + int(dirEntries['numBlocks'][-1])))
                 txt = "  REDUCING NUMBER OF DIRECTORY ENTRIES IN HEADER " +\
                       "FROM {:d} TO {:d}"
                 logging.info(txt.format(lcHeader.dirCount, iDir))
@@ -848,7 +791,6 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
     # -----------------------
     if not args.dryrun:
         ofp1.close()
-        ofp_data.close()
     oftt.close()
     if of_lccut is not None:
         if not lccut_prev_block == 0:
@@ -861,11 +803,151 @@ def _process_input_file(ifp1, fname, outFileRoot, lcHeader,
         os.remove(fname_timetears)
     # Otherwise, if not forced time corrections, remove the output data file
     elif not args.forceTime:
-        os.remove(outfilename)
+        if not args.dryrun:
+            os.remove(outfilename)
         return counters, messages, fname_timetears
     return counters, messages, outfilename
 
 
+def _plan_directory(inDir, lcHeader, lastOutBlock, hasHeader):
+    """
+    Lay out the output directory entries
+
+    Follows the input directory (fixing BUG3 entry lengths), adding an entry
+    every DIRBLOCKS blocks until lastOutBlock.  Entry times are not set.
+
+    Args:
+        inDir (:class:`numpy.ndarray`): input directory entries
+            (DIR_ENTRY_DTYPE)
+        lcHeader (:class:`LCDiskHeader`): disk header
+        lastOutBlock (int): last data block in the output file
+        hasHeader (bool): Does the input file have a header?
+
+    Returns:
+        (tuple):
+            entries (:class:`numpy.ndarray`): directory entries, the last
+                one may start beyond lastOutBlock
+            nDir (int): number of entries to write
+            origTimes (list): original entry times (None if created)
+            notes (list): message to log for each entry (or None)
+            nBug3 (int): number of BUG3 entry lengths fixed
+    """
+    if lcDir is not None:
+        template = lcDir
+    else:
+        template = np.zeros(1, dtype=DIR_ENTRY_DTYPE)
+        template['sampleRate'] = lcHeader.sampleRate
+    sources = np.concatenate((inDir, template)).astype(DIR_ENTRY_DTYPE)
+    inTimes = [BOGUS_TIME if t is None else t
+               for t in header_times(inDir).astype(object)]
+    nInDir = min(lcHeader.dirCount, len(inDir)) if hasHeader else 0
+    rows, origTimes, notes = [], [], []
+    src, numBlocks = -1, DIRBLOCKS
+    blockNumber = lcHeader.dataStart - DIRBLOCKS
+    nBug3 = 0
+    iDir = 0
+    while True:
+        note, origTime = None, None
+        if iDir < nInDir:
+            # Copy the input file's directory entry
+            src = iDir
+            blockNumber = int(inDir['blockNumber'][iDir])
+            numBlocks = int(inDir['numBlocks'][iDir])
+            origTime = inTimes[iDir]
+            if not numBlocks == DIRBLOCKS:
+                if numBlocks == BAD_DIRBLOCKS:
+                    numBlocks = DIRBLOCKS
+                    nBug3 += 1
+                else:
+                    fmt = "DIR{:10d}: Expected {:d} blocks, found {:d}"
+                    note = fmt.format(iDir, DIRBLOCKS, numBlocks)
+        elif hasHeader:
+            # Add entries beyond the original end
+            nextDirBlock = blockNumber + numBlocks
+            if iDir <= lcHeader.dirSize and nextDirBlock <= lastOutBlock:
+                blockNumber = nextDirBlock
+            else:
+                break
+        else:
+            # No input directory, make up the next entry
+            numBlocks = DIRBLOCKS
+            nextDirBlock = lcHeader.dataStart + iDir * numBlocks
+            if iDir < lcHeader.dirSize and nextDirBlock <= lastOutBlock:
+                blockNumber = nextDirBlock
+            else:
+                break
+        rows.append((src, blockNumber, numBlocks))
+        origTimes.append(origTime)
+        notes.append(note)
+        # Stop if the entry starts beyond the end of the data
+        if blockNumber > lastOutBlock:
+            break
+        # or if it reaches the end of the data
+        if blockNumber + numBlocks >= lastOutBlock:
+            rows[-1] = (src, blockNumber, lastOutBlock - blockNumber + 1)
+            break
+        iDir += 1
+
+    rows = np.array(rows, dtype=np.int64).reshape(-1, 3)
+    entries = sources[rows[:, 0]]
+    entries['blockNumber'] = rows[:, 1]
+    entries['numBlocks'] = rows[:, 2]
+    entries['U1'] = 0
+    nDir = len(entries)
+    if nDir and rows[-1, 1] > lastOutBlock:
+        nDir -= 1
+    return entries, nDir, origTimes, notes, nBug3
+
+
+def _write_directory(ofp, entries, nDir, origTimes, notes, blockTimes,
+                     lcHeader, verbosity):
+    """
+    Set directory entry times to their block times, log and write them
+
+    The entries are written in one call
+
+    Args:
+        ofp (file object): output file (None: do not write)
+        entries, nDir, origTimes, notes: outputs of _plan_directory()
+        blockTimes (:class:`numpy.ndarray`): times of the first nDir
+            entries' blocks
+        lcHeader (:class:`LCDiskHeader`): disk header
+        verbosity (int): verbosity level
+    """
+    global lcDir
+    if verbosity:
+        logging.info("   {:4s} | {:9s} | {:26s} | {:28s} | {}".format(
+            "DIR#", "BLOCK#", "ORIG DIRTIME", "NEW DIRTIME (BLOCKTIME)",
+            "DIFF (SECS)"))
+        logging.info("   {:-<5s}|{:-<11s}|{:-<28s}|{:-<30s}|{:-<10s}".format(
+                     "", "", "", "", ""))
+    times = blockTimes.astype(object)
+    for iDir, blockNumber in enumerate(entries['blockNumber'].tolist()):
+        if notes[iDir] is not None:
+            logging.info(notes[iDir])
+        if not verbosity:
+            continue
+        verboselogtext = "   {:4d} | {:9d} | {:26s} |".format(
+            iDir + 1, blockNumber, str(origTimes[iDir]))
+        if iDir >= nDir:   # Entry is beyond the end of data
+            logging.info(verboselogtext)
+        elif origTimes[iDir] is not None:
+            diff = abs(_to_msec(times[iDir] - origTimes[iDir]))
+            logging.info(verboselogtext + "   {:26s} | {:14.1f}".format(
+                         str(times[iDir]), diff/1000))
+        else:
+            logging.info(verboselogtext + "   {:26s} | {:<14s}".format(
+                         str(times[iDir]), "N/A"))
+    entries = entries[:nDir]
+    set_times(entries, blockTimes)
+    if ofp is not None:
+        with profiling.stage('file_write', entries.nbytes):
+            ofp.seek(lcHeader.dirStart * BLOCK_SIZE, os.SEEK_SET)
+            ofp.write(entries.tobytes())
+    if nDir:
+        lcDir = entries[-1:].copy()
+
+
 def _log_error_2(type, printHeader, currBlock, chan, expect_time, t):
     # LCHEAPO BUG 2 - Isolated time tag error
     logging.info(
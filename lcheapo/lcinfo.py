@@ -9,13 +9,31 @@ and end of each file
 from sdpchainpy import ProcessStep
 
 # from .sdpchain import ProcessStep
-from .lcheapo_utils import (LCDataBlock, LCDiskHeader)
+from .lcheapo_utils import (LCDataBlock, LCDiskHeader, HEADER_START,
+                            BLOCK_SIZE)
+from .lcscan import (read_headers, header_times, iter_headers,
+                     SAMPLES_PER_BLOCK)
 import argparse
+import csv
+import io
+import json
 import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
 from datetime import timedelta
+from pathlib import Path
+
+import numpy as np
 
 from .version import __version__
 
+INFO_FIELDS = ['file', 'has_header', 'n_channels', 'sample_rate',
+               'start_time', 'end_time', 'duration_s', 'n_blocks']
+TIME_ERROR_FIELDS = ['isolated_time_errors', 'time_tears']
+_quiet_lock = threading.Lock()
+
 
 def main():
     global warnings
@@ -24,12 +42,35 @@ def main():
     args = getOptions()
     in_filename_path, out_filename_path, _ = ProcessStep.setup_paths(args)
 
-    for filename in args.input_files:
-        with open(os.path.join(in_filename_path, filename),
-                  'rb') as fp:
+    if args.recursive is None and args.format == 'text' and args.jobs == 1 \
+            and not args.time_errors:
+        for filename in args.input_files:
+            with open(os.path.join(in_filename_path, filename),
+                      'rb') as fp:
+                print('-'*60)
+                print(filename)
+                _print_Info(fp)
+        return
+
+    filenames = [Path(in_filename_path) / f for f in args.input_files]
+    if args.recursive is not None:
+        filenames.extend(sorted(
+            (Path(in_filename_path) / args.recursive).rglob(args.pattern)))
+    infos = get_infos(filenames, args.jobs, args.time_errors)
+    fields = INFO_FIELDS + (TIME_ERROR_FIELDS if args.time_errors else [])
+    if args.format == 'json':
+        print(json.dumps(infos, indent=2))
+    elif args.format == 'csv':
+        writer = csv.DictWriter(sys.stdout, fieldnames=fields + ['error'],
+                                extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(infos)
+    else:
+        for info in infos:
             print('-'*60)
-            print(filename)
-            _print_Info(fp)
+            for key in fields + ['error']:
+                if key in info:
+                    print(f'{key:20s} = {info[key]}')
 
 
 def getOptions():
@@ -39,8 +80,22 @@ def getOptions():
     parser = argparse.ArgumentParser(
         description=__doc__,
         formatter_class=argparse.RawDescriptionHelpFormatter)
-    parser.add_argument("input_files", metavar="inFileName", nargs='+',
+    parser.add_argument("input_files", metavar="inFileName", nargs='*',
                         help="Input filename(s)")
+    parser.add_argument("-r", "--recursive", metavar="DIR", default=None,
+                        help="also scan all files matching PATTERN in DIR "
+                             "and its subdirectories (DIR is relative to "
+                             "IN_DIR)")
+    parser.add_argument("--pattern", default='*.lch',
+                        help="filename pattern for --recursive "
+                             "(default: %(default)s)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of files to scan in parallel")
+    parser.add_argument("-f", "--format", choices=['text', 'json', 'csv'],
+                        default='text', help="output format")
+    parser.add_argument("-t", "--time_errors", action='store_true',
+                        help="count isolated time errors and time tears "
+                             "(scans all block headers)")
     parser.add_argument("-d", dest="base_dir", metavar="BASE_DIR",
                         default='.', help="base directory for files")
     parser.add_argument("-i", dest="in_dir", metavar="IN_DIR",
@@ -51,9 +106,96 @@ def getOptions():
     parser.add_argument("--version", action='version',
                         version='%(prog)s {:s}'.format(__version__))
     args = parser.parse_args()
+    if not args.input_files and args.recursive is None:
+        parser.error('Provide inFileName(s) and/or --recursive')
     return args
 
 
+def get_infos(filenames, jobs=1, time_errors=False):
+    """
+    Return information about many LCHEAPO files, scanning them in parallel
+
+    Args:
+        filenames (list): LCHEAPO filenames
+        jobs (int): number of files to scan at the same time
+        time_errors (bool): also count time errors (see get_info())
+    Returns:
+        infos (list of dict): one get_info() result per file, in the same
+            order as filenames.  Files that could not be read have an
+            'error' key
+    """
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        return list(executor.map(lambda f: _safe_get_info(f, time_errors),
+                                 filenames))
+
+
+def get_info(filename, time_errors=False):
+    """
+    Return basic information about an LCHEAPO file
+
+    Args:
+        filename (str or Path): LCHEAPO file
+        time_errors (bool): count isolated time errors (a block whose time
+            is off, followed by one that is back on time) and time tears
+            (a time jump that is not recovered), using the channel 0 blocks
+    Returns:
+        info (dict): file, has_header, n_channels, sample_rate, start_time,
+            end_time, duration_s, n_blocks [, isolated_time_errors,
+            time_tears]
+    """
+    with open(filename, 'rb') as fp:
+        lcHeader = LCDiskHeader()
+        lcHeader.seekHeaderPosition(fp)
+        has_header = _read_header_quietly(lcHeader, fp)
+        if has_header:
+            sample_rate = lcHeader.realSampleRate
+            n_channels = lcHeader.numberOfChannels
+            first_data_block = lcHeader.dataStart
+        else:
+            first_data_block = 0
+            n_channels, sample_rate = _estimate_parms(fp, first_data_block)
+
+        fp.seek(0, 2)                # Seek end of file
+        last_data_block = int(fp.tell() / 512) - 1
+
+        start_time, temp = _get_times(fp, first_data_block, sample_rate)
+        temp, end_time = _get_times(fp, last_data_block, sample_rate)
+        info = dict(file=str(filename),
+                    has_header=has_header,
+                    n_channels=n_channels,
+                    sample_rate=sample_rate,
+                    start_time=start_time.isoformat(),
+                    end_time=end_time.isoformat(),
+                    duration_s=(end_time - start_time).total_seconds(),
+                    n_blocks=last_data_block - first_data_block + 1)
+        if time_errors:
+            info.update(_count_time_errors(fp, first_data_block, sample_rate))
+    return info
+
+
+def _safe_get_info(filename, time_errors):
+    try:
+        return get_info(filename, time_errors)
+    except Exception as e:
+        return dict(file=str(filename), error=f'{e.__class__.__name__}: {e}')
+
+
+def _read_header_quietly(lcHeader, fp):
+    """
+    Read header without readHeader()'s "no header" messages
+
+    The header block is read from the file first, so that only its parse
+    is done with stdout redirected.  The lock keeps parallel scans from
+    interleaving stdout redirections
+    """
+    fp.seek(HEADER_START * BLOCK_SIZE)
+    header_fp = io.BytesIO(bytes(HEADER_START * BLOCK_SIZE)
+                           + fp.read(BLOCK_SIZE))
+    with _quiet_lock, open(os.devnull, 'w') as devnull, \
+            redirect_stdout(devnull):
+        return lcHeader.readHeader(header_fp) == 1
+
+
 def _get_times(fp, block_num, samp_rate):
     """
     Get start and end time of the given block
@@ -96,24 +238,17 @@ def _print_Info(fp):
 
 
 def _estimate_parms(fp, first_data_block, imax=10):
-    lcData = LCDataBlock()
     base_sample_rate = 62.5
-    n_samples = 166
-    n_channels = 1
-    for i in range(imax):
-        lcData.seekBlock(fp, i)
-        lcData.readBlock(fp)
-        # lcData.prettyPrintHeader()
-        if lcData.muxChannel + 1 > n_channels:
-            n_channels = lcData.muxChannel + 1
+    headers = read_headers(fp, 0, imax)
+    n_channels = max(int(headers['muxChannel'].max()) + 1, 1)
     # print(f'{n_channels=}')
     if n_channels >= imax:
         raise ValueError('File indicates more channels {:d} than tested {:d}'
                          .format(n_channels, imax))
-    block_timedelta = (_get_times(fp, first_data_block + n_channels, 1)[0]
-                       - _get_times(fp, first_data_block, 1)[0])
-    # print(f'{block_timedelta=}')
-    sample_rate = n_samples / ((block_timedelta/timedelta(milliseconds=1))/1000)
+    times = header_times(read_headers(fp, first_data_block, n_channels + 1))
+    block_msec = (times[n_channels] - times[0]) / np.timedelta64(1, 'ms')
+    # print(f'{block_msec=}')
+    sample_rate = SAMPLES_PER_BLOCK / (block_msec / 1000)
     rate_multiplier = sample_rate/base_sample_rate
     if not rate_multiplier == int(rate_multiplier):
         raise ValueError('Sample rate ({:f}) is not a multiple of {:f}'
@@ -121,5 +256,40 @@ def _estimate_parms(fp, first_data_block, imax=10):
     return n_channels, sample_rate
 
 
+def _count_time_errors(fp, first_data_block, sample_rate):
+    """
+    Count isolated time errors and time tears in channel 0 blocks
+
+    Scans the headers a chunk at a time, only keeping the (rare) time
+    jumps in memory
+    """
+    block_msec = int(SAMPLES_PER_BLOCK / sample_rate * 1000)
+    jumps = []     # (channel 0 block index, time jump in msec)
+    n_previous = 0
+    prev_time = None
+    for _, headers in iter_headers(fp, first_data_block):
+        t = header_times(headers[headers['muxChannel'] == 0])
+        t = t.astype(np.int64)  # NaT becomes a huge jump
+        if prev_time is not None:
+            t = np.concatenate(([prev_time], t))
+        if len(t) == 0:
+            continue
+        d = np.diff(t) - block_msec
+        i = np.flatnonzero(d)
+        jumps.extend(zip((n_previous + i).tolist(), d[i].tolist()))
+        n_previous += len(d)
+        prev_time = t[-1]
+    isolated, tears, i = 0, 0, 0
+    while i < len(jumps):
+        k, d = jumps[i]
+        if i + 1 < len(jumps) and jumps[i + 1] == (k + 1, -d):
+            isolated += 1
+            i += 2
+        else:
+            tears += 1
+            i += 1
+    return dict(isolated_time_errors=isolated, time_tears=tears)
+
+
 if __name__ == '__main__':
     main()
@@ -11,8 +11,10 @@ from obspy.core import UTCDateTime, Stream
 
 from .instrument_metadata import chan_maps
 from .lcread import read, get_data_timelimits
+from . import profiling
 
 
+@profiling.profile_main
 def main():
     """
     Command-line plotting interface
@@ -70,7 +72,9 @@ def main():
     my_group.add_argument("--sfilt", dest="station_filt",
                           help="regex filter to find station name in filename "
                                "(see examples below)")
+    profiling.add_arguments(parser)
     args = parser.parse_args()
+    profiling.start(args)
 
     # Set/normalize start and end times
     endtime = _normalize_time_arg(args.endtime)
@@ -16,6 +16,7 @@ from obspy.core import UTCDateTime, Stream, Trace
 
 from .lcheapo_utils import (LCDataBlock, LCDiskHeader)
 from .instrument_metadata import chan_maps, load_station
+from . import profiling
 
 
 def read(filename, starttime=None, endtime=None, network='XX', station='SSSSS',
@@ -89,21 +90,23 @@ def get_data_timelimits(lcheapo_object):
 
     lcHeader = LCDiskHeader()
     block = LCDataBlock()
-    status = lcHeader.readHeader(fp)
+    with profiling.stage('header_read', 512):
+        status = lcHeader.readHeader(fp)
     if status == 0:
         return None, None
 
-    # read starttime
-    startBlock = lcHeader.dataStart
-    block.seekBlock(fp, startBlock)
-    block.readBlock(fp)
-    starttime = block.getDateTime()
+    with profiling.stage('block_read', 1024):
+        # read starttime
+        startBlock = lcHeader.dataStart
+        block.seekBlock(fp, startBlock)
+        block.readBlock(fp)
+        starttime = block.getDateTime()
 
-    # read endtime
-    lastBlock = block.determineLastBlock(fp)
-    block.seekBlock(fp, lastBlock)
-    block.readBlock(fp)
-    endtime = block.getDateTime()
+        # read endtime
+        lastBlock = block.determineLastBlock(fp)
+        block.seekBlock(fp, lastBlock)
+        block.readBlock(fp)
+        endtime = block.getDateTime()
 
     return UTCDateTime(starttime), UTCDateTime(endtime)
 
@@ -192,7 +195,8 @@ def _read_data(starttime, endtime, fp, verbose=False):
 
     lcHeader = LCDiskHeader()
     block = LCDataBlock()
-    lcHeader.readHeader(fp)
+    with profiling.stage('header_read', 512):
+        lcHeader.readHeader(fp)
     # lcHeader.printHeader()
     sample_rate = lcHeader.realSampleRate
     n_chans = lcHeader.numberOfChannels
@@ -205,7 +209,9 @@ def _read_data(starttime, endtime, fp, verbose=False):
     block.seekBlock(fp, n_start_block)
 
     # Read the data and arrange in read_blocks*512 array
-    buf = fp.read(read_blocks * 512)
+    with profiling.stage('block_read') as timer:
+        buf = fp.read(read_blocks * 512)
+        timer.nbytes = len(buf)
     if not (lb:=len(buf)) == read_blocks * 512:
         if lb%512 == 0:
             print(f'tried to read {read_blocks} blocks, only found {int(lb/512)}, adjusting...')
@@ -248,14 +254,18 @@ def _read_data(starttime, endtime, fp, verbose=False):
     # Extract channels
     for i in range(0, n_chans):
         # Get data
-        chan_data = data[i:read_blocks:n_chans, :].flatten()
-        # could be quicker using the np.flat() iterator ?
-        t32 = (np.int32(chan_data[0: 498*chan_blocks: 3])*(1 << 16) +
-               np.int32(chan_data[1: 498*chan_blocks: 3].astype('B'))*(1 << 8) +
-               np.int32(chan_data[2: 498*chan_blocks: 3].astype('B')))
-        stream.append(Trace(data=t32, header=stats))
+        with profiling.stage('decode', 498 * chan_blocks):
+            chan_data = data[i:read_blocks:n_chans, :].flatten()
+            # could be quicker using the np.flat() iterator ?
+            t32 = (np.int32(chan_data[0: 498*chan_blocks: 3])*(1 << 16) +
+                   np.int32(chan_data[1: 498*chan_blocks: 3].astype('B'))*(1 << 8) +
+                   np.int32(chan_data[2: 498*chan_blocks: 3].astype('B')))
+        with profiling.stage('trace_build', t32.nbytes):
+            stream.append(Trace(data=t32, header=stats))
     eps = 1e-6
-    stream.trim(starttime=starttime, endtime=endtime-eps, nearest_sample=False)
+    with profiling.stage('trace_build'):
+        stream.trim(starttime=starttime, endtime=endtime-eps,
+                    nearest_sample=False)
     return stream
 
 
@@ -344,10 +354,12 @@ def _get_block_number(time, fp):
     """
     lcHeader = LCDiskHeader()
     block = LCDataBlock()
-    lcHeader.readHeader(fp)
+    with profiling.stage('header_read', 512):
+        lcHeader.readHeader(fp)
     data_start_block = lcHeader.dataStart
-    block.seekBlock(fp, data_start_block)
-    block.readBlock(fp)
+    with profiling.stage('block_read', 512):
+        block.seekBlock(fp, data_start_block)
+        block.readBlock(fp)
 
     starttime, _ = get_data_timelimits(fp)
     block_len_s = block.numberOfSamples / lcHeader.realSampleRate
@@ -357,7 +369,7 @@ def _get_block_number(time, fp):
     return data_start_block + record_offset * num_chans
 
 
-def _stuff_info(stream, network, station, obs_type):
+def _stuff_info(stream, network, station, obs_type, responses=True):
     """
     Put network, station and channel information into station stream
 
@@ -366,6 +378,7 @@ def _stuff_info(stream, network, station, obs_type):
         network (str): network code
         station (str): station code
         obs_type (str): type of obs (must be in channel_maps)
+        responses (bool): attach instrument responses
 
     Returns:
         data (:class:`~obspy.stream.Stream`): informed data
@@ -382,8 +395,11 @@ def _stuff_info(stream, network, station, obs_type):
         trace.stats.channel = band_code_sps(chan[0], sps) + chan[1:3]
         if len(loc) > 1:
             trace.stats.location = loc
-        trace.stats.response = _load_response(obs_type, sps, trace.stats.channel,
-                                              trace.stats.starttime)
+        if not responses:
+            continue
+        with profiling.stage('response_load'):
+            trace.stats.response = _load_response(
+                obs_type, sps, trace.stats.channel, trace.stats.starttime)
     return stream
 
 
@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Vectorized (numpy) access to LCHEAPO data blocks
+
+Maps 512-byte LCHEAPO blocks onto a numpy structured dtype so that headers
+and samples of many blocks can be read and decoded at once, instead of one
+`LCDataBlock.readBlock()` per block.
+"""
+import os
+
+import numpy as np
+
+from .lcheapo_utils import BLOCK_SIZE
+
+SAMPLES_PER_BLOCK = 166
+DATA_BYTES = 3 * SAMPLES_PER_BLOCK
+CHUNK_BLOCKS = 65536  # blocks per chunk when iterating (32 MB)
+
+# Same field names as LCDataBlock attributes
+HEADER_DTYPE = np.dtype([('msec', '>u2'),
+                         ('second', 'u1'),
+                         ('minute', 'u1'),
+                         ('hour', 'u1'),
+                         ('day', 'u1'),
+                         ('month', 'u1'),
+                         ('year', 'u1'),
+                         ('blockFlag', 'u1'),
+                         ('muxChannel', 'u1'),
+                         ('numberOfSamples', '>u2'),
+                         ('U1', 'u1'),
+                         ('U2', 'u1')])
+BLOCK_DTYPE = np.dtype(HEADER_DTYPE.descr + [('data', 'u1', (DATA_BYTES,))])
+HEADER_FIELDS = HEADER_DTYPE.names
+assert BLOCK_DTYPE.itemsize == BLOCK_SIZE
+
+# Same field names as LCDirEntry attributes
+DIR_ENTRY_DTYPE = np.dtype([('msec', '>u2'),
+                            ('second', 'u1'),
+                            ('minute', 'u1'),
+                            ('hour', 'u1'),
+                            ('day', 'u1'),
+                            ('month', 'u1'),
+                            ('year', 'u1'),
+                            ('blockNumber', '>u4'),
+                            ('recordLength', '>u4'),
+                            ('sampleRate', '>u2'),
+                            ('numBlocks', '>u2'),
+                            ('flag', 'u1'),
+                            ('muxChannel', 'u1'),
+                            ('U1', 'u1', (10,))])
+assert DIR_ENTRY_DTYPE.itemsize == 32
+
+
+def n_file_blocks(lcheapo_object):
+    """
+    Return the number of full blocks in a file
+
+    Args:
+        lcheapo_object (str, Path or file-like object): LCHEAPO file
+    """
+    if hasattr(lcheapo_object, "fileno"):
+        return os.fstat(lcheapo_object.fileno()).st_size // BLOCK_SIZE
+    return os.stat(lcheapo_object).st_size // BLOCK_SIZE
+
+
+def map_blocks(lcheapo_object, first_block=0, n_blocks=None):
+    """
+    Memory-map LCHEAPO blocks as a read-only structured array
+
+    Nothing is read until the returned array is accessed.
+
+    Args:
+        lcheapo_object (str, Path or file-like object): LCHEAPO file
+        first_block (int): first block to map
+        n_blocks (int): number of blocks to map (None: to end of file)
+
+    Returns:
+        blocks (:class:`numpy.ndarray`): array of dtype BLOCK_DTYPE
+    """
+    available = n_file_blocks(lcheapo_object) - first_block
+    if n_blocks is None or n_blocks > available:
+        n_blocks = available
+    if n_blocks <= 0:
+        return np.zeros(0, dtype=BLOCK_DTYPE)
+    return np.memmap(lcheapo_object, dtype=BLOCK_DTYPE, mode='r',
+                     offset=first_block * BLOCK_SIZE, shape=(n_blocks,))
+
+
+def read_headers(lcheapo_object, first_block=0, n_blocks=None):
+    """
+    Read the headers of a range of blocks
+
+    Args:
+        lcheapo_object (str, Path or file-like object): LCHEAPO file
+        first_block (int): first block to read
+        n_blocks (int): number of blocks to read (None: to end of file)
+
+    Returns:
+        headers (:class:`numpy.ndarray`): array of dtype HEADER_DTYPE
+    """
+    blocks = map_blocks(lcheapo_object, first_block, n_blocks)
+    return headers_of(blocks)
+
+
+def iter_headers(lcheapo_object, first_block=0, last_block=None,
+                 chunk_blocks=CHUNK_BLOCKS):
+    """
+    Iterate through the headers of a file, a chunk at a time
+
+    Memory use depends on chunk_blocks, not on the file size
+
+    Args:
+        lcheapo_object (str, Path or file-like object): LCHEAPO file
+        first_block (int): first block to read
+        last_block (int): last block to read (None: end of file)
+        chunk_blocks (int): number of blocks per chunk
+
+    Yields:
+        (tuple): block number of the first header in the chunk, headers
+    """
+    blocks = map_blocks(lcheapo_object, first_block)
+    if last_block is not None:
+        blocks = blocks[:last_block - first_block + 1]
+    for i in range(0, len(blocks), chunk_blocks):
+        yield first_block + i, headers_of(blocks[i:i + chunk_blocks])
+
+
+def read_directory(fp, dir_start, n_entries):
+    """
+    Read directory entries
+
+    Args:
+        fp (file-like object): LCHEAPO file
+        dir_start (int): directory start block
+        n_entries (int): number of entries to read
+
+    Returns:
+        entries (:class:`numpy.ndarray`): array of dtype DIR_ENTRY_DTYPE
+    """
+    fp.seek(dir_start * BLOCK_SIZE, os.SEEK_SET)
+    buf = fp.read(n_entries * DIR_ENTRY_DTYPE.itemsize)
+    return np.frombuffer(buf, dtype=DIR_ENTRY_DTYPE,
+                         count=len(buf) // DIR_ENTRY_DTYPE.itemsize).copy()
+
+
+def set_times(records, times):
+    """
+    Set the time fields of header or directory entry records
+
+    Two-digit years are written as in `LCCommon.changeTime()`
+
+    Args:
+        records (:class:`numpy.ndarray`): HEADER_DTYPE, BLOCK_DTYPE or
+            DIR_ENTRY_DTYPE array (modified in place)
+        times (:class:`numpy.ndarray`): datetime64 array
+    """
+    msec = np.asarray(times, dtype='datetime64[ms]')
+    days = msec.astype('datetime64[D]')
+    months = msec.astype('datetime64[M]')
+    month_starts = months.astype('datetime64[D]')
+    year = msec.astype('datetime64[Y]').astype(np.int64) + 1970
+    ms_of_day = (msec - days).astype(np.int64)
+    records['year'] = np.where(year < 2000, year - 1900, year - 2000)
+    records['month'] = months.astype(np.int64) % 12 + 1
+    records['day'] = (days - month_starts).astype(np.int64) + 1
+    records['hour'] = ms_of_day // 3600000
+    records['minute'] = ms_of_day // 60000 % 60
+    records['second'] = ms_of_day // 1000 % 60
+    records['msec'] = ms_of_day % 1000
+
+
+def headers_of(blocks):
+    """
+    Return a compact copy of the header fields of a block array
+    """
+    headers = np.empty(len(blocks), dtype=HEADER_DTYPE)
+    for name in HEADER_FIELDS:
+        headers[name] = blocks[name]
+    return headers
+
+
+def header_times(headers):
+    """
+    Return the time of each header
+
+    Two-digit years are interpreted as in `LCCommon.fixYear()`
+
+    Args:
+        headers (:class:`numpy.ndarray`): HEADER_DTYPE or BLOCK_DTYPE array
+
+    Returns:
+        times (:class:`numpy.ndarray`): datetime64[ms] array, NaT where the
+            header time is invalid
+    """
+    year = headers['year'].astype(np.int64)
+    year = np.where(year < 50, year + 2000,
+                    np.where((year > 50) & (year < 100), year + 1900, year))
+    month = headers['month'].astype(np.int64)
+    day = headers['day'].astype(np.int64)
+    valid = ((month >= 1) & (month <= 12) & (day >= 1)
+             & (day <= _days_in_month(year, np.clip(month, 1, 12)))
+             & (headers['hour'] < 24) & (headers['minute'] < 60)
+             & (headers['second'] < 60) & (headers['msec'] < 1000))
+    msec = (_days_from_civil(year, month, day) * 86400000
+            + headers['hour'].astype(np.int64) * 3600000
+            + headers['minute'].astype(np.int64) * 60000
+            + headers['second'].astype(np.int64) * 1000
+            + headers['msec'].astype(np.int64))
+    times = msec.astype('datetime64[ms]')
+    times[~valid] = np.datetime64('NaT')
+    return times
+
+
+def decode_samples(blocks):
+    """
+    Convert the 24-bit big-endian data of each block to int32
+
+    Args:
+        blocks (:class:`numpy.ndarray`): BLOCK_DTYPE array
+
+    Returns:
+        samples (:class:`numpy.ndarray`): int32 array (n_blocks, 166)
+    """
+    b = np.asarray(blocks['data']).reshape(-1, SAMPLES_PER_BLOCK, 3)
+    return ((b[..., 0].view(np.int8).astype(np.int32) << 16)
+            | (b[..., 1].astype(np.int32) << 8)
+            | b[..., 2].astype(np.int32))
+
+
+def channel_samples(blocks, n_chans, channel):
+    """
+    Return one channel's samples from multiplexed blocks, as a 1-D array
+
+    Args:
+        blocks (:class:`numpy.ndarray`): BLOCK_DTYPE array, the first block
+            must be channel 0
+        n_chans (int): number of multiplexed channels
+        channel (int): channel to extract
+    """
+    n_blocks = (len(blocks) // n_chans) * n_chans
+    return decode_samples(blocks[channel:n_blocks:n_chans]).ravel()
+
+
+def first_mux0_block(lcheapo_object, first_block, max_search=16):
+    """
+    Return the first block at or after first_block with muxChannel == 0
+    """
+    headers = read_headers(lcheapo_object, first_block, max_search)
+    i = np.flatnonzero(headers['muxChannel'] == 0)
+    if len(i) == 0:
+        raise ValueError(f'No channel 0 block in blocks {first_block}-'
+                         f'{first_block + max_search - 1}')
+    return first_block + int(i[0])
+
+
+def _days_in_month(year, month):
+    leap = ((year % 4 == 0) & (year % 100 != 0)) | (year % 400 == 0)
+    days = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+    return days[month - 1] + ((month == 2) & leap)
+
+
+def _days_from_civil(year, month, day):
+    """
+    Days since 1970-01-01 of a proleptic Gregorian date (vectorized)
+    """
+    y = year - (month <= 2)
+    era = np.floor_divide(y, 400)
+    yoe = y - era * 400
+    mp = (month + 9) % 12
+    doy = (153 * mp + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
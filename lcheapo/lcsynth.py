@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Write synthetic LCHEAPO files, with optional lcfix bugs
+
+The files have a standard disk header (LCDiskHeader.writeHeader()), a
+directory entry every 14336 blocks and multiplexed 24-bit data blocks
+containing noise and a common low-frequency signal.  Data blocks are built
+a chunk at a time as numpy structured arrays (lcscan.BLOCK_DTYPE, the same
+bytes as LCDataBlock.writeBlock()), so multi-GB files take seconds.
+
+Faults that can be injected (the lcfix bug names):
+    - bug1: isolated one second time tag offset
+    - bug1a: BUG1s on 4 consecutive blocks, repeating every 500 blocks
+    - bug2: isolated bad time tag
+    - time_tear: all time tags offset from a block onwards
+    - bug3: directory entry with 16384 instead of 14336 blocks
+"""
+import argparse
+import math
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from .lcheapo_utils import LCDiskHeader, BLOCK_SIZE
+from .lcscan import (BLOCK_DTYPE, DIR_ENTRY_DTYPE, SAMPLES_PER_BLOCK,
+                     CHUNK_BLOCKS, set_times)
+from .version import __version__
+
+FAULT_TYPES = ('bug1', 'bug1a', 'bug2', 'time_tear', 'bug3')
+DIR_START = 8
+DIR_SIZE = 57247  # maximum number of directory entries
+DATA_START = 3586
+DIRBLOCKS = 14336
+BAD_DIRBLOCKS = 16384
+BLOCK_FLAG = 73
+BUG1A_BLOCKS = 4  # consecutive BUG1 blocks in each BUG1a repeat
+BUG1A_INTERVAL = 500  # blocks between BUG1a repeats
+BUG1A_REPEATS = 3
+BUG2_OFFSET_MS = 12345678
+TEAR_OFFSET_MS = 60000
+EDGE_GROUPS = 4  # no faults in the first and last block groups
+
+
+def write_synthetic(filename, n_chans=4, sample_rate=125, duration=3600.,
+                    starttime=datetime(2022, 1, 1), faults=None, seed=0,
+                    amplitude=10000., description='synthetic lcheapo data',
+                    chunk_blocks=CHUNK_BLOCKS):
+    """
+    Write a synthetic LCHEAPO file
+
+    Args:
+        filename (str or Path): output file
+        n_chans (int): number of channels (1, 2, 4 or 8)
+        sample_rate (int): header sample rate (31 and 62 mean 31.25 and
+            62.5 sps)
+        duration (float): data length (seconds)
+        starttime (:class:`datetime.datetime`): time of the first block
+        faults (dict): {fault type: count or list of data block numbers}.
+            Counts are spread evenly over the data (on different channels).
+            Block numbers are relative to the first data block, for bug3
+            they are directory entry numbers
+        seed (int): random generator seed
+        amplitude (float): noise standard deviation (counts)
+        description (str): header description
+        chunk_blocks (int): blocks generated and written at a time
+    Returns:
+        info (dict): n_blocks (data blocks), data_start (first data
+            block), faults ({type: list of absolute block numbers or
+            directory entry numbers}), expected (lcfix counts: bug1, bug2,
+            bug3, time_tear)
+    """
+    if n_chans not in (1, 2, 4, 8):
+        raise ValueError(f'{n_chans=} not in (1, 2, 4, 8)')
+    header = _make_header(n_chans, sample_rate, description)
+    real_rate = header.getRealSampleRate(sample_rate)
+    # Block length in ms, as calculated by lcfix
+    block_ms = int(SAMPLES_PER_BLOCK / real_rate * 1000)
+    n_groups = max(int(math.ceil(duration * 1000 / block_ms)), 1)
+    n_blocks = n_groups * n_chans
+    entries = _make_directory(n_blocks, sample_rate)
+    placed = place_faults(n_groups, n_chans, len(entries), faults or {})
+    isolated, tears = _time_offsets(placed)
+    header.dirCount = len(entries)
+    header.dirBlock = DIR_START + len(entries) // 16
+    header.writeBlock = DATA_START + n_blocks
+    start_ms = np.datetime64(starttime, 'ms').astype(np.int64)
+    rng = np.random.default_rng(seed)
+    group_chunk = max(chunk_blocks // n_chans, 1)
+
+    with open(filename, 'wb') as fp:
+        fp.truncate(DATA_START * BLOCK_SIZE)
+        header.seekHeaderPosition(fp)
+        header.writeHeader(fp)
+        fp.seek(DATA_START * BLOCK_SIZE)
+        for g0 in range(0, n_groups, group_chunk):
+            g1 = min(g0 + group_chunk, n_groups)
+            blocks = _make_blocks(g0, g1, n_chans, real_rate, block_ms,
+                                  start_ms, isolated, tears, rng, amplitude)
+            fp.write(blocks.tobytes())
+        # Directory entries have the times of their first blocks
+        numbers = entries['blockNumber'].astype(np.int64) - DATA_START
+        set_times(entries, (start_ms + (numbers // n_chans) * block_ms
+                            + _offsets(numbers, isolated, tears))
+                  .astype('datetime64[ms]'))
+        for i in placed['bug3']:
+            entries['numBlocks'][i] = BAD_DIRBLOCKS
+        fp.seek(DIR_START * BLOCK_SIZE)
+        fp.write(entries.tobytes())
+
+    absolute = {k: [b + DATA_START for b in v] if k != 'bug3' else list(v)
+                for k, v in placed.items()}
+    expected = dict(bug1=len(isolated[0]) - len(placed['bug2']),
+                    bug2=len(placed['bug2']), bug3=len(placed['bug3']),
+                    time_tear=len(placed['time_tear']) * n_chans)
+    return dict(n_blocks=n_blocks, data_start=DATA_START, faults=absolute,
+                expected=expected)
+
+
+def size_duration(size_mb, n_chans=4, sample_rate=125):
+    """
+    Return the data duration (seconds) giving a file of about size_mb MB
+    """
+    block_s = SAMPLES_PER_BLOCK / LCDiskHeader().getRealSampleRate(
+        sample_rate)
+    return size_mb * 2**20 / BLOCK_SIZE / n_chans * block_s
+
+
+def place_faults(n_groups, n_chans, n_entries, faults):
+    """
+    Return the data blocks (relative to the first) of each fault
+
+    Args:
+        n_groups (int): number of block groups (one block per channel)
+        n_chans (int): number of channels
+        n_entries (int): number of directory entries
+        faults (dict): {fault type: count or list of block numbers}
+    Returns:
+        (dict): {fault type: sorted list of block numbers (directory entry
+            numbers for bug3)}
+    """
+    unknown = set(faults) - set(FAULT_TYPES)
+    if unknown:
+        raise ValueError(f'Unknown fault types: {sorted(unknown)}')
+    placed = {k: [] for k in FAULT_TYPES}
+    counts = {}
+    for k, v in faults.items():
+        if isinstance(v, (int, np.integer)):
+            counts[k] = int(v)
+        else:
+            placed[k] = sorted(int(b) for b in v)
+    n_bug3 = counts.pop('bug3', 0)
+    if n_bug3 > n_entries:
+        raise ValueError(f'{n_bug3} bug3s but only {n_entries} directory '
+                         'entries')
+    placed['bug3'] += np.linspace(0, n_entries - 1, n_bug3).astype(int)\
+        .tolist()
+    # Spread the block faults over equal segments, in type order
+    order = [k for k in FAULT_TYPES for _ in range(counts.get(k, 0))]
+    if not order:
+        return placed
+    first, last = EDGE_GROUPS, n_groups - EDGE_GROUPS
+    seg_groups = (last - first) // len(order)
+    bug1a_groups = int(math.ceil((BUG1A_INTERVAL * (BUG1A_REPEATS - 1)
+                                  + BUG1A_BLOCKS) / n_chans)) + 2
+    needed = bug1a_groups if 'bug1a' in order else 3
+    if seg_groups < needed:
+        raise ValueError(f'Data too short for {len(order)} faults '
+                         f'({n_groups} block groups)')
+    for i, k in enumerate(order):
+        g = first + i * seg_groups + 1
+        if k == 'time_tear':
+            placed[k].append(g * n_chans)  # all channels are offset
+        else:
+            placed[k].append(g * n_chans + i % n_chans)
+    return placed
+
+
+def _time_offsets(placed):
+    """
+    Return the isolated bad times and the time tears of placed faults
+
+    Returns:
+        (tuple): sorted blocks and offsets (ms) of the isolated bad times,
+            list of (first block, offset (ms)) of the time tears
+    """
+    isolated = {}
+    for b in placed['bug1']:
+        isolated[b] = 1000
+    for b in placed['bug1a']:
+        for r in range(BUG1A_REPEATS):
+            for i in range(BUG1A_BLOCKS):
+                isolated[b + r * BUG1A_INTERVAL + i] = 1000
+    for b in placed['bug2']:
+        isolated[b] = BUG2_OFFSET_MS
+    blocks = np.array(sorted(isolated), dtype=np.int64)
+    offsets = np.array([isolated[b] for b in blocks.tolist()],
+                       dtype=np.int64)
+    tears = [(b, TEAR_OFFSET_MS) for b in placed['time_tear']]
+    return (blocks, offsets), tears
+
+
+def _offsets(numbers, isolated, tears):
+    """
+    Return the time offsets (ms) of data blocks
+
+    Args:
+        numbers (:class:`numpy.ndarray`): data block numbers
+        isolated, tears: outputs of _time_offsets()
+    """
+    offsets = np.zeros(len(numbers), dtype=np.int64)
+    for b, offset in tears:
+        offsets[numbers >= b] += offset
+    bad, bad_offsets = isolated
+    if len(bad):
+        i = np.clip(np.searchsorted(bad, numbers), 0, len(bad) - 1)
+        hit = bad[i] == numbers
+        offsets[hit] += bad_offsets[i[hit]]
+    return offsets
+
+
+def _make_blocks(g0, g1, n_chans, sample_rate, block_ms, start_ms, isolated,
+                 tears, rng, amplitude):
+    """
+    Return the data blocks of block groups g0 to g1 - 1
+    """
+    n_groups = g1 - g0
+    blocks = np.zeros(n_groups * n_chans, dtype=BLOCK_DTYPE)
+    numbers = np.arange(g0 * n_chans, g1 * n_chans, dtype=np.int64)
+    groups = numbers // n_chans
+    set_times(blocks, (start_ms + groups * block_ms
+                       + _offsets(numbers, isolated, tears))
+              .astype('datetime64[ms]'))
+    blocks['blockFlag'] = BLOCK_FLAG
+    blocks['muxChannel'] = numbers % n_chans
+    blocks['numberOfSamples'] = SAMPLES_PER_BLOCK
+    blocks['U1'] = 3
+    blocks['U2'] = SAMPLES_PER_BLOCK
+    # Noise plus a 6-second "microseism" common to all channels
+    i = np.arange(g0 * SAMPLES_PER_BLOCK, g1 * SAMPLES_PER_BLOCK)
+    common = 2 * amplitude * np.sin(2 * np.pi * i / sample_rate / 6.)
+    samples = rng.standard_normal((n_groups, n_chans, SAMPLES_PER_BLOCK))
+    samples *= amplitude
+    samples += common.reshape(n_groups, 1, SAMPLES_PER_BLOCK)
+    samples = np.clip(np.rint(samples), -2**23, 2**23 - 1).astype('>i4')
+    raw = samples.reshape(-1, SAMPLES_PER_BLOCK, 1).view('u1')
+    blocks['data'] = raw[..., 1:].reshape(len(blocks), -1)
+    return blocks
+
+
+def _make_header(n_chans, sample_rate, description):
+    h = LCDiskHeader()
+    (h.writeBlock, h.writeByte, h.readBlock, h.readByte) = (0, 0, 0, 0)
+    (h.dirStart, h.dirSize, h.dirBlock, h.dirCount) = (DIR_START, DIR_SIZE,
+                                                       DIR_START, 0)
+    (h.slowStart, h.slowSize, h.slowBlock, h.slowByte) = (0, 0, 0, 0)
+    (h.logStart, h.logSize, h.logBlock, h.logByte) = (0, 0, 0, 0)
+    (h.dataStart, h.diskNumber) = (DATA_START, 0)
+    (h.softwareVersion, h.description) = ('9.08a', description[:79])
+    (h.sampleRate, h.startChannel, h.numberOfChannels) = (
+        int(sample_rate), 0, n_chans)
+    (h.slowDataRate, h.slowStartChannel, h.slowNumberOfChannels) = (0, 0, 0)
+    (h.dataType, h.diskSize, h.ramSize, h.numberOfWindows) = (2, 0, 8, 0)
+    return h
+
+
+def _make_directory(n_blocks, sample_rate):
+    """
+    Return directory entries (without times), one every DIRBLOCKS blocks
+    """
+    starts = np.arange(0, n_blocks, DIRBLOCKS)
+    if len(starts) > DIR_SIZE:
+        raise ValueError(f'{n_blocks} data blocks need more than {DIR_SIZE} '
+                         'directory entries')
+    entries = np.zeros(len(starts), dtype=DIR_ENTRY_DTYPE)
+    entries['blockNumber'] = DATA_START + starts
+    entries['numBlocks'] = np.minimum(DIRBLOCKS, n_blocks - starts)
+    entries['sampleRate'] = int(sample_rate)
+    entries['flag'] = BLOCK_FLAG
+    return entries
+
+
+def main():
+    """
+    Write a synthetic LCHEAPO file
+    """
+    args = _get_args()
+    duration = args.duration
+    if args.size_mb:
+        duration = size_duration(args.size_mb, args.channels,
+                                 args.sample_rate)
+    faults = {k: getattr(args, k) for k in FAULT_TYPES if getattr(args, k)}
+    info = write_synthetic(args.outfile, n_chans=args.channels,
+                           sample_rate=args.sample_rate, duration=duration,
+                           starttime=args.start, faults=faults,
+                           seed=args.seed)
+    size = Path(args.outfile).stat().st_size
+    print(f'{args.outfile}: {info["n_blocks"]:d} data blocks '
+          f'({size / 2**20:.1f} MB)')
+    for k, blocks in info['faults'].items():
+        if blocks:
+            what = 'directory entries' if k == 'bug3' else 'blocks'
+            print(f'    {k}: {what} {blocks}')
+    return 0
+
+
+def _get_args():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("outfile", help="Output filename")
+    parser.add_argument("-c", "--channels", type=int, default=4,
+                        choices=(1, 2, 4, 8), help="number of channels")
+    parser.add_argument("-r", "--sample_rate", type=int, default=125,
+                        help="header sample rate (31=31.25, 62=62.5 sps)")
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument("--duration", type=float, default=3600.,
+                      help="data length in seconds (default 3600)")
+    size.add_argument("--size_mb", type=float,
+                      help="approximate file size in MB (instead of "
+                           "--duration)")
+    parser.add_argument("--start", type=datetime.fromisoformat,
+                        default=datetime(2022, 1, 1),
+                        help="data start time (ISO format)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random generator seed")
+    for k in FAULT_TYPES:
+        parser.add_argument(f"--{k}", type=int, default=0, metavar='N',
+                            help=f"number of {k} faults to inject")
+    parser.add_argument("--version", action='version',
+                        version=f'%(prog)s {__version__}')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
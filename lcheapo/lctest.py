@@ -0,0 +1,664 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Plot LCHEAPO test results
+
+Reads parameters from a lctest.yaml file
+Plots:
+    - time_series of one or more stations/channels
+    - stacks of time series from one station/channel
+    - spectra from  multiple stations/channels
+    - particle_motions between two channels
+
+There are 4 sections in each lctest.yaml file:
+
+- ``input``: input data parameters
+    - ``datafiles``: a list of the LCHEAPO files to read, each item contains:
+        - ``name``: the filename
+        - ``obs_type``: the obs type (for spectra plots).  possible values are
+                        given in the help for ``lcplot``
+        - ``station``: station name to use for all channels of this file
+
+- ``output``: output plot file parameters
+    - ``show``: show the plots?  If False, just save them to files
+    - ``filebase``: start of each output filename (may include directory)
+
+- ``plots``: the plots to make
+    - ``time_series``: a list of waveform plots to make, each item contains:
+        - ``description``: plot title
+        - ``select``: parameters to select a subset of the
+                      waveforms (see obspy.core.stream.Stream.select())
+        - ``start_time``: plot start time (null: start of data)
+        - ``end_time``: plot end time (null: end of data)
+
+    - ``spectra``: list of spectra plots to make, each item contains:
+        - ``description``: plot title
+        - ``select``: as in ``time_series``
+        - ``start_time``: data start time
+        - ``end_time``: data end time
+        - ``overlay``: overlay spectra on one plot? (True)
+        - ``window_length.s``: spectral window length
+
+    - ``stack``: a list of stacked waveform plots to make.
+               Useful when you performed a test action (tap, lift, jump, etc)
+               several times.
+               Each item contains:
+        - ``description``: plot title
+        - ``components``: a list of orientation codes to plot (one plot
+                                 for each orientation code)
+        - ``times``: list of times to plot at (each one "yyyy-mm-ddTHH:MM:SS")
+        - ``offset_before.s``: start plot this many seconds before each `time`
+        - ``offset_after.s``: end plot this many seconds after each ``time``
+        - ``plot_span``: also plot a time series spanning all of the ``times``
+
+    - ``particle_motion``: a list of particle motion plots to make.
+                           Use to evaluate the orientation and polarity of
+                           the channels.
+                           Each item contains:
+        - ``description``**: as in ``time_series``
+        - ``component_x``: component to plot on the x axis
+        - ``component_y``: component code to plot on the y axis
+        - ``times``: as in ``stack```
+        - ``particle_offset_before.s``: start particle motion plot this many
+                                        seconds before each ``time``
+        - ``particle_offset_after.s``: end particle motion plot this many
+                                       seconds after each ``time``
+        - ``offset_before.s``: start time series plot this many seconds before
+                               each ``time``
+        - ``offset_after.s``: end time series plot this many seconds after
+                              each ``time``
+
+``plot_globals`` [optional]: Default values for each type of plot.
+                             Same parameters as for ``plots``
+
+The plots are made in two stages: the time windows of all of the plots are
+collected first and each datafile is read once, over the union of these
+windows.  Each plot then gets slices of the read data and the plots are
+rendered in parallel (``-j``).
+"""
+import argparse
+import re
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from obspy.core import UTCDateTime, Stream
+
+from .batch_plot import PlotSpec, new_figure, render_all
+from .lcread import read as lcread, get_data_timelimits
+from .spectral import PSDs
+from .yaml_json import load_yaml_json
+from . import profiling
+
+PLOT_TYPES = ('time_series', 'spectra', 'stack', 'particle_motion')
+MERGE_GAP = 3600  # read windows closer than this (seconds) together
+
+
+class ReadCache:
+    """
+    Reads LCHEAPO datafiles once for many time windows
+
+    Windows are registered with request(), load() reads the union of the
+    windows from each file, then get() returns slices of the read data.
+    Datafiles with the same name and obs_type (the same instrument under
+    several station names) are only read once.
+    """
+    def __init__(self, datafiles, max_gap=MERGE_GAP, verbose=False):
+        """
+        :param datafiles: list of dict(name=, obs_type=, station=)
+        :param max_gap: read windows separated by less than this many
+            seconds in one piece
+        :param verbose: print each read
+        """
+        self.datafiles = datafiles
+        self.max_gap = max_gap
+        self.verbose = verbose
+        self.n_reads = 0
+        self._limits = {}
+        self._windows = {}
+        self._spans = {}
+        for df in datafiles:
+            key = self._key(df)
+            if key not in self._limits:
+                self._limits[key] = get_data_timelimits(df['name'])
+                self._windows[key] = []
+
+    def __repr__(self):
+        return 'ReadCache({:d} files, {:d} reads)'.format(len(self._limits),
+                                                         self.n_reads)
+
+    @staticmethod
+    def _key(datafile):
+        return (datafile['name'], datafile['obs_type'])
+
+    def request(self, starttime=None, endtime=None):
+        """
+        Register a time window to read from every datafile
+
+        :param starttime: window start (None: start of each file)
+        :param endtime: window end (None: end of each file)
+        """
+        for key, windows in self._windows.items():
+            window = self._clip(key, starttime, endtime)
+            if window is not None:
+                windows.append(window)
+
+    def load(self):
+        """
+        Read the union of the requested windows from each datafile
+
+        :returns: number of reads
+        """
+        for key, windows in self._windows.items():
+            self._spans[key] = []
+            for start, end in _merge_windows(windows, self.max_gap):
+                if self.verbose:
+                    print(f'Reading {key[0]}, {start} - {end}')
+                st = lcread(key[0], start, end, obs_type=key[1])
+                self.n_reads += 1
+                if st is not None:
+                    self._spans[key].append((start, end, st))
+        return self.n_reads
+
+    def get(self, starttime=None, endtime=None, select=None):
+        """
+        Return the data of all datafiles in a time window
+
+        The traces are slices of the read data (the samples are not copied)
+
+        :param starttime: window start (None: start of each file)
+        :param endtime: window end (None: end of each file)
+        :param select: keyword arguments for Stream.select()
+        :returns: Stream, or None if there are no data
+        """
+        stream = Stream()
+        for df in self.datafiles:
+            key = self._key(df)
+            window = self._clip(key, starttime, endtime)
+            if window is None:
+                continue
+            for start, end, st in self._spans.get(key, []):
+                if start >= window[1] or end <= window[0]:
+                    continue
+                for tr in st.slice(max(start, window[0]),
+                                   min(end, window[1]) - 1e-6,
+                                   nearest_sample=False):
+                    tr.stats.station = df['station']
+                    stream.append(tr)
+        if select:
+            stream = stream.select(**select)
+        if len(stream) == 0:
+            print('No data between {} and {} found in any file'.format(
+                starttime, endtime))
+            return None
+        return stream
+
+    def _clip(self, key, starttime, endtime):
+        """
+        Return (starttime, endtime) within a file's limits, or None
+        """
+        data_start, data_end = self._limits[key]
+        if data_start is None:
+            return None
+        start = data_start if starttime is None else max(
+            UTCDateTime(starttime), data_start)
+        end = data_end if endtime is None else min(UTCDateTime(endtime),
+                                                   data_end)
+        if end <= start:
+            return None
+        return start, end
+
+
+@profiling.profile_main
+def main():
+    """
+    Read the yaml file and plot the specified tests
+    """
+    args = get_arguments()
+    profiling.start(args)
+    root = read_lctest_yaml(args.yaml_file)
+    show = root['output']['show']
+    filebase = root['output']['filebase']
+    if not filebase:
+        if not show:
+            print('output: show is False and no filebase, nothing to do')
+            return 0
+        filebase = str(Path(tempfile.mkdtemp()) / 'lctest')
+    files = run(root, filebase, args.jobs, args.verbose)
+    if show:
+        _show_files(files)
+    return 0
+
+
+def run(root, filebase, jobs=1, verbose=False):
+    """
+    Make the plots of an lctest configuration
+
+    :param root: lctest configuration
+    :param filebase: start of each output filename
+    :param jobs: number of plotting processes
+    :param verbose: be verbose
+    :returns: list of plotted files
+    """
+    stages = plot_stages(root)
+    cache = ReadCache(root['input']['datafiles'], verbose=verbose)
+    for stage in stages:
+        cache.request(*stage['window'])
+    cache.load()
+    if verbose:
+        print(cache)
+    specs = []
+    for stage in stages:
+        stream = cache.get(*stage['window'],
+                           select=stage['plot_info'].get('select'))
+        if stream is not None:
+            specs.extend(_STAGE_SPECS[stage['type']](
+                stream, stage['plot_info'], filebase))
+    # With jobs > 1, the stages of the plotting processes are not profiled
+    with profiling.stage('render'):
+        return render_all(specs, jobs, verbose)
+
+
+def plot_stages(root):
+    """
+    Return the plots of an lctest configuration, completed by plot_globals
+
+    :returns: list of dict(type=, plot_info=, window=(starttime, endtime))
+    """
+    plot_globals = get_plot_globals(root) or {}
+    stages = []
+    for plot_type in PLOT_TYPES:
+        for plot_info in root['plots'].get(plot_type, []):
+            plot_info = _add_defaults(dict(plot_info),
+                                      plot_globals.get(plot_type, None))
+            if plot_type in ('time_series', 'spectra'):
+                window = (plot_info.get('start_time'),
+                          plot_info.get('end_time'))
+            else:
+                window = _get_time_limits(plot_info)
+            stages.append(dict(type=plot_type, plot_info=plot_info,
+                               window=window))
+    return stages
+
+
+def _time_series_specs(stream, plot_info, filebase):
+    title = plot_info["description"]
+    outfile = _make_plot_filename(filebase, plot_info.get('select', None),
+                                  'ts', title)
+    return [PlotSpec(plot_time_series, outfile, stream=stream, title=title)]
+
+
+def _spectra_specs(stream, plot_info, filebase):
+    title = plot_info["description"]
+    outfile = _make_plot_filename(filebase, plot_info.get('select', None),
+                                  'spectra', title)
+    return [PlotSpec(plot_spect, outfile, stream=stream, title=title,
+                     window_length=plot_info.get('window_length.s', 1000),
+                     overlay=plot_info.get('overlay', True))]
+
+
+def _stack_specs(stream, plot_info, filebase):
+    specs = []
+    times = [UTCDateTime(t) for t in plot_info['times']]
+    offset_before = plot_info.get('offset_before.s', None)
+    offset_after = plot_info.get('offset_after.s', None)
+    for o_code in plot_info['components']:
+        for trace in _stream_component(stream, o_code):
+            title = plot_info['description'] + f', {trace.get_id()}'
+            outfile = _make_plot_filename(
+                filebase, plot_info.get('select', None), 'stack', title)
+            specs.append(PlotSpec(
+                plot_stack, outfile, trace=trace, times=times,
+                offset_before=offset_before, offset_after=offset_after,
+                title=title))
+    if plot_info.get('plot_span', False):
+        title = plot_info['description']
+        outfile = _make_plot_filename(
+            filebase, plot_info.get('select', None), 'span', title)
+        specs.append(PlotSpec(plot_time_series, outfile,
+                              stream=_span(times, stream), title=title))
+    return specs
+
+
+def _particle_motion_specs(stream, plot_info, filebase):
+    specs = []
+    times = [UTCDateTime(t) for t in plot_info['times']]
+    streamx = _stream_component(stream, plot_info['component_x'])
+    streamy = _stream_component(stream, plot_info['component_y'])
+    for tracex in streamx:
+        tracey = streamy.select(station=tracex.stats.station)[0]
+        title = '{}, {} vs {}'.format(plot_info['description'],
+                                      tracex.get_id(), tracey.get_id())
+        outfile = _make_plot_filename(filebase, plot_info.get('select', None),
+                                      'pm', title)
+        specs.append(PlotSpec(
+            plot_particle_motion, outfile, tracex=tracex, tracey=tracey,
+            times=times,
+            offset_before=plot_info.get('particle_offset_before.s', None),
+            offset_after=plot_info.get('particle_offset_after.s', None),
+            offset_before_ts=plot_info.get('offset_before.s', None),
+            offset_after_ts=plot_info.get('offset_after.s', None),
+            title=title))
+    if plot_info.get('plot_span', False):
+        title = plot_info['description']
+        outfile = _make_plot_filename(
+            filebase, plot_info.get('select', None), 'span', title)
+        specs.append(PlotSpec(plot_time_series, outfile,
+                              stream=_span(times, streamx + streamy),
+                              title=title))
+    return specs
+
+
+_STAGE_SPECS = {'time_series': _time_series_specs,
+                'spectra': _spectra_specs,
+                'stack': _stack_specs,
+                'particle_motion': _particle_motion_specs}
+
+
+def plot_spect(filename, stream, title, window_length=1000, overlay=True):
+    """
+    Calculate and plot spectra
+
+    Args:
+        filename (str): output file
+        stream (:class:`obspy.core.stream.Stream`): data
+        title (str): plot title
+        window_length (float): spectral window length (seconds)
+        overlay (bool): overlay the spectra on one plot
+    """
+    psds = PSDs.calc(stream, window_length=window_length)
+    fig = new_figure(figsize=(8, 6))
+    if overlay:
+        ax = fig.add_subplot()
+        for i, p in enumerate(psds.PSDs):
+            n_lines = len(ax.lines)
+            p.plot(ax=ax, show=False, show_Peterson=(i == 0))
+            ax.lines[n_lines].set_label(_seed_id(p.stats))
+        ax.legend(fontsize='small')
+        ax.set_title(title)
+    else:
+        n_rows = int(np.floor(np.sqrt(len(psds))))
+        n_cols = int(np.ceil(len(psds) / n_rows))
+        for i, p in enumerate(psds.PSDs):
+            p.plot(ax=fig.add_subplot(n_rows, n_cols, i + 1), show=False)
+        fig.suptitle(title)
+    fig.savefig(filename)
+
+
+def plot_time_series(filename, stream, title):
+    """
+    Plot a time series, one panel per trace
+
+    Args:
+        filename (str): output file
+        stream (:class:`obspy.core.stream.Stream`): data
+        title (str): plot title
+    """
+    fig = new_figure(figsize=(8, 6))
+    axs = fig.subplots(len(stream), 1, sharex=True, squeeze=False)[:, 0]
+    for ax, tr in zip(axs, stream):
+        ax.plot(tr.times('matplotlib'), tr.data, 'k', linewidth=0.5)
+        ax.set_ylabel(tr.id, fontsize='small')
+    axs[-1].xaxis_date()
+    fig.autofmt_xdate()
+    fig.suptitle(title)
+    fig.savefig(filename)
+
+
+def plot_stack(filename, trace, times, offset_before, offset_after, title):
+    """
+    Plot a stack of time series from one trace
+
+    Args:
+        filename (str): output file
+        trace (:class:`obspy.core.trace.Trace`): data
+        times (list of :class:`obspy.UTCDateTime`): stack times
+        offset_before (float): start each plot this many seconds before
+            its time
+        offset_after (float): end each plot this many seconds after its
+            time
+        title (str): plot title
+    """
+    assert offset_before >= 0,\
+        f'plot_stack "{title}": offset_before < 0 ({offset_before:g})'
+    assert offset_after > 0,\
+        f'plot_stack "{title}": offset_after <= 0 ({offset_after:g})'
+    colors = _rainbow(len(times))
+    fig = new_figure()
+    ax = fig.add_subplot()
+    # Set up y axis range
+    max_val = max([np.abs(trace.slice(time - offset_before,
+                                      time + offset_after).data).max(initial=0)
+                   for time in times])
+    # Plot the subtraces
+    offset_vertical = 0
+    for time, c in zip(times, colors):
+        offset_vertical += max_val
+        t = trace.slice(time - offset_before, time + offset_after)
+        ax.plot(t.times("utcdatetime") - time,
+                t.data - offset_vertical, color=c,
+                label=time.strftime('%H:%M:%S') +
+                '.{:02d}'.format(int(time.microsecond / 1e4)))
+        offset_vertical += max_val
+    ax.set_title(title)
+    ax.grid()
+    ax.legend()
+    fig.savefig(filename)
+
+
+def plot_particle_motion(filename, tracex, tracey, times, offset_before,
+                         offset_after, offset_before_ts, offset_after_ts,
+                         title):
+    """
+    Plot particle motions
+
+    Args:
+        filename (str): output file
+        tracex (:class:`obspy.core.trace.Trace`): to plot on x axis
+        tracey (:class:`obspy.core.trace.Trace`): to plot on y axis
+        times (list of :class:`obspy.UTCDateTime`): event times
+        offset_before, offset_after (float): particle motion window around
+            each time (seconds)
+        offset_before_ts, offset_after_ts (float): time series window around
+            each time (seconds)
+        title (str): plot title
+    """
+    # Setup axis grid
+    fig = new_figure()
+    gs = fig.add_gridspec(2, 3, hspace=0, wspace=0)
+    # two columns, one row:
+    axx = fig.add_subplot(gs[0, :2])
+    axy = fig.add_subplot(gs[1, :2], sharex=axx, sharey=axx)
+    # one column, one row
+    axxy = fig.add_subplot(gs[1, 2], sharey=axy)
+    tx_comp = tracex.stats.channel[-1]
+    ty_comp = tracey.stats.channel[-1]
+    for time in times:
+        # time series plots
+        _plot_one_ts(axx, tracex, tx_comp, time,
+                     offset_before, offset_after,
+                     offset_before_ts, offset_after_ts)
+        _plot_one_ts(axy, tracey, ty_comp, time,
+                     offset_before, offset_after,
+                     offset_before_ts, offset_after_ts)
+
+        # partical motion plot
+        tx = tracex.slice(time - offset_before, time + offset_after)
+        ty = tracey.slice(time - offset_before, time + offset_after)
+        n = min(tx.stats.npts, ty.stats.npts)
+        axxy.plot(tx.data[:n], ty.data[:n])
+    axxy.axvline(0)
+    axxy.axhline(0)
+    axxy.set_aspect('equal', 'datalim')
+    axxy.set_xlabel(tx_comp)
+    fig.suptitle(title)
+    fig.savefig(filename)
+
+
+def _plot_one_ts(ax, trace, comp, time, offset_before_pm, offset_after_pm,
+                 offset_before, offset_after):
+    t = trace.slice(time - offset_before, time + offset_after)
+    ax.plot(t.times("utcdatetime") - time, t.data)
+    ax.axvline(-offset_before_pm, color='k', linestyle='--')
+    ax.axvline(offset_after_pm, color='k', linestyle='--')
+    ax.set_ylabel(comp)
+
+
+def _merge_windows(windows, max_gap=0):
+    """
+    Return the union of (starttime, endtime) windows, sorted
+
+    Windows separated by less than max_gap seconds are merged
+    """
+    merged = []
+    for start, end in sorted(windows):
+        if merged and start - merged[-1][1] <= max_gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(w) for w in merged]
+
+
+def _rainbow(n):
+    from matplotlib import cm
+    return cm.rainbow(np.linspace(0, 1, n))
+
+
+def _seed_id(stats):
+    return '{}.{}.{}.{}'.format(stats.network, stats.station, stats.location,
+                                stats.channel)
+
+
+def _span(times, stream):
+    """ Return the data spanning the times, with half the span on each side """
+    first = min(times)
+    last = max(times)
+    span = last - first
+    return stream.slice(first - span / 2, last + span / 2)
+
+
+def _show_files(files):
+    """ Show plotted files on screen """
+    from matplotlib import pyplot as plt
+    for f in files:
+        fig = plt.figure()
+        ax = fig.add_axes([0, 0, 1, 1])
+        ax.imshow(plt.imread(f))
+        ax.set_axis_off()
+    plt.show()
+
+
+def _stream_component(stream, component):
+    """ Return the traces corresponding to the given component """
+    try:
+        return stream.select(component=component)
+    except IndexError:
+        print(f'Did not find component {component}')
+        sys.exit()
+
+
+def _get_time_limits(plot_info):
+    """
+    Get time limits for an object containing offsets and a list of `times`
+
+    Args:
+        plot_info (dict): dictionary containing ``times`` and
+            `offset_before.s`, `offset_after.s` and/or
+            `particle_offset_before.s`, `particle_offset_after.s` elements
+    Returns:
+        starttime, endtime (:class:`obspy.UTCDateTime`)
+    """
+    max_offset_before = max(plot_info.get(k, 0) for k in (
+        'offset_before.s', 'particle_offset_before.s', 'offset_before_ts.s'))
+    max_offset_after = max(plot_info.get(k, 0) for k in (
+        'offset_after.s', 'particle_offset_after.s', 'offset_after_ts.s'))
+    times = [UTCDateTime(t) for t in plot_info['times']]
+    min_time = min(times) - max_offset_before
+    max_time = max(times) + max_offset_after
+    if plot_info.get('plot_span', False):
+        span = max(times) - min(times)
+        min_time = min(min_time, min(times) - span / 2)
+        max_time = max(max_time, max(times) + span / 2)
+    return min_time, max_time
+
+
+def _make_plot_filename(filebase, selectargs, plot_type, type_info,
+                        suffix='.png'):
+    """
+    Makes a valid filename from the list of elements
+
+    Args:
+        filebase (str): start of filename (may include directories)
+        selectargs (dict): arguments provided to "select()""
+        plot_type (str)): 'spectra', 'ts', 'stack', 'pm', 'span'
+        type_info (str)): information specific to the plot type
+    """
+    filepath = Path(filebase)
+    filebase = filepath.name
+    fileparent = filepath.parent
+    fileparent.mkdir(exist_ok=True)
+    if selectargs is not None:
+        select_strs = '_'.join([key+arg for key, arg in selectargs.items()])
+    else:
+        select_strs = ''
+    cleaned = [_get_valid_filename(e) for e in (filebase, plot_type,
+                                                select_strs, type_info)]
+    assert suffix[0] == '.'
+    return str(fileparent / ('_'.join(cleaned) + suffix))
+
+
+def _add_defaults(localdict, defaultdict):
+    """
+    Returns localdict, completed by defaultdict
+
+    If a key is in defaultdict and not in localdict, add to localdict
+    """
+    if defaultdict is None:
+        return localdict
+    for k, v in defaultdict.items():
+        if k not in localdict:
+            localdict[k] = v
+    return localdict
+
+
+def get_plot_globals(root):
+    """
+    Return global plot values
+    """
+    globals = root.get('plot_globals', None)
+    return globals
+
+
+def get_arguments():
+    """
+    Get command line arguments
+    """
+    p = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('yaml_file', help='YAML parameter file')
+    p.add_argument("-v", "--verbose", default=False, action='store_true',
+                   help="verbose")
+    p.add_argument("-j", "--jobs", type=int, default=1,
+                   help="number of plotting processes")
+    profiling.add_arguments(p)
+    return p.parse_args()
+
+
+def _get_valid_filename(s):
+    assert isinstance(s, str)
+    s = s.strip().replace(' ', '_')
+    return re.sub(r'(?u)[^-\w.]', '', s)
+
+
+def read_lctest_yaml(filename):
+    """
+    Verify and read in an lctest yaml file
+    """
+    root, _ = load_yaml_json(filename)
+    return root
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Verify the integrity of LCHEAPO files without fixing them
+
+Scans all data blocks (a chunk at a time) and counts:
+    bad_mux: channel number impossible, or not following that of the last
+        block with a possible channel number
+    bad_blockFlag, bad_numberOfSamples, bad_U1, bad_U2: unexpected header
+        values (same tests as lcfix)
+    bad_time: invalid date, or date outside of [--min_time, --max_time]
+    zero_data: all-zero data blocks
+    saturated_data: data blocks containing a full-scale (+-2^23) sample
+
+Can also write per-block CRC32s, or check a file against previously
+written CRC32s (for example, to validate a copy)
+"""
+import argparse
+import json
+import sys
+import zlib
+from pathlib import Path
+
+import numpy as np
+from sdpchainpy import ProcessStep
+
+from .lcheapo_utils import LCDiskHeader, BLOCK_SIZE
+from .lcscan import (map_blocks, header_times, n_file_blocks,
+                     SAMPLES_PER_BLOCK, CHUNK_BLOCKS)
+from .version import __version__
+
+# Expected non-time header values (as in lcfix)
+EXPECTED_VALUES = {'blockFlag': 73, 'numberOfSamples': 166, 'U1': 3,
+                   'U2': 166}
+CHECKS = ('bad_mux',) + tuple(f'bad_{k}' for k in EXPECTED_VALUES) + \
+    ('bad_time', 'zero_data', 'saturated_data')
+MAX_LISTED = 20  # maximum number of bad blocks listed for each check
+
+
+def verify(filename, n_channels=None, first_block=None, min_time='2000-01-01',
+           max_time=None, crcs=False, chunk_blocks=CHUNK_BLOCKS):
+    """
+    Verify an LCHEAPO file's data blocks
+
+    Args:
+        filename (str or Path): LCHEAPO file
+        n_channels (int): number of channels (None: from the header, or
+            estimated from the first blocks if there is no header)
+        first_block (int): first data block (None: from the header, or 0)
+        min_time (str or datetime): earliest acceptable block time
+        max_time (str or datetime): latest acceptable block time (None: now)
+        crcs (bool): also calculate each block's CRC32
+        chunk_blocks (int): number of blocks to scan at once
+    Returns:
+        report (dict): results, plus a 'crc32' array if crcs is True
+    """
+    header = _read_header(filename)
+    if first_block is None:
+        first_block = header.dataStart if header else 0
+    if n_channels is None:
+        if header:
+            n_channels = header.numberOfChannels
+        else:
+            n_channels = _estimate_n_channels(filename, first_block)
+    tmin = np.datetime64(min_time, 'ms')
+    tmax = np.datetime64(max_time if max_time else 'now', 'ms')
+
+    blocks = map_blocks(filename, first_block)
+    counts = {k: 0 for k in CHECKS}
+    listed = {k: [] for k in CHECKS}
+    crc32 = np.zeros(len(blocks), dtype=np.uint32) if crcs else None
+    prev = None
+    for i in range(0, len(blocks), chunk_blocks):
+        chunk = blocks[i:i + chunk_blocks]
+        bad = _check_chunk(chunk, n_channels, prev, tmin, tmax)
+        for k, mask in bad.items():
+            counts[k] += int(np.count_nonzero(mask))
+            if len(listed[k]) < MAX_LISTED:
+                listed[k].extend(
+                    (first_block + i
+                     + np.flatnonzero(mask)[:MAX_LISTED - len(listed[k])]
+                     ).tolist())
+        if crcs:
+            crc32[i:i + len(chunk)] = block_crcs(chunk)
+        valid = np.flatnonzero(chunk['muxChannel'] < n_channels)
+        if len(valid):
+            prev = (int(chunk['muxChannel'][valid[-1]]),
+                    int(valid[-1]) - len(chunk))
+        elif prev is not None:
+            prev = (prev[0], prev[1] - len(chunk))
+    report = dict(file=str(filename),
+                  has_header=header is not None,
+                  n_channels=n_channels,
+                  first_block=first_block,
+                  n_blocks=len(blocks),
+                  counts=counts,
+                  first_bad_blocks=listed)
+    if crcs:
+        report['crc32'] = crc32
+    return report
+
+
+def block_crcs(blocks):
+    """
+    Return the CRC32 of each block
+
+    Args:
+        blocks (:class:`numpy.ndarray`): BLOCK_DTYPE array
+    Returns:
+        crcs (:class:`numpy.ndarray`): uint32 array
+    """
+    buf = np.ascontiguousarray(blocks).view(np.uint8).data
+    return np.fromiter((zlib.crc32(buf[j:j + BLOCK_SIZE])
+                        for j in range(0, len(buf), BLOCK_SIZE)),
+                       dtype=np.uint32, count=len(blocks))
+
+
+def write_crcs(crc_file, report):
+    """
+    Save the CRC32s in a verify() report
+    """
+    np.savez(crc_file, crc32=report['crc32'],
+             first_block=report['first_block'])
+
+
+def check_crcs(crc_file, report):
+    """
+    Compare a verify() report's CRC32s with those saved in crc_file
+
+    Only the blocks present in both are compared, so a partial copy can be
+    checked as it grows
+
+    Returns:
+        result (dict): number of compared and mismatched blocks, plus the
+            first mismatched block numbers
+    """
+    with np.load(crc_file) as f:
+        ref, ref_first = f['crc32'], int(f['first_block'])
+    crc32 = report['crc32']
+    offset = report['first_block'] - ref_first
+    if offset < 0:
+        raise ValueError(f'{crc_file} starts after the scanned blocks')
+    n = max(min(len(ref) - offset, len(crc32)), 0)
+    bad = np.flatnonzero(ref[offset:offset + n] != crc32[:n])
+    return dict(compared=n, mismatched=len(bad),
+                first_mismatched=(report['first_block']
+                                  + bad[:MAX_LISTED]).tolist())
+
+
+def main():
+    args = getOptions()
+    process_step = ProcessStep('lcverify',
+                               " ".join(sys.argv),
+                               app_description=__doc__,
+                               app_version=__version__,
+                               parameters=vars(args).copy())
+    in_dir, out_dir, input_files = ProcessStep.setup_paths(
+        args, verbose=args.format == 'text')
+
+    reports, out_files = [], []
+    for filename in input_files:
+        report = verify(Path(in_dir) / filename,
+                        min_time=args.min_time, max_time=args.max_time,
+                        crcs=(args.write_crc or args.check_crc is not None))
+        crc_file = Path(out_dir) / (Path(filename).name + '.crc32.npz')
+        if args.check_crc is not None:
+            ref_file = args.check_crc or crc_file
+            report['crc_check'] = check_crcs(ref_file, report)
+        if args.write_crc:
+            write_crcs(crc_file, report)
+            report['crc_file'] = str(crc_file)
+            out_files.append(crc_file.name)
+        report.pop('crc32', None)
+        reports.append(report)
+        if args.format == 'text':
+            _print_report(report)
+    if args.format == 'json':
+        print(json.dumps(reports, indent=2))
+    problems = any(sum(r['counts'].values()) > 0
+                   or r.get('crc_check', {}).get('mismatched', 0) > 0
+                   for r in reports)
+    exit_status = 2 if problems else 0
+    process_step.output_files = out_files
+    process_step.exit_status = exit_status
+    process_step.write(in_dir, out_dir, quiet=True)
+    sys.exit(exit_status)
+
+
+def getOptions():
+    """
+    Parse user passed options and parameters.
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_files", metavar="inFileName", nargs='+',
+                        help="Input filename(s)")
+    parser.add_argument("-f", "--format", choices=['text', 'json'],
+                        default='text', help="report format")
+    parser.add_argument("--min_time", default='2000-01-01',
+                        help="earliest valid block time (%(default)s)")
+    parser.add_argument("--max_time", default=None,
+                        help="latest valid block time (default: now)")
+    parser.add_argument("--write_crc", action='store_true',
+                        help="write per-block CRC32s to "
+                             "OUT_DIR/{inFileName}.crc32.npz")
+    parser.add_argument("--check_crc", nargs='?', const='', metavar='CRC_FILE',
+                        help="compare blocks to CRC32s written with "
+                             "--write_crc (default CRC_FILE: "
+                             "OUT_DIR/{inFileName}.crc32.npz)")
+    parser.add_argument("-d", dest="base_dir", metavar="BASE_DIR",
+                        default='.', help="base directory for files")
+    parser.add_argument("-i", dest="in_dir", metavar="IN_DIR",
+                        default='.', help="input file directory (absolute, " +
+                                          "or relative to base_dir)")
+    parser.add_argument("-o", dest="out_dir", metavar="OUT_DIR",
+                        default='.', help="CRC file directory (absolute, " +
+                                          "or relative to base_dir)")
+    parser.add_argument("--version", action='version',
+                        version='%(prog)s {:s}'.format(__version__))
+    args = parser.parse_args()
+    return args
+
+
+def _check_chunk(blocks, n_channels, prev, tmin, tmax):
+    """
+    Return a boolean "bad" mask for each check on a chunk of blocks
+
+    A block's muxChannel is checked against that of the last block with a
+    possible muxChannel (< n_channels), so that a corrupted value does not
+    also flag the next block
+
+    Args:
+        blocks (:class:`numpy.ndarray`): BLOCK_DTYPE array
+        n_channels (int): number of channels
+        prev (tuple): muxChannel and index (negative, relative to this
+            chunk) of the last earlier block with a possible muxChannel, or
+            None
+        tmin, tmax (:class:`numpy.datetime64`): valid time range
+    """
+    bad = {}
+    mux = blocks['muxChannel'].astype(np.int64)
+    index = np.arange(len(mux))
+    possible = mux < n_channels
+    none = np.iinfo(np.int64).min
+    prev_mux, prev_index = prev if prev is not None else (0, none)
+    # Index of the last block with a possible muxChannel before each block
+    ref = np.maximum.accumulate(np.concatenate(
+        ([prev_index], np.where(possible, index, none))))[:-1]
+    ref_mux = np.where(ref >= 0, mux[np.clip(ref, 0, None)], prev_mux)
+    bad['bad_mux'] = ~possible | (
+        (ref != none) & (mux != (ref_mux + index - ref) % n_channels))
+    for key, value in EXPECTED_VALUES.items():
+        bad[f'bad_{key}'] = blocks[key] != value
+    times = header_times(blocks)
+    bad['bad_time'] = np.isnat(times) | (times < tmin) | (times > tmax)
+    data = blocks['data']
+    bad['zero_data'] = ~data.any(axis=1)
+    d = data.reshape(-1, SAMPLES_PER_BLOCK, 3)
+    full_scale = (((d[..., 0] == 0x7F) & (d[..., 1] == 0xFF)
+                   & (d[..., 2] == 0xFF))
+                  | ((d[..., 0] == 0x80) & (d[..., 1] == 0)
+                     & (d[..., 2] == 0)))
+    bad['saturated_data'] = full_scale.any(axis=1)
+    return bad
+
+
+def _read_header(filename):
+    """
+    Return the file's LCDiskHeader, or None if it has none
+    """
+    if n_file_blocks(filename) <= 2:
+        return None
+    lcHeader = LCDiskHeader()
+    with open(filename, 'rb') as fp:
+        if lcHeader.readHeader(fp) == 0:
+            return None
+    return lcHeader
+
+
+def _estimate_n_channels(filename, first_block, n_blocks=16):
+    """
+    Estimate the number of channels from the first blocks' channel numbers
+    """
+    blocks = map_blocks(filename, first_block, n_blocks)
+    return int(blocks['muxChannel'].max()) + 1
+
+
+def _print_report(report):
+    print('-'*60)
+    print(report['file'])
+    print(f"  {report['n_blocks']:d} blocks starting at block "
+          f"{report['first_block']:d}, {report['n_channels']:d} channels"
+          + ("" if report['has_header'] else " (no header)"))
+    for k in CHECKS:
+        n = report['counts'][k]
+        txt = f"  {k:16s} {n:10d}"
+        if n > 0:
+            txt += ' (first: {})'.format(
+                ', '.join(str(x) for x in report['first_bad_blocks'][k][:5]))
+        print(txt)
+    if 'crc_check' in report:
+        c = report['crc_check']
+        print(f"  CRC32: {c['mismatched']:d} of {c['compared']:d} blocks "
+              "mismatched")
+    if 'crc_file' in report:
+        print(f"  CRC32s written to {report['crc_file']}")
+
+
+if __name__ == '__main__':
+    main()
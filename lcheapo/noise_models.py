@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Noise models:
+- Peterson (low and high) seismological noise models
+- Pressure (low and high, hand picked from Brown et al., 2014)
+- 2-pole high-pass filters corresponding to geophone and hydrophone cutoffs
+
+The model knots are converted to log10(period) arrays once, and evaluated
+curves are cached for each period grid, so plotting many panels on the same
+grid does not recompute them.  Periods (or frequencies) can be 1-D, or 2-D
+to evaluate several grids at once (one grid per row).
+"""
+import hashlib
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import scipy.signal as ssig
+
+#        Period    Level       Slope
+LPAB = [[0.10,    -162.36,     5.64],
+        [0.17,    -166.7,      0.00],
+        [0.40,    -170.0,     -8.30],
+        [0.80,    -166.4,     28.90],
+        [1.24,    -168.60,    52.48],
+        [2.40,    -159.98,    29.81],
+        [4.30,    -141.10,     0.00],
+        [5.00,     -71.36,   -99.77],
+        [6.00,     -97.26,   -66.49],
+        [10.00,   -132.18,   -31.57],
+        [12.00,   -205.27,    36.16],
+        [15.60,    -37.65,  -104.33],
+        [21.90,   -114.37,   -47.10],
+        [31.60,   -160.58,   -16.28],
+        [45.00,   -187.50,     0.00],
+        [70.00,   -216.47,    15.70],
+        [101.00,  -185.00,     0.00],
+        [154.00,  -168.34,    -7.61],
+        [328.00,  -217.43,    11.90],
+        [600.00,  -258.28,    26.60],
+        [10000.0, -346.88,    48.75],
+        [100000,  -346.88,    48.75]]
+
+HPAB = [[0.10,    -108.73,   -17.23],
+        [0.22,    -150.34,   -80.50],
+        [0.32,    -122.31,   -23.87],
+        [0.80,    -116.85,    32.51],
+        [3.80,    -108.48,    18.08],
+        [4.60,     -74.66,   -32.95],
+        [6.30,       0.66,  -127.18],
+        [7.90,     -93.37,   -22.42],
+        [15.40,     73.54,  -162.98],
+        [20.00,   -151.52,    10.01],
+        [354.80,  -206.66,    31.63],
+        [100000,  -206.66,    31.63]]
+
+# The following values are re uPa^2/Hz, converted to Pa^2/Hz below
+#        Period    Level
+B_high = [[0.01,      82],
+          [0.02,      89],
+          [0.05,      95],
+          [0.10,      95],
+          [0.20,     100],
+          [0.50,     105],
+          [1.0,      118],
+          [2.0,      127],
+          [5.0,      154],
+          [10.0,     140],
+          [20.0,     140],
+          [50.0,     140],
+          [100.0,    140],
+          [100000,   140]]
+
+B_low = [[0.01,     64],
+         [0.02,     72.5],
+         [0.05,     71],
+         [0.10,     71],
+         [0.20,     72],
+         [0.50,     90],
+         [1.0,      95],
+         [2.0,     113],
+         [5.0,     130],
+         [7.0,     111],
+         [10.0,    111],
+         [20.0,    111],
+         [50.0,    111],
+         [100.0,   111],
+         [100000,  111]]
+
+MAX_CACHED = 256  # maximum number of cached (model, grid) curves
+
+
+def _line_knots(model):
+    """
+    Return log10(periods), levels of a [period, level, slope] model
+    """
+    model = np.array(model, dtype=float)
+    return (np.log10(model[:, 0]),
+            model[:, 1] + model[:, 2] * np.log10(model[:, 0]))
+
+
+def _level_knots(model, offset=0.):
+    """
+    Return log10(periods), levels of a [period, level] model
+    """
+    model = np.array(model, dtype=float)
+    return np.log10(model[:, 0]), model[:, 1] + offset
+
+
+# name: (low, high) knots, each (log10(periods), levels)
+_KNOTS = {'Peterson': (_line_knots(LPAB), _line_knots(HPAB)),
+          'Brown': (_level_knots(B_low, -120), _level_knots(B_high, -120))}
+for _low, _high in _KNOTS.values():
+    for _xp, _yp in (_low, _high):
+        assert np.all(np.diff(_xp) > 0), 'xp is not increasing'
+        _xp.setflags(write=False)
+        _yp.setflags(write=False)
+# Knot levels, as [[period, level], ...] (Peterson models without slopes)
+P_low = np.column_stack((10**_KNOTS['Peterson'][0][0],
+                         _KNOTS['Peterson'][0][1])).tolist()
+P_high = np.column_stack((10**_KNOTS['Peterson'][1][0],
+                          _KNOTS['Peterson'][1][1])).tolist()
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def PetersonNoiseModel(periods, as_freqs=False):
+    """
+    Return Peterson low and high seismological noise models
+
+    returns the acceleration noise models in dB ref to 1 (m/s^2)^2/Hz
+
+    Args:
+        periods (array-like): periods to use (should be increasing).  1-D,
+            or 2-D for several grids (one per row)
+        as_freqs (bool): interpret "periods" as frequencies instead
+    Returns:
+        lownoise, highnoise (:class:`numpy.ndarray`): read-only arrays,
+            same shape as periods, NaN outside of the model
+    """
+    return noise_model('Peterson', periods, as_freqs)
+
+
+def BrownNoiseModel(periods, as_freqs=False):
+    """
+    Return Brown low and high presure noise models in dB ref to 1 Pa^2/Hz
+
+    Args:
+        periods (array-like): periods to use (should be increasing).  1-D,
+            or 2-D for several grids (one per row)
+        as_freqs (bool): interpret "periods" as frequencies instead
+    Returns:
+        lownoise, highnoise (:class:`numpy.ndarray`): read-only arrays
+    """
+    return noise_model('Brown', periods, as_freqs)
+
+
+def noise_model(name, periods, as_freqs=False):
+    """
+    Return the low and high levels of a named noise model
+
+    Results are cached by (model, grid)
+
+    Args:
+        name (str): 'Peterson' or 'Brown'
+        periods (array-like): periods to use (should be increasing).  1-D,
+            or 2-D for several grids (one per row)
+        as_freqs (bool): interpret "periods" as frequencies instead
+    """
+    periods = np.asarray(periods, dtype=float)
+    key = (name, bool(as_freqs), periods.shape,
+           hashlib.sha1(np.ascontiguousarray(periods).data).hexdigest())
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    low, high = _KNOTS[name]
+    if as_freqs:
+        periods = 1. / periods[..., ::-1]
+    curves = [_fit_points(periods, knots) for knots in (low, high)]
+    if as_freqs:
+        curves = [c[..., ::-1] for c in curves]
+    for c in curves:
+        c.setflags(write=False)
+    curves = tuple(curves)
+    with _cache_lock:
+        _cache[key] = curves
+        while len(_cache) > MAX_CACHED:
+            _cache.popitem(last=False)
+    return curves
+
+
+def two_pole_HP(periods, corner_freq, noise_level):
+    """
+    Return high-pass filter effect on data
+
+    (multipling noise by the correction factor)
+
+    Modified from obspy.paz_to_freq_resp
+
+    Returns:
+        correction (:class:`numpy.ndarray`): dB, same shape as periods
+    """
+    f = 1. / np.asarray(periods, dtype=float)
+    zeros = [0., 0.]
+    p = corner_freq*2*np.pi
+    poles = [p, p]
+    b, a = ssig.zpk2tf(zeros, poles, noise_level)
+    _w, h = ssig.freqs(b, np.atleast_1d(a), f.ravel() * 2 * np.pi)
+    return -20*np.log10(np.abs(h)).reshape(f.shape)
+
+
+def _fit_points(periods, knots):
+    """
+    Fit points to a noise model
+
+    Args:
+        periods (:class:`numpy.ndarray`): periods in increasing order
+            (along the last axis)
+        knots (tuple): log10(periods), levels of the model
+    """
+    x = np.log10(periods)
+    assert np.all(np.diff(x, axis=-1) > 0), 'x is not increasing'
+    xp, yp = knots
+    return np.interp(x.ravel(), xp, yp,
+                     left=np.nan, right=np.nan).reshape(x.shape)
+
+
+if __name__ == '__main__':
+    print('not a command line code')
+    sys.exit(1)
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Timers and counters for the lcheapo hot paths
+
+Instrumented code declares stages (header reads, block reads, decoding,
+Trace building, response loading, miniSEED encoding, file writes...).  While
+profiling is enabled, each stage accumulates its time, bytes and number of
+calls.  It is disabled by default: stage() then returns a shared do-nothing
+context manager and instrument() returns the function it was given, so the
+instrumented code runs as before.
+
+    >>> from lcheapo import profiling
+    >>> profiling.enable()
+    >>> with profiling.stage('decode', nbytes=498):
+    ...     pass
+    >>> profiling.report()['stages']['decode']['calls']
+    1
+    >>> profiling.enable(False)
+
+Stages can be nested: 'seconds' includes the nested stages, 'self_seconds'
+does not.
+
+Console scripts with a --profile option (lcfix, lc2ms_py, lc2SDS_py,
+lcplot, lctest, lcdetect) write the report as JSON and can run cProfile or
+pyinstrument (a sampling profiler) around main().
+"""
+import functools
+import json
+import sys
+import threading
+import time
+from pathlib import Path
+
+ENABLED = False
+PROFILERS = ('cprofile', 'pyinstrument')
+
+_stages = {}  # name: [seconds, self_seconds, bytes, calls]
+_lock = threading.Lock()
+_local = threading.local()
+_start = None
+_session = None
+
+
+class _NullStage:
+    """
+    What stage() returns when profiling is disabled
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    """
+    Times one pass through a stage
+
+    Set nbytes inside the with block if it is only known there
+    """
+    __slots__ = ('name', 'nbytes', 't0', 'nested')
+
+    def __init__(self, name, nbytes):
+        self.name = name
+        self.nbytes = nbytes
+        self.nested = 0.
+
+    def __enter__(self):
+        _stack().append(self)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.t0
+        stack = _stack()
+        stack.pop()
+        if stack:
+            stack[-1].nested += seconds
+        add(self.name, seconds, self.nbytes,
+            self_seconds=seconds - self.nested)
+        return False
+
+
+def _stack():
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+def enable(on=True):
+    """
+    Enable (or disable) profiling and reset the counters
+    """
+    global ENABLED, _start
+    ENABLED = on
+    reset()
+    _start = time.perf_counter() if on else None
+
+
+def reset():
+    """
+    Reset the counters
+    """
+    with _lock:
+        _stages.clear()
+
+
+def stage(name, nbytes=0):
+    """
+    Return a context manager timing a stage
+
+    :param name: stage name
+    :param nbytes: bytes processed
+    """
+    if not ENABLED:
+        return _NULL_STAGE
+    return _Stage(name, nbytes)
+
+
+def add(name, seconds=0., nbytes=0, calls=1, self_seconds=None):
+    """
+    Add to a stage's counters (no-op if profiling is disabled)
+    """
+    if not ENABLED:
+        return
+    if self_seconds is None:
+        self_seconds = seconds
+    with _lock:
+        s = _stages.setdefault(name, [0., 0., 0, 0])
+        s[0] += seconds
+        s[1] += self_seconds
+        s[2] += nbytes
+        s[3] += calls
+
+
+def instrument(name, func, nbytes=0):
+    """
+    Return func, timed as a stage if profiling is enabled
+
+    For per-block functions: call it once, before the loop
+
+    :param name: stage name
+    :param func: function to time
+    :param nbytes: bytes processed per call
+    """
+    if not ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        with _Stage(name, nbytes):
+            return func(*args, **kwargs)
+    return timed
+
+
+class TimedFile:
+    """
+    Binary file whose writes are timed as the 'file_write' stage
+
+    For writers that accept a file-like object (e.g. Trace.write()), to
+    separate their encoding and writing times
+    """
+    def __init__(self, filename, mode='wb'):
+        self._fp = open(filename, mode)
+
+    def write(self, b):
+        with stage('file_write', len(b)):
+            return self._fp.write(b)
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._fp.close()
+        return False
+
+
+def report():
+    """
+    Return the counters
+
+    :returns: dict(wall_seconds, stages={name: dict(seconds, self_seconds,
+        bytes, calls)})
+    """
+    with _lock:
+        stages = {k: dict(seconds=v[0], self_seconds=v[1], bytes=v[2],
+                          calls=v[3])
+                  for k, v in sorted(_stages.items(),
+                                     key=lambda x: -x[1][1])}
+    wall = time.perf_counter() - _start if _start is not None else 0.
+    return dict(command=' '.join(sys.argv), wall_seconds=wall,
+                stages=stages)
+
+
+def add_arguments(parser):
+    """
+    Add --profile and --profiler to a console script's ArgumentParser
+    """
+    parser.add_argument("--profile", metavar="JSON_FILE",
+                        help="write the time, bytes and calls of each "
+                             "processing stage to this file")
+    parser.add_argument("--profiler", choices=PROFILERS,
+                        help="also profile with cProfile or pyinstrument "
+                             "(written next to JSON_FILE, with suffix .prof "
+                             "or .html).  Requires --profile")
+
+
+def start(args):
+    """
+    Start profiling if the command line asked for it
+
+    The report is written when the function decorated by profile_main()
+    ends
+
+    :param args: parsed arguments (see add_arguments())
+    """
+    global _session
+    if not getattr(args, 'profile', None):
+        if getattr(args, 'profiler', None):
+            sys.exit('--profiler requires --profile')
+        return
+    profiler = None
+    if args.profiler == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif args.profiler == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            sys.exit('--profiler pyinstrument requires pyinstrument '
+                     '(pip install pyinstrument)')
+        profiler = Profiler()
+        profiler.start()
+    _session = (Path(args.profile), args.profiler, profiler)
+    enable()
+
+
+def stop():
+    """
+    Stop profiling and write the report(s) started by start()
+    """
+    global _session
+    if _session is None:
+        return
+    path, kind, profiler = _session
+    _session = None
+    if kind == 'cprofile':
+        profiler.disable()
+        profiler.dump_stats(str(path.with_suffix('.prof')))
+    elif kind == 'pyinstrument':
+        profiler.stop()
+        path.with_suffix('.html').write_text(profiler.output_html())
+    path.write_text(json.dumps(report(), indent=2))
+    enable(False)
+    print(f'Profile written to {path}')
+
+
+def profile_main(main):
+    """
+    Decorator for console script main()s that call start()
+
+    Writes the profile however main() ends (including sys.exit())
+    """
+    @functools.wraps(main)
+    def wrapper(*args, **kwargs):
+        try:
+            return main(*args, **kwargs)
+        finally:
+            stop()
+    return wrapper
@@ -1,17 +1,25 @@
+import json
 import math
+import os
 from pathlib import Path
 import re
 from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
 
+from obspy import UTCDateTime
 from obspy.clients.filesystem.sds import Client
 from obspy.core.inventory import read_inventory
 from obspy.signal.spectral_estimation import PPSD
-from matplotlib import pyplot as plt
 
-from .noise_models import PetersonNoiseModel, BrownNoiseModel, two_pole_HP
+from ..batch_plot import PlotSpec, new_figure, render_all
+from ..noise_models import PetersonNoiseModel, BrownNoiseModel
 
 MED_PSD_DIR = 'plot_medPSDs'
 PPSD_DIR = 'plot_PPSDs'
+MANIFEST_FILE = 'manifest.json'
+_worker = {}  # client and inventory of a worker process
 
 def main():
     
@@ -19,25 +27,34 @@ def main():
     
     client = Client(args.sds_dir)
     inv = read_inventory(args.inv_file)
+    inv_index = _index_inventory(inv, verbose=True)
 
     # Get lists of "NET.STA.LOC.CHAN"
     client_nslcs = _client_get_nslc(client, args)
-    inv_nslcs = _inv_get_nslc(inv, args)  # list of 4-tuples, too
+    inv_nslcs = _inv_get_nslc(inv_index, args)
     shared_nslcs = _get_shared_nslcs(client_nslcs, inv_nslcs)
 
+    manifest = _read_manifest(args.state_dir)
     psds = {}
+    specs = []
     Path(PPSD_DIR).mkdir(exist_ok=True)
-    for nslc in shared_nslcs:
-        ppsd = _makePPSD(client, inv, nslc, args)
+    for nslc, ppsd, manifest[nslc] in _iter_ppsds(client, inv, shared_nslcs,
+                                                  args, manifest, inv_index):
+        _write_manifest(args.state_dir, manifest)
         if ppsd is None:
             continue
-        _plot_ppsd(ppsd, nslc, PPSD_DIR)
+        specs.append(_ppsd_plot_spec(ppsd, nslc, PPSD_DIR, args.state_dir))
         periods, psds[nslc] = ppsd.get_mode()
 
     unique_channels = list(set([x.split('.')[3] for x in shared_nslcs]))
     Path(MED_PSD_DIR).mkdir(exist_ok=True)
     for channel in unique_channels:
-        _plot_compare_channel(periods, psds, channel, MED_PSD_DIR)
+        specs.append(PlotSpec(
+            _plot_compare_channel, f'{MED_PSD_DIR}/{channel}.PSDs.png',
+            periods=periods, channel=channel,
+            psds={k: v for k, v in psds.items()
+                  if k.split('.')[3] == channel}))
+    render_all(specs, args.jobs)
 
 
 def _parse_input():
@@ -55,6 +72,20 @@ def _parse_input():
                         help='only stations matching the string ("*" and "?" wildcards accepted)')
     parser.add_argument('-c', '--channels', default='*',
                         help='only channels matching the string ("*" and "?" wildcards accepted)')
+    parser.add_argument('-j', '--jobs', default=1, type=int,
+                        help='number of station-channels to process in '
+                             'parallel (worker processes)')
+    parser.add_argument('--readahead', default=2, type=int,
+                        help='number of days read in background threads '
+                             'while PPSDs are calculated (0: no read-ahead)')
+    parser.add_argument('--state_dir', default=None,
+                        help='directory in which PPSDs are saved between '
+                             'runs ({nslc}.npz) with a manifest of the SDS '
+                             'files already processed.  Only new or '
+                             'modified day files are processed.  Only '
+                             'reuse it with the same --maxdays and '
+                             '--skipdays (default: start from scratch '
+                             'every time)')
     return parser.parse_args()
 
 
@@ -62,23 +93,13 @@ def _get_shared_nslcs(client_nslcs, inv_nslcs, verbose=True):
     """
     Separate nslcs into ones on the client only, on the inventory only, and both
 
-    Return the "both"
+    Return the "both" (in inventory order)
     """
-    shared = []
-    client_only = []
-    inv_only = []
-
-    nslcs = list(inv_nslcs + client_nslcs)  # all unique nslcs
-    for nslc in nslcs:
-        if nslc in client_nslcs:
-            if nslc in inv_nslcs:
-                shared.append(nslc)
-            else:
-                client_only.append(nslc)
-        elif nslc in inv_nslcs:
-            inv_only.append(nslc)
-        else:
-            raise ValueError('{nslc=} not found in Client nor Inventory: IMPOSSIBLE!')
+    client_set = set(client_nslcs)
+    inv_set = set(inv_nslcs)
+    shared = [x for x in dict.fromkeys(inv_nslcs) if x in client_set]
+    client_only = [x for x in dict.fromkeys(client_nslcs) if x not in inv_set]
+    inv_only = [x for x in dict.fromkeys(inv_nslcs) if x not in client_set]
     if verbose:
         print(f'Inventory had {len(inv_nslcs)} station-channels')
         print(f'Client had {len(client_nslcs)} station-channels')
@@ -88,22 +109,80 @@ def _get_shared_nslcs(client_nslcs, inv_nslcs, verbose=True):
     return shared
 
 
-def _inv_get_nslc(inv, args):
+def _index_inventory(inv, verbose=False):
+    """
+    Return {'NET.STA.LOC.CHAN': (start_date, end_date, channel)}
+
+    Built in one pass through the inventory.  Channel dates default to the
+    station's, then to the network's.  An NSLC with several epochs spans
+    from the first start to the last end and has the last epoch's channel.
+    A missing end date is replaced by the current time
+
+    Args:
+        verbose (bool): print, once per NSLC, the dates that were not
+            found at the channel level
+    """
+    index = {}
+    fallbacks = {}
+    now = UTCDateTime()
+    for net in inv:
+        for sta in net:
+            for cha in sta:
+                nslc = '.'.join((net.code, sta.code, cha.location_code,
+                                 cha.code))
+                start_date, level = _first_date('start_date', cha, sta, net)
+                if level != 'Channel':
+                    fallbacks.setdefault(nslc, {})['start_date'] = level
+                end_date, level = _first_date('end_date', cha, sta, net)
+                if level != 'Channel':
+                    fallbacks.setdefault(nslc, {})['end_date'] = level
+                if end_date is None:
+                    end_date = now
+                if nslc in index:
+                    old_start, old_end, old_cha = index[nslc]
+                    if start_date is None or (old_start is not None
+                                              and old_start < start_date):
+                        start_date = old_start
+                    if end_date < old_end:
+                        end_date, cha = old_end, old_cha
+                index[nslc] = (start_date, end_date, cha)
+    if verbose:
+        for nslc, levels in fallbacks.items():
+            print(f'{nslc}: Channel ' + ', '.join(
+                f'{attr} not found, using {level} {attr}'
+                for attr, level in levels.items()))
+    return index
+
+
+def _first_date(attr, cha, sta, net):
+    """
+    Return the channel's start_date or end_date, or the station's, or the
+    network's, and the level it came from ('Channel', 'Station' or
+    'Network')
+    """
+    if getattr(cha, attr) is not None:
+        return getattr(cha, attr), 'Channel'
+    if getattr(sta, attr) is not None:
+        return getattr(sta, attr), 'Station'
+    return getattr(net, attr), 'Network'
+
+
+def _inv_get_nslc(inv_index, args):
     """
     Return nslcs as a list of 'NET.STA.LOC.CHAN'
-    
+
     Only return items matching the station and channel search strings
+
+    Args:
+        inv_index (dict): inventory index (see _index_inventory())
     """
+    sta_match = _fdsn_matcher(args.stations)
+    cha_match = _fdsn_matcher(args.channels)
     nslcs = []
-    for net in inv:
-        for sta in net:
-            if re.match(_fdsn_to_regex(args.stations), sta.code) is None:
-                continue
-            for chan in sta:
-                if re.match(_fdsn_to_regex(args.channels), chan.code) is None:
-                    continue
-                nslcs.append('.'.join((net.code, sta.code, chan.location_code,
-                                       chan.code)))
+    for nslc in inv_index:
+        _, sta, _, cha = nslc.split('.')
+        if sta_match(sta) and cha_match(cha):
+            nslcs.append(nslc)
     return nslcs
 
 def _client_get_nslc(client, args):
@@ -112,13 +191,12 @@ def _client_get_nslc(client, args):
     
     Only return items matching the station and channel search strings
     """
+    sta_match = _fdsn_matcher(args.stations)
+    cha_match = _fdsn_matcher(args.channels)
     nslcs = []
     for x in client.get_all_nslc():
-        if re.match(_fdsn_to_regex(args.stations), x[1]) is None:
-            continue
-        if re.match(_fdsn_to_regex(args.channels), x[3]) is None:
-            continue
-        nslcs.append('.'.join(x))
+        if sta_match(x[1]) and cha_match(x[3]):
+            nslcs.append('.'.join(x))
     return nslcs
 
 def _fdsn_to_regex(x):
@@ -127,60 +205,137 @@ def _fdsn_to_regex(x):
     x = x.replace('?', '.')
     return '^' + x + '$'
 
-def _inv_nslc_date_range(inv, nslc):
-    n,s,l,c = nslc.split('.')
-    nslc_inv = inv.select(network=n, station=s, channel=c, location=l)
-    if len(nslc_inv) == 0:
+def _fdsn_matcher(x):
+    """Return a function testing if a string matches an FDSN search string"""
+    regex = re.compile(_fdsn_to_regex(x))
+    return lambda s: regex.match(s) is not None
+
+def _inv_nslc_date_range(inv_index, nslc):
+    """
+    Return an nslc's start and end dates
+
+    Args:
+        inv_index (dict): inventory index (see _index_inventory())
+    """
+    if nslc not in inv_index:
         raise ValueError(f'{nslc=} not found in inventory!')
-    for net in inv:
-        for sta in net:
-            for cha in sta:
-                if cha.start_date is not None:
-                    start_date = cha.start_date
-                elif sta.start_date is not None:
-                    print(f'{nslc} Channel start_date not found, returning Station start_date')
-                    start_date = sta.start_date
-                elif sta.start_date is not None:
-                    print(f'{nslc} Channel and Station start_date not found, returning Network start_date')
-                    start_date = net.start_date
-                if cha.end_date is not None:
-                    end_date = cha.end_date
-                elif sta.end_date is not None:
-                    print(f'{nslc} Channel end_date not found, returning Station end_date')
-                    end_date = sta.end_date
-                elif sta.start_date is not None:
-                    print(f'{nslc} Channel and Station end_date not found, returning Network end_date')
-                    end_date = net.end_date
+    start_date, end_date, _ = inv_index[nslc]
     return start_date, end_date
 
 
-def _makePPSD(client, inv, nslc, args):
+def _iter_ppsds(client, inv, nslcs, args, manifest, inv_index=None):
+    """
+    Calculate the PPSDs of several NSLCs, in args.jobs worker processes
+
+    Each worker reads the SDS archive and inventory once, then calculates
+    (and saves) whole-NSLC PPSDs.  Progress is printed as they are done.
+
+    Args:
+        manifest (dict): {nslc: manifest} (see _makePPSD())
+        inv_index (dict): inventory index (see _index_inventory())
+    Yields:
+        nslc, ppsd (PPSD or None), manifest: in completion order
+    """
+    n_jobs = len(nslcs)
+    if args.jobs <= 1:
+        if inv_index is None:
+            inv_index = _index_inventory(inv)
+        for i, nslc in enumerate(nslcs, 1):
+            ppsd, nslc_manifest = _makePPSD(client, inv, nslc, args,
+                                            manifest.get(nslc), inv_index)
+            print(f'[{i:d}/{n_jobs:d}] {nslc} done')
+            yield nslc, ppsd, nslc_manifest
+        return
+    with ProcessPoolExecutor(max_workers=args.jobs,
+                             initializer=_init_worker,
+                             initargs=(args.sds_dir, args.inv_file)) as executor:
+        futures = {executor.submit(_ppsd_job, nslc, args, manifest.get(nslc)):
+                   nslc for nslc in nslcs}
+        for i, future in enumerate(as_completed(futures), 1):
+            nslc = futures[future]
+            ppsd, nslc_manifest = future.result()
+            print(f'[{i:d}/{n_jobs:d}] {nslc} done')
+            yield nslc, ppsd, nslc_manifest
+
+
+def _init_worker(sds_dir, inv_file):
+    _worker['client'] = Client(sds_dir)
+    _worker['inv'] = read_inventory(inv_file)
+    _worker['inv_index'] = _index_inventory(_worker['inv'])
+
+
+def _ppsd_job(nslc, args, manifest):
+    return _makePPSD(_worker['client'], _worker['inv'], nslc, args, manifest,
+                     _worker['inv_index'])
+
+
+def _makePPSD(client, inv, nslc, args, manifest=None, inv_index=None):
+    """
+    Calculate or update an NSLC's PPSD
+
+    If args.state_dir is set, the PPSD is read from (and saved to)
+    {state_dir}/{nslc}.npz, and days that were processed from the same SDS
+    files (same modification times and sizes) are skipped.  Segments
+    already in the PPSD are not added again, so a modified day file only
+    adds its new data.
+
+    Args:
+        manifest (dict): {day_start: {sds_file: [mtime_ns, size]}} of the
+            days already processed for this NSLC
+        inv_index (dict): inventory index (see _index_inventory(), made
+            from inv if None)
+    Returns:
+        ppsd (PPSD or None), manifest (dict): updated manifest
+    """
     max_days = args.maxdays
     if max_days >= 1:
         delta = 86400
     else:
         delta = int(max_days*86400)
 
-    ppsd = None    
+    manifest = dict(manifest or {})
+    state_file = None
+    if args.state_dir:
+        state_file = Path(args.state_dir) / f'{nslc}.npz'
+        if not state_file.exists():
+            state_file.parent.mkdir(parents=True, exist_ok=True)
+            manifest = {}
+    ppsd = None
     n,s,l,c = nslc.split('.')
-    start_date, end_date = _inv_nslc_date_range(inv, nslc)
+    if inv_index is None:
+        inv_index = _index_inventory(inv)
+    start_date, end_date = _inv_nslc_date_range(inv_index, nslc)
     if end_date - start_date > (args.skipdays+1)*86400:
         start_date += args.skipdays*86400
-    if end_date-start_date < 86400:
-        start_date 
-    data_days = end_date - start_date
+    data_days = (end_date - start_date) / 86400
     if max_days is None:
-        max_days = math.ceil(data_days / delta)
+        max_days = math.ceil(data_days)
     elif max_days > data_days:
-        print('Reducing max_days ({max_days}) to match {data_days=}')
+        print(f'Reducing max_days ({max_days}) to match {data_days=}')
         max_days = int(math.ceil(data_days))
     print(f'Calculating {max_days}-day PPSD for {nslc=}')
+    days = []
     for day in range(int(math.ceil(max_days))):
         stime = start_date + day*86400.
         etime = stime + delta
-        st = client.get_waveforms(n,s,l,c, stime, etime, merge=1)
+        files = _file_signatures(
+            client._get_filenames(n, s, l, c, stime, etime))
+        if not files:
+            continue
+        if manifest.get(str(stime)) == files:
+            continue
+        days.append((stime, etime, files))
+
+    def read_day(day):
+        stime, etime, _ = day
+        return client.get_waveforms(n,s,l,c, stime, etime, merge=1)
+
+    n_added = 0
+    for (stime, etime, files), st in _prefetch(read_day, days,
+                                               args.readahead):
         if len(st) == 0:
-            return None
+            manifest[str(stime)] = files
+            continue
         elif len(st) > 1:
             print(f'More than one stream ({len(st)}), using first one')
         tr = st[0]
@@ -191,15 +346,95 @@ def _makePPSD(client, inv, nslc, args):
                             db_bins=(-60, 60, 1.0))
             else:
                 ppsd = PPSD(tr.stats, metadata=inv)
+            if state_file is not None and state_file.exists():
+                # Previous runs' results
+                ppsd.add_npz(str(state_file))
         ppsd.add(tr)
-    return ppsd
-
-def _plot_compare_channel(periods, psds, channel, path):
-    fig, ax = plt.subplots()
-    key_list = list(psds.keys())
-    for key in key_list:
-        if key.split('.')[3] == channel:
-            ax.semilogx(periods, psds[key], label=key)
+        manifest[str(stime)] = files
+        n_added += 1
+    if state_file is not None:
+        if n_added > 0:
+            # Saved before the manifest is, so that an interrupted run only
+            # reprocesses days
+            ppsd.save_npz(str(state_file))
+        elif state_file.exists():
+            ppsd = PPSD.load_npz(str(state_file), metadata=inv)
+    print(f'{nslc}: {n_added} new or modified day(s) processed')
+    return ppsd, manifest
+
+
+def _prefetch(read, items, readahead=2):
+    """
+    Yield (item, read(item)) in order, reading up to readahead items ahead
+    in background threads
+
+    Reading (I/O and miniSEED decoding) then overlaps with whatever is done
+    with the previous items
+    """
+    if readahead < 1:
+        for item in items:
+            yield item, read(item)
+        return
+    items = list(items)
+    with ThreadPoolExecutor(max_workers=readahead) as executor:
+        pending = deque((item, executor.submit(read, item))
+                        for item in items[:readahead])
+        for i in range(readahead, len(items) + readahead):
+            if i < len(items):
+                pending.append((items[i], executor.submit(read, items[i])))
+            item, future = pending.popleft()
+            yield item, future.result()
+
+
+def _file_signatures(filenames):
+    """
+    Return {filename: [mtime_ns, size]} of existing files
+    """
+    sigs = {}
+    for f in sorted(filenames):
+        try:
+            stat = os.stat(f)
+        except FileNotFoundError:
+            continue
+        sigs[str(f)] = [stat.st_mtime_ns, stat.st_size]
+    return sigs
+
+
+def _read_manifest(state_dir):
+    """
+    Return the manifest of processed SDS files:
+    {nslc: {day_start: {sds_file: [mtime_ns, size]}}}
+    """
+    if not state_dir or not (Path(state_dir) / MANIFEST_FILE).exists():
+        return {}
+    with open(Path(state_dir) / MANIFEST_FILE) as fp:
+        return json.load(fp)
+
+
+def _write_manifest(state_dir, manifest):
+    """
+    Write the manifest (atomically: a crash leaves the previous one)
+    """
+    if not state_dir:
+        return
+    Path(state_dir).mkdir(parents=True, exist_ok=True)
+    tmp_file = Path(state_dir) / (MANIFEST_FILE + '.tmp')
+    with open(tmp_file, 'w') as fp:
+        json.dump(manifest, fp, indent=1)
+    os.replace(tmp_file, Path(state_dir) / MANIFEST_FILE)
+
+
+def _plot_compare_channel(filename, periods, psds, channel):
+    """
+    Plot the mode PSDs of one channel code, with noise models
+
+    Args:
+        psds (dict): {nslc: mode PSD}
+    """
+    fig = new_figure()
+    ax = fig.add_subplot()
+    for key, psd in psds.items():
+        ax.semilogx(periods, psd, label=key)
     ax.legend(fontsize='xx-small', loc='best')
     ax.set_xlabel('Period(s)')
     if channel[-1] in ('H', 'G', 'O'):
@@ -212,11 +447,27 @@ def _plot_compare_channel(periods, psds, channel, path):
         ax.semilogx(periods, ln, '--')
         ax.semilogx(periods, hn, '--')
         ax.set_ylabel('Power Spectral Density (dB ref 1 m/s^2/sqrt(Hz))')
-    plt.savefig(f'{path}/{channel}.PSDs.png')
+    fig.savefig(filename)
+
+
+def _ppsd_plot_spec(ppsd, nslc, path, state_dir=None):
+    """
+    Return the PlotSpec of an NSLC's PPSD plot
+
+    If the PPSD was saved in state_dir, workers read it from there instead
+    of receiving the whole PPSD
+    """
+    filename = f'{path}/{nslc}_PPSD.png'
+    state_file = Path(state_dir) / f'{nslc}.npz' if state_dir else None
+    if state_file is not None and state_file.exists():
+        return PlotSpec(_plot_ppsd, filename, npz_file=str(state_file))
+    return PlotSpec(_plot_ppsd, filename, ppsd=ppsd)
 
 
-def _plot_ppsd(ppsd, nslc, path):
-    ppsd.plot(filename=f'{path}/{nslc}_PPSD.png')
+def _plot_ppsd(filename, ppsd=None, npz_file=None):
+    if ppsd is None:
+        ppsd = PPSD.load_npz(npz_file)
+    ppsd.plot(filename=filename, show=False)
 
 if __name__ == '__main__':
     main()
@@ -3,17 +3,125 @@ Functions to calculate spectra, coherences and transfer functions
 """
 from obspy.signal.invsim import cosine_taper
 from obspy.core.trace import Trace
+from obspy.core.stream import Stream
 import scipy.signal as ssig
+import scipy.fft as sfft
+from numpy.lib.stride_tricks import sliding_window_view
 from matplotlib import mlab
 import matplotlib.pyplot as plt
 import numpy as np
 import math as m
 import warnings
+import hashlib
+import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
-from .Peterson_noise_model import PetersonNoiseModel
+from .noise_models import PetersonNoiseModel
+from . import profiling
 
 # Set variables
 spect_library = 'scipy'  # 'mlab' or 'scipy': mlab gives weird coherences!
+batch_bytes = 2**26  # Maximum size of the windowed data FFT'd at once
+
+
+class ResponseCache:
+    """
+    Cache of evaluated instrument responses
+
+    Evaluating a response (evalresp) for every PSD is slow and gives the same
+    result for the same response, nfft, sampling rate and output.  Responses
+    are identified by a hash of their content, so equal responses attached
+    to different traces share an entry.
+
+    The least recently used entries are dropped when the cache holds more
+    than max_bytes.  If store is given, evaluated responses are also saved
+    to (and read from) npz files in that directory.
+    """
+    def __init__(self, max_bytes=2**28, store=None):
+        """
+        :parm max_bytes: maximum size of the cached arrays
+        :parm store: directory in which to save evaluated responses
+            (None: memory only)
+        """
+        self.max_bytes = max_bytes
+        self.store = Path(store) if store else None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def get(self, response, nfft, sampling_rate, output='VEL'):
+        """
+        Return an evaluated response, as Response.get_evalresp_response()
+
+        The returned arrays are read-only
+
+        :type response: :class:`~obspy.core.inventory.response.Response`
+        :param nfft: FFT length (samples)
+        :param sampling_rate: sampling rate (sps)
+        :param output: 'DISP', 'VEL', 'ACC' or 'DEF'
+        :returns: resp (complex array), freqs
+        """
+        key = (_response_hash(response), int(nfft), float(sampling_rate),
+               output)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+        with profiling.stage('response_load'):
+            resp_freqs = self._load(key)
+            if resp_freqs is None:
+                resp_freqs = response.get_evalresp_response(
+                    t_samp=1 / sampling_rate, nfft=nfft, output=output)
+                self._save(key, resp_freqs)
+        for x in resp_freqs:
+            x.setflags(write=False)
+        with self._lock:
+            if key in self._entries:
+                # Evaluated by another thread in the meantime
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self._entries[key] = resp_freqs
+            self._nbytes += sum(x.nbytes for x in resp_freqs)
+            while self._nbytes > self.max_bytes and len(self._entries) > 1:
+                _, old = self._entries.popitem(last=False)
+                self._nbytes -= sum(x.nbytes for x in old)
+        return resp_freqs
+
+    def _store_file(self, key):
+        return self.store / '{}_{:d}_{:g}_{}.npz'.format(*key)
+
+    def _load(self, key):
+        if self.store is None or not self._store_file(key).exists():
+            return None
+        with np.load(self._store_file(key)) as f:
+            return f['resp'], f['freqs']
+
+    def _save(self, key, resp_freqs):
+        if self.store is None:
+            return
+        self.store.mkdir(parents=True, exist_ok=True)
+        np.savez(self._store_file(key), resp=resp_freqs[0],
+                 freqs=resp_freqs[1])
+
+
+# Shared by all PSD calculations (set to ResponseCache(store=...) to keep
+# evaluated responses on disk)
+response_cache = ResponseCache()
 
 
 class PSD:
@@ -44,78 +152,48 @@ class PSD:
         return s
 
     @classmethod
-    def calc(cls, tr, window_length=1000):
+    def calc(cls, tr, window_length=1000, dtype=np.float64):
         """
         Calculate PSD of a data trace
         Based on obspy PPSD function
 
-        REMOVING PART COHERENT WITH ANOTHER CHANNEL WILL REQUIRE DOING
-        WELCH MYSELF (MUST APPLY REMOVAL AT THE LEVEL OF EACH FFT)
+        To remove the part coherent with another channel, use
+        CoherentNoiseRemover
 
         :type st: :class:`~obspy.core.stream.Stream`
         :param tr: Trace to be processed, should have response attached
         :type window_length: `numeric`
         :param window_length: minimum FFT window length in seconds
+        :param dtype: calculation precision (np.float32 or np.float64).
+            tr.data is not modified
         """
         assert type(tr) == Trace
 
         sampling_rate = tr.stats.sampling_rate
-        data_len = tr.stats.endtime - tr.stats.starttime
-        if window_length > data_len/2:
-            window_length = int(data_len/3)
-        nfft = 2**(m.ceil(m.log2(window_length * sampling_rate)))
+        nfft = _calc_nfft(window_length, sampling_rate,
+                          tr.stats.endtime - tr.stats.starttime)
         nlap = int(0.75 * nfft)
 
-        if spect_library == 'mlab':
-            spec, _freq = mlab.psd(tr.data, nfft, sampling_rate,
-                                   detrend=mlab.detrend_linear,
-                                   window=_fft_taper, noverlap=nlap,
-                                   sides='onesided', scale_by_freq=True)
-        elif spect_library == 'scipy':
-            _freq, spec = ssig.welch(tr.data, sampling_rate, nperseg=nfft,
-                                     detrend="linear", noverlap=nlap)
-        else:
-            warnings.warn('Unknown spectra library: "{}"'.format(
-                spect_library))
-            return False
+        data = tr.data.astype(dtype, copy=False)
+        with profiling.stage('fft', data.nbytes):
+            if spect_library == 'mlab':
+                spec, _freq = mlab.psd(data.copy(), nfft, sampling_rate,
+                                       detrend=mlab.detrend_linear,
+                                       window=_fft_taper, noverlap=nlap,
+                                       sides='onesided', scale_by_freq=True)
+            elif spect_library == 'scipy':
+                _freq, spec = ssig.welch(
+                    data, sampling_rate, nperseg=nfft, detrend="linear",
+                    noverlap=nlap, window=_hann(nfft, dtype))
+            else:
+                warnings.warn('Unknown spectra library: "{}"'.format(
+                    spect_library))
+                return False
 
         # leave out first entry (offset)
-        spec = spec[1:]
-
-        # Remove the response using the same conventions
-        # since the power is squared we must square the sensitivity
-        # determine instrument response from metadata
-        try:
-            resp, _ = tr.stats.response.get_evalresp_response(
-                t_samp=1 / sampling_rate, nfft=nfft, output="VEL")
-            resp = resp[1:]
-        except Exception as e:
-            msg = ("Error getting response from provided metadata:\n"
-                   "%s: %s\n"
-                   "Skipping time segment(s).")
-            msg = msg % (e.__class__.__name__, str(e))
-            warnings.warn(msg)
-            resp = None
-
-        _freq = _freq[1:]
-        if resp[0]:
-            # Get the amplitude response (squared)
-            respamp = np.absolute(resp * np.conjugate(resp))
-            # Make omega with the same conventions as spec
-            w = 2.0 * m.pi * _freq
-            # Remove response
-            iu = tr.stats.response.response_stages[0].input_units
-            if iu.upper()[:2] == "PA":
-                print(f'Channel {tr.stats.channel} has input_units "{iu}"'
-                      ': treating as hydrophone')
-                spec = spec / respamp
-                PSD_units = "dB ref 1 Pa^2/Hz"
-            else:
-                spec = (w**2) * spec / respamp
-                PSD_units = "dB ref 1 (m/s^2)^2/Hz"
-        else:
-            PSD_units = "dB ref 1 count^2/Hz"
-        return cls(_freq, spec, PSD_units, tr.stats)
+        spec, PSD_units = _remove_response(tr.stats, _freq[1:], spec[1:],
+                                           nfft)
+        return cls(_freq[1:], spec, PSD_units, tr.stats)
 
     def plot(self, ax=None, show=True, outfile=None, show_Peterson=True):
         """
@@ -160,7 +238,7 @@ class PSDs:
         return len(self.PSDs)
 
     @classmethod
-    def calc(cls, st, window_length=1000):
+    def calc(cls, st, window_length=1000, workers=1, dtype=np.float64):
         """
         Calculate PSDs of a data stream
 
@@ -168,11 +246,14 @@ class PSDs:
         :param st: Stream to be processed
         :type window_length: `numeric`
         :param window_length: minimum FFT window length in seconds
+        :param workers: number of channels to process at the same time
+            (threads: the FFTs release the GIL and the data are not copied)
+        :param dtype: calculation precision (see PSD.calc())
         :returns: list of dictionaries containing freqs, data, units, name
         """
-        PSDs = []
-        for tr in st:
-            PSDs.append(PSD.calc(tr, window_length))
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            PSDs = list(executor.map(
+                lambda tr: PSD.calc(tr, window_length, dtype), st))
         return cls(PSDs=PSDs)
 
     def plot(self, outfile=None):
@@ -205,36 +286,46 @@ class Coherences:
     def __init__(self, freqs, cohs, num_windows, signif_level,
                  starttime, endtime, stats):
         self.freqs = np.array(freqs)
-        self.cohs = cohs
+        self.cohers = cohs
         for coh in cohs:
-            assert self.freqs.shape == self.cohs.shape
-        self.num_window = num_windows
+            assert self.freqs.shape == coh.data.shape
+        self.num_windows = num_windows
         self.signif_level = signif_level
         self.starttime = starttime
         self.endtime = endtime
+        self.stats = stats
 
     @classmethod
-    def calc(cls, st, window_length=1000):
+    def calc(cls, st, window_length=1000, workers=1, dtype=np.float64):
         """
         Calculate coherences between channels of a data stream
 
-        TO REMOVE PART COHERENT WITH ANOTHER CHANNEL, WILL HAVE TO DO
-        WELCH MYSELF (MUST APPLY REMOVAL AT THE LEVEL OF EACH FFT)
+        To remove the part coherent with another channel, use
+        CoherentNoiseRemover
 
         :type st: :class:`~obspy.core.stream.Stream`
         :param tr: Stream to be processed
         :type window_length: `numeric`
         :param window_length: minimum FFT window length in seconds
+        :param workers: number of threads (see CrossSpectralMatrix.calc())
+        :param dtype: calculation precision (np.float32 or np.float64).
+            The stream's data are not modified
         :returns: list of dictionaries containing freqs, data, units, name
+        :raises ValueError: (scipy library) if the channels have different
+            sampling rates, lengths or start times.  Select compatible
+            channels (or trim the stream) first
         """
+        if spect_library == 'scipy':
+            return CrossSpectralMatrix.calc(st, window_length, workers,
+                                            dtype).coherences()
+        # Convert each channel once
+        data = [tr.data.astype(dtype) for tr in st]
         cohers = []
         for i in range(len(st)-1):
             for j in range(i+1, len(st)):
                 # print(i,j)
                 tr_i = st[i]
                 tr_j = st[j]
-                tr_i.data = tr_i.data.astype(np.float64)
-                tr_j.data = tr_j.data.astype(np.float64)
 
                 # Verify that channels are compatible (same sampling rate,
                 # length and starttime)
@@ -244,11 +335,11 @@ class Coherences:
                     cohers.append([])
                     continue
                 sampling_rate = tr_i.stats.sampling_rate
-                if len(tr_i.data) != len(tr_j.data):
+                if len(data[i]) != len(data[j]):
                     warnings.warn(tmp + 'have different lengths')
                     cohers.append([])
                     continue
-                data_samples = len(tr_i.data)
+                data_samples = len(data[i])
                 if abs(tr_i.stats.starttime - tr_j.stats.starttime) >\
                         1 / sampling_rate:
                     warnings.warn('tmp +  ' + 'are offset by > one sample')
@@ -260,20 +351,12 @@ class Coherences:
                 nfft = 2**(m.ceil(m.log2(window_length * sampling_rate)))
                 nlap = int(0.75 * nfft)
                 if spect_library == 'mlab':   # MLAB GIVES STRANGE ANSWER
-                    Cxy, _freq = mlab.cohere(tr_i.data, tr_j.data, nfft,
+                    Cxy, _freq = mlab.cohere(data[i], data[j], nfft,
                                              sampling_rate,
                                              detrend=mlab.detrend_linear,
                                              window=_fft_taper,
                                              noverlap=nlap, sides='onesided',
                                              scale_by_freq=False)
-                # SCIPY GIVES SIMILAR ANSWER TO MATLAB
-                elif spect_library == 'scipy':
-                    _freq, Cxy = ssig.coherence(tr_i.data, tr_j.data,
-                                                sampling_rate,
-                                                # window=_fft_taper,
-                                                nperseg=nfft,
-                                                detrend="linear",
-                                                noverlap=nlap)
                 else:
                     warnings.warn('Unknown spectra library: "{}"'.format(
                         spect_library))
@@ -311,16 +394,526 @@ class Coherences:
         return
 
 
+class CrossSpectralMatrix:
+    """
+    Cross-spectral matrix of a multi-channel stream
+
+    Each channel is FFT'd once, PSDs, coherences and transfer functions are
+    then derived from the matrix.  Uses the same conventions as
+    scipy.signal.welch() and csd() (Hann window, linear detrend, one-sided
+    densities)
+    """
+    def __init__(self, freqs, data, num_windows, nfft, sampling_rate,
+                 stats, starttime=None, endtime=None):
+        """
+        :parm freqs: 1-D array of frequencies (starting at 0)
+        :parm data: 3-D complex array (n_chans, n_chans, n_freqs).
+            data[i, j] is the cross-spectral density between channels i
+            and j (conj(FFT_i) * FFT_j), data[i, i] is the PSD of channel i
+        :parm num_windows: number of averaged windows
+        :parm nfft: window length (samples)
+        :parm sampling_rate: sampling rate (sps)
+        :type stats: list of :class:`~obspy.core.trace.Stats`
+        :type starttime, endtime: :class:`~obspy.core.UTCDateTime`
+        """
+        self.freqs = np.array(freqs)
+        self.data = np.array(data)
+        assert self.data.shape == (len(stats), len(stats), len(freqs))
+        self.num_windows = num_windows
+        self.nfft = nfft
+        self.sampling_rate = sampling_rate
+        self.stats = stats
+        self.starttime = starttime
+        self.endtime = endtime
+
+    def __repr__(self):
+        s = 'CrossSpectralMatrix(freqs, data, num_windows={}, nfft={}, '\
+            'sampling_rate={:g}, stats) <channels={}>'.format(
+                self.num_windows, self.nfft, self.sampling_rate,
+                [_seed_code(x) for x in self.stats])
+        return s
+
+    @classmethod
+    def calc(cls, st, window_length=1000, workers=1, dtype=np.float64):
+        """
+        Calculate the cross-spectral matrix of a data stream
+
+        :type st: :class:`~obspy.core.stream.Stream`
+        :param st: Stream to be processed.  All traces must have the same
+            sampling rate, length and starttime
+        :type window_length: `numeric`
+        :param window_length: minimum FFT window length in seconds
+        :param workers: number of window batches to process at the same
+            time (threads: the FFTs and matrix products release the GIL)
+        :param dtype: precision of the data and FFTs (np.float32 or
+            np.float64).  The data are converted once, the stream is not
+            modified.  The cross-spectral sums are always accumulated in
+            double precision
+        """
+        tr = st[0]
+        nfft = _calc_nfft(window_length, tr.stats.sampling_rate,
+                          tr.stats.npts / tr.stats.sampling_rate)
+        acc = WelchAccumulator(len(st), nfft, tr.stats.sampling_rate,
+                               dtype=dtype)
+        acc.add(st, workers)
+        return acc.result()
+
+    def psd(self, i):
+        """
+        Return the PSD of channel i, with the instrument response removed
+
+        :rtype: :class:`PSD`
+        """
+        spec, units = _remove_response(self.stats[i], self.freqs[1:],
+                                       self.data[i, i, 1:].real, self.nfft)
+        return PSD(self.freqs[1:], spec, units, self.stats[i])
+
+    def psds(self):
+        """
+        Return the PSDs of all channels
+
+        :rtype: :class:`PSDs`
+        """
+        return PSDs([self.psd(i) for i in range(len(self.stats))])
+
+    def coherence(self, i, j):
+        """
+        Return the magnitude-squared coherence between channels i and j
+
+        Same as scipy.signal.coherence(), including the 0 frequency
+        """
+        return (np.abs(self.data[i, j])**2
+                / (self.data[i, i].real * self.data[j, j].real))
+
+    def coherences(self):
+        """
+        Return the coherences between all channel pairs
+
+        :rtype: :class:`Coherences`
+        """
+        n = len(self.stats)
+        cohers = [Coherence(self.coherence(i, j)[1:], (i, j))
+                  for i in range(n - 1) for j in range(i + 1, n)]
+        csl = np.sqrt(2. / self.num_windows)  # 95% significance level
+        return Coherences(self.freqs[1:], cohers, self.num_windows, csl,
+                          self.starttime, self.endtime, self.stats)
+
+    def transfer_functions(self, drivechans='H', respchans='Z',
+                           noisechan='response', clean=None):
+        """
+        Return the transfer functions between driving and response channels
+
+        :rtype: :class:`TransferFunctions` (see TransferFunctions.calc())
+        """
+        return TransferFunctions.calc(self, drivechans, respchans, noisechan,
+                                      clean)
+
+    def chan_index(self, chan):
+        """
+        Return the index of a channel
+
+        :param chan: channel index, or channel name (or its last
+            character(s))
+        :raises ValueError: if no channel matches
+        """
+        if isinstance(chan, (int, np.integer)):
+            if not 0 <= chan < len(self.stats):
+                raise ValueError(f'No channel number {chan}')
+            return int(chan)
+        for i, stats in enumerate(self.stats):
+            if stats is not None and stats.channel.endswith(chan):
+                return i
+        raise ValueError(f'No channel matching "{chan}"')
+
+    def split_channels(self, drivechans):
+        """
+        Return the indices of the driving channels and of the other channels
+
+        :param drivechans: driving channel names (or last character(s)), or
+            indices
+        """
+        drives = [self.chan_index(c)
+                  for c in np.atleast_1d(np.asarray(drivechans, dtype=object))]
+        others = [i for i in range(len(self.stats)) if i not in drives]
+        return drives, others
+
+    def remove_coherent(self, drivechans):
+        """
+        Remove the parts of the other channels that are coherent with the
+        driving channels (tilt and/or compliance noise removal)
+
+        Returns the cross-spectral matrix of what remains after subtracting,
+        in each window, the driving channels' contributions predicted by the
+        (multiple-input) transfer functions:
+        G_rr - G_rd G_dd^-1 G_dr (Bendat&Piersol "Random Data" 1986,
+        chapter 7).  Removing several driving channels at once is the same as
+        removing them one after the other (Crawford & Webb 2000).
+
+        :param drivechans: driving channel names (or last character(s)), or
+            indices
+        :rtype: :class:`CrossSpectralMatrix` of the other channels
+        """
+        drives, others = self.split_channels(drivechans)
+        g = self.data.transpose(2, 0, 1)
+        g_od = g[:, others][:, :, drives]
+        g_oo = g[:, others][:, :, others]
+        cleaned = g_oo - g_od @ _multiple_transfer(g, drives, others)
+        return CrossSpectralMatrix(
+            self.freqs, cleaned.transpose(1, 2, 0), self.num_windows,
+            self.nfft, self.sampling_rate, [self.stats[i] for i in others],
+            self.starttime, self.endtime)
+
+
+class WelchAccumulator:
+    """
+    Running Welch cross-spectral sums, for records fed in chunks
+
+    Only the cross-spectral sums and the samples of the last, incomplete,
+    window are kept, so memory use does not depend on the record length.
+    The result is the same as CrossSpectralMatrix.calc() on the whole
+    record.
+
+    Example (reading one hour at a time):
+
+    >>> acc = WelchAccumulator(4, nfft=2**16, sampling_rate=62.5)
+    >>> for t in hours:                                    # doctest: +SKIP
+    ...     acc.add(lcread(fname, t, 3600, network='XX'))
+    >>> csm = acc.result()                                 # doctest: +SKIP
+
+    Accumulators of consecutive parts of a record, calculated in parallel,
+    are combined with merge() or +=.  The parts must overlap so that no
+    window is lost or counted twice: use partitions() to cut the record.
+    """
+    def __init__(self, n_chans, nfft, sampling_rate, overlap=0.75,
+                 dtype=np.float64, cleaner=None):
+        """
+        :parm n_chans: number of channels
+        :parm nfft: window length (samples)
+        :parm sampling_rate: sampling rate (sps)
+        :parm overlap: window overlap (fraction of nfft)
+        :parm dtype: precision of the data and FFTs (np.float32 or
+            np.float64)
+        :parm cleaner: remove coherent noise from each window's FFTs
+            before summing (the sums are then those of the cleaned
+            channels)
+        :type cleaner: :class:`CoherentNoiseRemover`
+        """
+        self.n_chans = n_chans
+        self.nfft = nfft
+        self.sampling_rate = sampling_rate
+        self.step = nfft - int(overlap * nfft)
+        self.dtype = np.dtype(dtype)
+        self.window = _hann(nfft, dtype)
+        self.cleaner = cleaner
+        if cleaner is not None:
+            if cleaner.nfft != nfft or len(cleaner.freqs) != nfft // 2 + 1:
+                raise ValueError('cleaner has a different nfft')
+            n_out = len(cleaner.others)
+        else:
+            n_out = n_chans
+        self.sums = np.zeros((n_out, n_out, nfft // 2 + 1),
+                             dtype=np.complex128)
+        self.num_windows = 0
+        self.stats = None
+        self.starttime = None
+        self.endtime = None
+        self._tail = np.zeros((n_chans, 0), dtype=dtype)
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def add(self, data, workers=1):
+        """
+        Add the next chunk of data
+
+        :param data: next chunk of the record
+        :type data: :class:`~obspy.core.stream.Stream` or 2-D array
+            (n_chans, n_samples)
+        :param workers: number of window batches to process at the same
+            time (threads)
+        :raises ValueError: if a Stream does not start where the previous
+            one ended
+        """
+        if isinstance(data, Stream):
+            st = data
+            data, sampling_rate = _stream_data(st, self.dtype)
+            if sampling_rate != self.sampling_rate:
+                raise ValueError('Sampling rate changed')
+            if self.endtime is None:
+                self.stats = [tr.stats for tr in st]
+                self.starttime = st[0].stats.starttime
+            elif abs(st[0].stats.starttime - self.endtime) > \
+                    0.5 / self.sampling_rate:
+                raise ValueError('Stream starts at {}, expected {}'.format(
+                    st[0].stats.starttime, self.endtime))
+            self.endtime = st[0].stats.starttime \
+                + data.shape[1] / self.sampling_rate
+        data = np.asarray(data, dtype=self.dtype)
+        if data.shape[0] != self.n_chans:
+            raise ValueError(f'Data have {data.shape[0]} channels, '
+                             f'expected {self.n_chans}')
+        buf = np.concatenate((self._tail, data), axis=1)
+        n_windows = max((buf.shape[1] - self.nfft) // self.step + 1, 0)
+        if n_windows > 0:
+            windows = sliding_window_view(buf, self.nfft,
+                                          axis=-1)[:, ::self.step]
+            batch = max(1, batch_bytes // (2 * self.dtype.itemsize
+                                           * self.nfft * self.n_chans))
+            if workers > 1:
+                # Smaller batches, so that all workers are used
+                batch = max(1, min(batch, -(-n_windows // workers)))
+
+            def batch_sums(i):
+                ffts = _window_ffts(windows[:, i:min(i + batch, n_windows)],
+                                    self.window)
+                if self.cleaner is not None:
+                    ffts = self.cleaner.clean_ffts(ffts)
+                return _cross_spectra(ffts)
+
+            with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+                for sums in executor.map(batch_sums,
+                                         range(0, n_windows, batch)):
+                    self.sums += sums
+            self.num_windows += n_windows
+        self._tail = buf[:, n_windows * self.step:].copy()
+
+    def merge(self, other):
+        """
+        Add the sums of an accumulator calculated on another part of the
+        record
+        """
+        for key in ('n_chans', 'nfft', 'sampling_rate', 'step', 'dtype'):
+            if getattr(self, key) != getattr(other, key):
+                raise ValueError(f'Accumulators have different {key}')
+        self.sums += other.sums
+        self.num_windows += other.num_windows
+        if self.stats is None:
+            self.stats = other.stats
+        for t in (other.starttime, other.endtime):
+            if t is not None:
+                self.starttime = t if self.starttime is None \
+                    else min(self.starttime, t)
+                self.endtime = t if self.endtime is None \
+                    else max(self.endtime, t)
+        return self
+
+    def partitions(self, n_samples, n_parts):
+        """
+        Cut a record into parts whose accumulators can be merged
+
+        :param n_samples: number of samples in the record
+        :param n_parts: number of parts
+        :returns: list of (first, last + 1) sample indices.  Consecutive
+            parts overlap by nfft - step samples
+        """
+        n_windows = max((n_samples - self.nfft) // self.step + 1, 0)
+        bounds = np.linspace(0, n_windows, n_parts + 1).astype(int)
+        return [(int(a * self.step), int((b - 1) * self.step + self.nfft))
+                for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+    def result(self):
+        """
+        Return the cross-spectral matrix of the data added so far
+
+        :rtype: :class:`CrossSpectralMatrix`
+        """
+        if self.num_windows < 1:
+            raise ValueError('Data are shorter than one FFT window')
+        stats = self.stats
+        if stats is None:
+            stats = [None] * self.n_chans
+        if self.cleaner is not None:
+            stats = [stats[i] for i in self.cleaner.others]
+        return CrossSpectralMatrix(
+            np.fft.rfftfreq(self.nfft, 1 / self.sampling_rate),
+            _density(self.sums, self.num_windows, self.window,
+                     self.sampling_rate, self.nfft),
+            self.num_windows, self.nfft, self.sampling_rate, stats,
+            self.starttime, self.endtime)
+
+
+class CoherentNoiseRemover:
+    """
+    Remove the parts of channels that are coherent with driving channels
+    (tilt, compliance), window by window
+
+    The (multiple-input) transfer functions from the driving channels
+    (pressure, horizontals) to the other channels are estimated from a
+    cross-spectral matrix, then each window's FFT of the other channels is
+    replaced by what is left after subtracting the driving channels' FFTs
+    times the transfer functions.  Windows are processed in batches, so
+    memory use does not depend on the record length.
+
+    The transfer functions can come from the same record or from another one
+    (for example, a quiet period)
+
+    Example (tilt noise removal):
+
+    >>> remover = CoherentNoiseRemover.calc(st, ['1', '2'])  # doctest: +SKIP
+    >>> psds = remover.psds(st)                              # doctest: +SKIP
+    >>> st_clean = remover.clean_stream(st)                  # doctest: +SKIP
+    """
+    def __init__(self, freqs, transfer, drives, others, nfft, sampling_rate,
+                 stats):
+        """
+        :parm freqs: 1-D array of frequencies (starting at 0)
+        :parm transfer: 3-D complex array (n_freqs, n_drives, n_others) of
+            transfer functions: FFT_other = sum(transfer * FFT_drive) + noise
+        :parm drives: indices of the driving channels
+        :parm others: indices of the channels to clean
+        :parm nfft: window length (samples)
+        :parm sampling_rate: sampling rate (sps)
+        :type stats: list of :class:`~obspy.core.trace.Stats` (all channels)
+        """
+        self.freqs = np.array(freqs)
+        self.transfer = np.array(transfer)
+        assert self.transfer.shape == (len(freqs), len(drives), len(others))
+        self.drives = list(drives)
+        self.others = list(others)
+        self.nfft = nfft
+        self.sampling_rate = sampling_rate
+        self.stats = stats
+
+    def __repr__(self):
+        return 'CoherentNoiseRemover(freqs, transfer, drives, others, '\
+            'nfft={}, sampling_rate={:g}, stats) <{} from {}>'.format(
+                self.nfft, self.sampling_rate,
+                [_seed_code(self.stats[i]) for i in self.others],
+                [_seed_code(self.stats[i]) for i in self.drives])
+
+    @classmethod
+    def from_csm(cls, csm, drivechans):
+        """
+        Estimate the transfer functions from a cross-spectral matrix
+
+        :type csm: :class:`CrossSpectralMatrix`
+        :param drivechans: driving channel names (or last character(s)), or
+            indices
+        """
+        drives, others = csm.split_channels(drivechans)
+        return cls(csm.freqs,
+                   _multiple_transfer(csm.data.transpose(2, 0, 1), drives,
+                                      others),
+                   drives, others, csm.nfft, csm.sampling_rate, csm.stats)
+
+    @classmethod
+    def calc(cls, st, drivechans, window_length=1000, workers=1,
+             dtype=np.float64):
+        """
+        Estimate the transfer functions from a data stream
+
+        :type st: :class:`~obspy.core.stream.Stream`
+        :param drivechans: driving channel names (or last character(s)), or
+            indices
+        :param window_length: minimum FFT window length in seconds
+        :param workers, dtype: see CrossSpectralMatrix.calc()
+        """
+        return cls.from_csm(CrossSpectralMatrix.calc(st, window_length,
+                                                     workers, dtype),
+                            drivechans)
+
+    def clean_ffts(self, ffts):
+        """
+        Remove the coherent noise from windowed FFTs
+
+        :param ffts: complex array (n_chans, n_windows, n_freqs) of all
+            channels' FFTs
+        :returns: complex array (n_others, n_windows, n_freqs) of the
+            cleaned channels' FFTs
+        """
+        predicted = (ffts[self.drives].transpose(2, 1, 0)
+                     @ self.transfer.astype(ffts.dtype)).transpose(2, 1, 0)
+        return ffts[self.others] - predicted
+
+    def csm(self, st, workers=1, dtype=np.float64):
+        """
+        Return the cross-spectral matrix of the cleaned channels
+
+        :type st: :class:`~obspy.core.stream.Stream`
+        :param workers, dtype: see CrossSpectralMatrix.calc()
+        :rtype: :class:`CrossSpectralMatrix`
+        """
+        acc = WelchAccumulator(len(st), self.nfft, st[0].stats.sampling_rate,
+                               dtype=dtype, cleaner=self)
+        acc.add(st, workers)
+        return acc.result()
+
+    def psds(self, st, workers=1, dtype=np.float64):
+        """
+        Return the PSDs of the cleaned channels
+
+        :rtype: :class:`PSDs`
+        """
+        return self.csm(st, workers, dtype).psds()
+
+    def clean_stream(self, st, dtype=np.float64):
+        """
+        Return the cleaned channels' time series
+
+        Each window is linearly detrended (the response channels' trends
+        are put back), tapered, cleaned and inverse-FFT'd, then the windows
+        are overlap-added.  The record is padded (reflected) at both ends so
+        that all samples are reconstructed.
+
+        :type st: :class:`~obspy.core.stream.Stream`
+        :param dtype: precision of the data and FFTs
+        :rtype: :class:`~obspy.core.stream.Stream` of the cleaned channels
+        """
+        data, sampling_rate = _stream_data(st, dtype)
+        if sampling_rate != self.sampling_rate:
+            raise ValueError('Sampling rate differs from the transfer '
+                             'functions\'')
+        nfft = self.nfft
+        step = nfft - int(0.75 * nfft)
+        if nfft % step:
+            raise ValueError(f'nfft ({nfft}) is not a multiple of 4')
+        n_samples = data.shape[1]
+        pad = nfft - step
+        n_blocks = -(-(n_samples + 2 * pad) // step)
+        data = np.pad(data, ((0, 0), (pad, n_blocks * step - n_samples - pad)),
+                      mode='reflect')
+        window = _hann(nfft, dtype)
+        n_windows = n_blocks - nfft // step + 1
+        windows = sliding_window_view(data, nfft, axis=-1)[:, ::step]
+        out = np.zeros((len(self.others), n_blocks, step))
+        norm = np.zeros((n_blocks, step))
+        batch = max(1, batch_bytes // (2 * data.itemsize * nfft * len(st)))
+        t = (np.arange(nfft) - (nfft - 1) / 2).astype(dtype)
+        for i in range(0, n_windows, batch):
+            w = windows[:, i:min(i + batch, n_windows)]
+            trend = (w.mean(axis=-1, keepdims=True)
+                     + (w @ t)[..., np.newaxis] / (t @ t) * t)
+            cleaned = sfft.irfft(self.clean_ffts(_window_ffts(w, window)),
+                                 n=nfft, axis=-1)
+            cleaned += trend[self.others] * window
+            for j in range(nfft // step):
+                seg = slice(j * step, (j + 1) * step)
+                out[:, i + j:i + j + cleaned.shape[1]] += cleaned[..., seg]
+                norm[i + j:i + j + cleaned.shape[1]] += window[seg]
+        keep = slice(pad, pad + n_samples)
+        out = out.reshape(len(self.others), -1)[:, keep] / norm.ravel()[keep]
+        traces = []
+        for data, i in zip(out, self.others):
+            traces.append(Trace(data.astype(dtype, copy=False),
+                                header=st[i].stats.copy()))
+        return Stream(traces)
+
+
 class TransferFunction:
     def __init__(self, freqs, data, uncerts, drive_stats, resp_stats,
-                 gooddata=None, noisechan='response'):
+                 gooddata=None, noisechan='response', coherence=None,
+                 num_windows=None):
         """
         :parm freqs: 1-D array of frequencies
-        :parm data: 1-D array of transfer function
-        :parm uncerts: 1-D array of uncertainties
-        :parm units: data units (str)
+        :parm data: 1-D complex array of transfer function (response /
+            driving, in counts/count)
+        :parm uncerts: 1-D array of uncertainties (on abs(data))
         :parm noisechan: 'response', 'driving', 'equal' or 'unknown'
         :type drive_stats, resp_stats: :class:`~obspy.core.trace.Stats`
+        :parm gooddata: 1-D boolean array, True where the coherence is
+            above the 95% significance level
+        :parm coherence: 1-D array of magnitude-squared coherence
+        :parm num_windows: number of averaged windows
         """
         self.freqs = freqs
         self.data = data
@@ -329,109 +922,38 @@ class TransferFunction:
         self.resp_stats = resp_stats
         self.gooddata = gooddata
         self.noisechan = noisechan
+        self.coherence = coherence
+        self.num_windows = num_windows
+
+    def __repr__(self):
+        return 'TransferFunction(freqs, data, uncerts, drive_stats, '\
+            'resp_stats, noisechan={!r}) <{} / {}>'.format(
+                self.noisechan, _seed_code(self.resp_stats),
+                _seed_code(self.drive_stats))
 
     @classmethod
-    def calc(cls, spects, cohers, drivechan='H', respchan='Z',
-             noisechan='response', verbose=True):
+    def calc(cls, csm, drivechan='H', respchan='Z', noisechan='response',
+             clean=None, verbose=False):
         """
         Calculate the transfer function between 2 channels
 
-        XF = calcXF(spect,cohers,drivechan,respchan,noisechan)
-        input:
-            spects    (list)  contains PSDs calculated using calc_PSDs()
-            cohers    (list)  contains coherences
-            drivechan (str)   the driving channel name (or last character(s))
-            respchan  (str)   the response channel name (or last character(s))
-            noisechan (str)	  is which channel to assume contains the noise
-                'response'	[default] Assume all noise on the response channel
-                'driving'	Assume all noise on the driving channel
-                'equal'		Assume the same signal/noise on the driving  and
-                            response channels
-                'unknown'	Make no assumption about noise
-        output:
-            dictionary containing the transfer function
+        :type csm: :class:`CrossSpectralMatrix`
+        :param drivechan: the driving channel name (or last character(s)),
+            or index
+        :param respchan: the response channel name (or last character(s)),
+            or index
+        :param noisechan: which channel to assume contains the noise
+            'response'	[default] Assume all noise on the response channel
+            'driving'	Assume all noise on the driving channel
+            'equal'		Assume the same signal/noise on the driving  and
+                        response channels
+            'unknown'	Make no assumption about noise
+        :param clean: channels whose coherent parts are removed from the
+            others first (see CrossSpectralMatrix.remove_coherent())
+        :rtype: :class:`TransferFunction`
         """
-
-        if verbose:
-            print(f'Calculating XF between "{drivechan}" (driving) and'
-                  f'"{respchan}" (response) channels, assume noise is on'
-                  f'{noisechan}')
-
-        # FIND PSD and coherence channels matching drivechan and respchan
-        coh = None
-        for c in cohers:
-            chan_i = cohers.stats[c.ch_nums[0]].channel
-            chan_j = cohers.stats[c.ch_nums[1]].channel
-            if (chan_i.endswith(drivechan) and chan_j.endswith(respchan)) or \
-               (chan_i.endswith(respchan) and chan_j.endswith(drivechan)):
-                coh = c
-                break
-        if not coh:
-            warnings.warn('Did no t find a coherence with channels {}, {}'.
-                          format(drivechan, respchan))
-            return False
-        drive_spect = None
-        resp_spect = None
-        for s in spects:
-            if s['chan'].endswith(drivechan):
-                drive_spect = s
-                if verbose:
-                    print('drive_spect channel is "{}"'.format(s['chan']))
-            elif s['chan'].endswith(respchan):
-                resp_spect = s
-                if verbose:
-                    print('resp_spect channel is "{}"'.format(s['chan']))
-        if not drive_spect:
-            warnings.warn('Did not find a spectra with channel {}'.
-                          format(drivechan))
-            return False
-        if not resp_spect:
-            warnings.warn('Did not find a spectra with channel {}'.
-                          format(respchan))
-            return False
-
-        # CALCULATE RESP/DRIVE
-        RespOverDrive = np.sqrt(np.divide(resp_spect['data'],
-                                          drive_spect['data']))
-
-        # CALCULATE TRANSFER FUNCTION
-        # Equations from Bendat&Piersol "Random Data" 1986, pp 176-181 (xfs)
-        # & pp 317, Table 9.6
-        cohmagsq = np.multiply(np.absolute(coh['data']),
-                               np.absolute(coh['data']))
-        errbase = np.divide(np.sqrt(np.ones(cohmagsq.shape) - cohmagsq),
-                            2 * coh['num_windows'] * cohmagsq)
-        if noisechan == 'response':
-            xf = np.multiply(RespOverDrive, coh['data'])
-            xferr = np.multiply(np.abs(xf), errbase)
-        elif noisechan == 'driving':
-            xf = np.divide(RespOverDrive, coh['data'])
-            xferr = np.multiply(np.abs(xf), errbase)
-        elif noisechan == 'equal':
-            xf = RespOverDrive
-            xferr = np.abs(np.multiply(xf, errbase))
-        elif noisechan == 'unknown':
-            xf = RespOverDrive
-            # Ad-hoc error guesstimate
-            maxerr = np.abs(np.power(coh['data'], -1.)) + errbase
-            minerr = np.abs(coh['data']) - errbase
-            xferr = np.abs(np.multiply(xf, (maxerr-minerr) / 2))
-        else:
-            warnings.warn('Invalid: noisechan = ' + noisechan)
-            return False
-        return cls(drive_spect.freqs, xf, xferr,
-                   drive_spect.stats, resp_spect.stats,
-                   np.absolute(coh['data']) > coh['signif_level'],
-                   noisechan)
-        # XF=dict(drive_info=dict(channel=drive_spect['chan'],
-        #                         units=drive_spect['units']),
-        #         resp_info= dict(channel=resp_spect['chan'],
-        #                         units=resp_spect['units']),
-        #         freq=     drive_spect['freq'],
-        #         data=      xf,
-        #         error=     xferr,
-        #         noisechan=noisechan,
-        #         gooddata=  np.absolute(coh['data']) > coh['signif_level'])
+        return TransferFunctions.calc(csm, [drivechan], [respchan],
+                                      noisechan, clean, verbose).XFs[0]
 
     def plot(self, outfile=None, debug=False):
         """
@@ -442,14 +964,14 @@ class TransferFunction:
         if debug:
             print(self.freqs[0])
             print(self.data[0])
-            print(self.uncert[0])
+            print(self.uncerts[0])
         # plt.errorbar(np.log10(XF['freq']), np.absolute(XF['data']),
         #              yerr=np.absolute(XF['error']))
         # plt.ylim(0 , np.max(np.absolute(XF['data'])))
         plt.loglog(self.freqs, np.absolute(self.data), marker='o',
                    linestyle='')
-        plt.loglog(self.freqs, np.absolute(self.data) + self.uncert)
-        plt.loglog(self.freqs, np.absolute(self.data) - self.uncert)
+        plt.loglog(self.freqs, np.absolute(self.data) + self.uncerts)
+        plt.loglog(self.freqs, np.absolute(self.data) - self.uncerts)
         plt.ylim(np.min(np.absolute(self.data)),
                  np.max(np.absolute(self.data)))
         plt.title(f'Transfer function, noise channel: ({self.noisechan})')
@@ -462,6 +984,259 @@ class TransferFunction:
         return
 
 
+class TransferFunctions:
+    """
+    List of TransferFunction
+    """
+    def __init__(self, XFs=None):
+        assert isinstance(XFs, list)
+        for xf in XFs:
+            assert isinstance(xf, TransferFunction)
+        self.XFs = XFs
+
+    def __len__(self):
+        return len(self.XFs)
+
+    def __iter__(self):
+        return iter(self.XFs)
+
+    @classmethod
+    def calc(cls, csm, drivechans='H', respchans='Z', noisechan='response',
+             clean=None, verbose=False):
+        """
+        Calculate the transfer functions between driving and response
+        channels
+
+        All driving/response pairs are calculated at once, from one
+        cross-spectral matrix.  Equations from Bendat&Piersol "Random Data"
+        1986, pp 176-181 (xfs) & pp 317, Table 9.6 (uncertainties)
+
+        :type csm: :class:`CrossSpectralMatrix`
+        :param drivechans: driving channel names (or last character(s)),
+            or indices
+        :param respchans: response channel names (or last character(s)),
+            or indices
+        :param noisechan: which channel to assume contains the noise (see
+            TransferFunction.calc())
+        :param clean: channels whose coherent parts are removed from the
+            others before calculating the transfer functions (for example,
+            the horizontals to remove tilt noise before calculating the
+            pressure -> vertical compliance)
+        :rtype: :class:`TransferFunctions`
+        """
+        if clean:
+            csm = csm.remove_coherent(clean)
+        drives = [csm.chan_index(c)
+                  for c in np.atleast_1d(np.asarray(drivechans, dtype=object))]
+        resps = [csm.chan_index(c)
+                 for c in np.atleast_1d(np.asarray(respchans, dtype=object))]
+        pairs = [(d, r) for d in drives for r in resps if d != r]
+        if not pairs:
+            raise ValueError('No driving/response channel pairs')
+        d, r = np.array(pairs).T
+        if verbose:
+            for i, j in pairs:
+                print(f'Calculating XF between "{_seed_code(csm.stats[i])}" '
+                      f'(driving) and "{_seed_code(csm.stats[j])}" '
+                      f'(response) channels, assume noise is on {noisechan}')
+
+        # All pairs and frequencies at once
+        g_dd = csm.data[d, d, 1:].real
+        g_rr = csm.data[r, r, 1:].real
+        g_dr = csm.data[d, r, 1:]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cohmagsq = np.abs(g_dr)**2 / (g_dd * g_rr)
+            coh = np.sqrt(cohmagsq)
+            errbase = np.sqrt(1 - cohmagsq) / (coh
+                                               * np.sqrt(2 * csm.num_windows))
+            if noisechan == 'response':
+                xf = g_dr / g_dd
+                xferr = np.abs(xf) * errbase
+            elif noisechan == 'driving':
+                xf = g_rr / g_dr.conj()
+                xferr = np.abs(xf) * errbase
+            elif noisechan == 'equal':
+                xf = np.sqrt(g_rr / g_dd) * np.exp(1j * np.angle(g_dr))
+                xferr = np.abs(xf) * errbase
+            elif noisechan == 'unknown':
+                xf = np.sqrt(g_rr / g_dd) * np.exp(1j * np.angle(g_dr))
+                # Ad-hoc error guesstimate
+                maxerr = 1 / coh + errbase
+                minerr = coh - errbase
+                xferr = np.abs(xf) * (maxerr - minerr) / 2
+            else:
+                raise ValueError(f'Invalid noisechan: {noisechan}')
+        csl = np.sqrt(2. / csm.num_windows)  # 95% significance level
+        return cls([TransferFunction(csm.freqs[1:], xf[k], xferr[k],
+                                     csm.stats[i], csm.stats[j],
+                                     cohmagsq[k] > csl, noisechan,
+                                     cohmagsq[k], csm.num_windows)
+                    for k, (i, j) in enumerate(pairs)])
+
+    def plot(self, outfile=None):
+        """
+        plot transfer functions
+        """
+        for xf in self.XFs:
+            if outfile is None:
+                xf.plot()
+                continue
+            outfile = Path(outfile)
+            xf.plot(outfile=str(outfile.with_name(
+                f'{outfile.stem}_{xf.resp_stats.channel}_'
+                f'{xf.drive_stats.channel}{outfile.suffix}')))
+        return
+
+
+def _calc_nfft(window_length, sampling_rate, data_len):
+    """
+    Return the FFT length (samples) for a given window length (seconds)
+
+    :param data_len: length of the data (seconds).  If window_length is
+        more than half of data_len, uses a third of data_len instead
+    """
+    if window_length > data_len/2:
+        window_length = int(data_len/3)
+    return 2**(m.ceil(m.log2(window_length * sampling_rate)))
+
+
+def _stream_data(st, dtype=np.float64):
+    """
+    Return the data of a stream's traces as one 2-D array (a copy)
+
+    :returns: data (n_traces, n_samples), sampling_rate
+    :raises ValueError: if the traces have different sampling rates or
+        lengths, or are offset by more than one sample
+    """
+    sampling_rate = st[0].stats.sampling_rate
+    for i, tr in enumerate(st[1:], 1):
+        tmp = 'Channels 0 and {:d}'.format(i)
+        if tr.stats.sampling_rate != sampling_rate:
+            raise ValueError(tmp + ' have different samp rates')
+        if len(tr.data) != len(st[0].data):
+            raise ValueError(tmp + ' have different lengths')
+        if abs(tr.stats.starttime - st[0].stats.starttime) > \
+                1 / sampling_rate:
+            raise ValueError(tmp + ' are offset by > one sample')
+    return np.array([tr.data for tr in st], dtype=dtype), sampling_rate
+
+
+def _hann(nfft, dtype=np.float64):
+    """
+    Return scipy.signal.welch()'s default (periodic Hann) window
+    """
+    return ssig.get_window('hann', nfft).astype(dtype)
+
+
+def _window_ffts(windows, taper):
+    """
+    FFT linearly-detrended and tapered windows
+
+    :param windows: array (..., nfft) of data windows
+    :param taper: 1-D taper (nfft)
+    :returns: complex array (..., nfft//2 + 1)
+    """
+    nfft = windows.shape[-1]
+    with profiling.stage('fft', windows.nbytes):
+        t = (np.arange(nfft) - (nfft - 1) / 2).astype(windows.dtype)
+        mean = windows.mean(axis=-1, keepdims=True)
+        slope = (windows @ t)[..., np.newaxis] / (t @ t)
+        return sfft.rfft((windows - mean - slope * t) * taper, axis=-1)
+
+
+def _cross_spectra(ffts):
+    """
+    Sum cross-spectra over windows
+
+    :param ffts: complex array (n_chans, n_windows, n_freqs)
+    :returns: complex array (n_chans, n_chans, n_freqs) of
+        sum(conj(ffts[i]) * ffts[j]) over windows
+    """
+    f = ffts.transpose(2, 0, 1)
+    return (f.conj() @ f.transpose(0, 2, 1)).transpose(1, 2, 0)
+
+
+def _multiple_transfer(g, drives, others):
+    """
+    Return the multiple-input transfer functions G_dd^-1 G_do
+
+    :param g: complex array (n_freqs, n_chans, n_chans) of cross-spectra
+    :param drives: indices of the driving channels
+    :param others: indices of the response channels
+    :returns: complex array (n_freqs, n_drives, n_others)
+    """
+    g_dd = g[:, drives][:, :, drives]
+    g_do = g[:, drives][:, :, others]
+    return np.linalg.pinv(g_dd, hermitian=True) @ g_do
+
+
+def _density(sums, n_windows, taper, sampling_rate, nfft):
+    """
+    Convert summed cross-spectra to one-sided spectral densities
+
+    Same scaling as scipy.signal.csd(scaling='density')
+    """
+    out = sums / (n_windows * sampling_rate * (taper**2).sum())
+    if nfft % 2:
+        out[..., 1:] *= 2
+    else:
+        out[..., 1:-1] *= 2
+    return out
+
+
+def _remove_response(stats, freqs, spec, nfft):
+    """
+    Remove the instrument response from a PSD
+
+    :param stats: trace stats, should have a response attached
+    :param freqs: 1-D array of frequencies (without 0)
+    :param spec: 1-D array of PSD values (counts^2/Hz)
+    :param nfft: FFT window length (samples)
+    :returns: spec, units.  If there is no response, spec is unchanged
+        and units are counts
+    """
+    # Remove the response using the same conventions
+    # since the power is squared we must square the sensitivity
+    # determine instrument response from metadata
+    try:
+        resp, _ = response_cache.get(stats.response, nfft,
+                                     stats.sampling_rate, output="VEL")
+        resp = resp[1:]
+    except Exception as e:
+        msg = ("Error getting response from provided metadata:\n"
+               "%s: %s\n"
+               "Skipping time segment(s).")
+        msg = msg % (e.__class__.__name__, str(e))
+        warnings.warn(msg)
+        resp = None
+
+    if resp is not None:
+        # Get the amplitude response (squared)
+        respamp = np.absolute(resp * np.conjugate(resp))
+        # Make omega with the same conventions as spec
+        w = 2.0 * m.pi * freqs
+        # Remove response
+        iu = stats.response.response_stages[0].input_units
+        if iu.upper()[:2] == "PA":
+            print(f'Channel {stats.channel} has input_units "{iu}"'
+                  ': treating as hydrophone')
+            spec = spec / respamp
+            PSD_units = "dB ref 1 Pa^2/Hz"
+        else:
+            spec = (w**2) * spec / respamp
+            PSD_units = "dB ref 1 (m/s^2)^2/Hz"
+    else:
+        PSD_units = "dB ref 1 count^2/Hz"
+    return spec, PSD_units
+
+
+def _response_hash(response):
+    """
+    Return a hash of a response's content
+    """
+    return hashlib.sha1(pickle.dumps(response)).hexdigest()
+
+
 def _fft_taper(data):
     """
     Cosine taper, 10 percent at each end (like done by [McNamara2004]_).
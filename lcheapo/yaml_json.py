@@ -1,11 +1,18 @@
 """
 Routines for yaml/json files
+
+Parsed documents and compiled schema validators are cached by file path,
+modification time and size, so a file referenced many times is only parsed
+once (until it changes).  A schema's signature includes those of the files
+it $refs
 """
 # Standard library modules
+import copy
 import json
 # import pprint
 import os.path
 import sys
+import threading
 import pkg_resources
 
 # Non-standard modules
@@ -18,6 +25,43 @@ VALID_TYPES = ["lctest"]
 DEFAULT_SCHEMA = pkg_resources.resource_filename("lcheapo",
                                                  "data/lctest.schema.json")
 
+# path: (signature, value)
+_documents = {}
+_validators = {}
+_validated = set()  # (instance path, signature, schema signature)
+_cache_lock = threading.Lock()
+
+
+def clear_caches():
+    """
+    Empty the document, validator and validation caches
+    """
+    with _cache_lock:
+        _documents.clear()
+        _validators.clear()
+        _validated.clear()
+
+
+def _file_signature(filename):
+    """
+    Return the (modification time, size) of a file
+    """
+    stat = os.stat(filename)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _cache_get(cache, path, signature):
+    with _cache_lock:
+        entry = cache.get(path)
+    if entry is not None and entry[0] == signature:
+        return entry[1]
+    return None
+
+
+def _cache_put(cache, path, signature, value):
+    with _cache_lock:
+        cache[path] = (signature, value)
+
 
 def list_valid_types():
     """
@@ -52,27 +96,23 @@ def validate(filename, schema_file=DEFAULT_SCHEMA, format=None, type=None,
         verbose = False
     if not type:
         type = _get_file_type(filename)
+
+    # Files that already passed are not validated again until they change
+    schema_signature = _schema_signature(schema_file)
+    key = (os.path.abspath(filename), _file_signature(filename),
+           schema_signature)
+    if schema_signature is not None and key in _validated:
+        if not quiet:
+            print(f"instance = {filename} ... OK")
+        return True
     instance = read_yaml_json(filename, format=format)
 
-    # LOAD SCHEMA FILE
-    base_path = os.path.dirname(schema_file)
-    base_uri = f"file://{base_path}/"
-    with open(schema_file, "r") as f:
-        try:
-            schema = jsonref.loads(f.read(), base_uri=base_uri,
-                                   jsonschema=True)
-        except json.decoder.JSONDecodeError as e:
-            print("JSONDecodeError: Error loading JSON schema file: {}".
-                  format(schema_file))
-            print(str(e))
-            return False
-        except Exception:
-            print(f"Error loading JSON schema file: {schema_file}")
-            print(sys.exc_info()[1])
-            return False
+    # LOAD SCHEMA FILE (cached)
+    v = _schema_validator(schema_file)
+    if v is None:
+        return False
 
     # Lazily report all errors in the instance
-    # ASSUMES SCHEMA IS DRAFT-04 (I couldn't get it to work otherwise)
     try:
         if verbose:
             print(f"instance = {filename}")
@@ -83,8 +123,6 @@ def validate(filename, schema_file=DEFAULT_SCHEMA, format=None, type=None,
             print(f"schema =   {os.path.basename(schema_file)}")
             print("\tTesting schema ...", end="")
 
-        v = jsonschema.Draft4Validator(schema)
-
         if verbose:
             print("OK")
             print("\tTesting instance ...", end="")
@@ -101,6 +139,9 @@ def validate(filename, schema_file=DEFAULT_SCHEMA, format=None, type=None,
                 print(f": {error.message}")
             print("\tFAILED")
         else:
+            if schema_signature is not None:
+                with _cache_lock:
+                    _validated.add(key)
             if not quiet:
                 print("OK")
     except jsonschema.ValidationError as e:
@@ -114,6 +155,80 @@ def validate(filename, schema_file=DEFAULT_SCHEMA, format=None, type=None,
     return True
 
 
+def _schema_validator(schema_file):
+    """
+    Return a Draft-04 validator for a JSON schema file, or None on error
+
+    Validators are cached by the signatures of the schema and of the files
+    it $refs, so the schema is only read and its $refs resolved once (until
+    one of them changes)
+    """
+    path = os.path.abspath(schema_file)
+    signature = _schema_signature(path)
+    v = _cache_get(_validators, path, signature)
+    if v is not None:
+        return v
+    base_path = os.path.dirname(path)
+    base_uri = f"file://{base_path}/"
+    with open(path, "r") as f:
+        try:
+            schema = jsonref.loads(f.read(), base_uri=base_uri,
+                                   jsonschema=True)
+        except json.decoder.JSONDecodeError as e:
+            print("JSONDecodeError: Error loading JSON schema file: {}".
+                  format(schema_file))
+            print(str(e))
+            return None
+        except Exception:
+            print(f"Error loading JSON schema file: {schema_file}")
+            print(sys.exc_info()[1])
+            return None
+    # ASSUMES SCHEMA IS DRAFT-04 (I couldn't get it to work otherwise)
+    v = jsonschema.Draft4Validator(schema)
+    if signature is not None:
+        _cache_put(_validators, path, signature, v)
+    return v
+
+
+def _schema_signature(schema_file):
+    """
+    Return the signatures of a schema file and of the files it $refs
+    (recursively), or None if one of them can't be read
+    """
+    signatures, todo = {}, [os.path.abspath(schema_file)]
+    while todo:
+        path = todo.pop()
+        if path in signatures:
+            continue
+        try:
+            signatures[path] = _file_signature(path)
+        except OSError:
+            return None
+        schema = _cached_document(path, "JSON")
+        if schema is None:
+            return None
+        todo.extend(os.path.normpath(os.path.join(os.path.dirname(path), ref))
+                    for ref in _file_refs(schema))
+    return tuple(sorted(signatures.items()))
+
+
+def _file_refs(element):
+    """
+    Yield the file parts of the local-file $refs in a JSON element
+    """
+    if isinstance(element, dict):
+        for key, value in element.items():
+            if key == "$ref" and isinstance(value, str):
+                ref = value.split("#")[0]
+                if ref and "://" not in ref:
+                    yield ref
+            else:
+                yield from _file_refs(value)
+    elif isinstance(element, list):
+        for value in element:
+            yield from _file_refs(value)
+
+
 def _get_file_format(filename):
     """
     Determines if the information file is in JSON or YAML format
@@ -131,21 +246,49 @@ def _get_file_format(filename):
 def read_yaml_json(filename, format=None, debug=False):
     """
     Read a JSON or YAML file
+
+    Documents are cached by path and modification time: a file is only
+    parsed again if it has changed.  Each call returns a new copy.
     """
     if not format:
         format = _get_file_format(filename)
+    element = _cached_document(filename, format, debug)
+    if element is None:
+        return
+    return copy.deepcopy(element)
+
 
+def _cached_document(filename, format, debug=False):
+    """
+    Return the cached parse of a file (not to be modified), or None on error
+    """
+    path = os.path.abspath(filename)
+    signature = _file_signature(path)
+    element = _cache_get(_documents, (path, format), signature)
+    if element is None:
+        element = _parse_yaml_json(filename, format)
+        if element is not None:
+            _cache_put(_documents, (path, format), signature, element)
+    elif debug:
+        print(f"READ_YAML_JSON(): {filename} from cache")
+    return element
+
+
+def _parse_yaml_json(filename, format):
+    """
+    Parse a JSON or YAML file
+    """
     with open(filename, "r") as f:
         if format == "YAML":
             try:
                 element = yaml.safe_load(f)
-            except yaml.ParserError:
+            except yaml.YAMLError:
                 print(f"Error parsing YAML file: {filename}")
                 print(sys.exc_info()[1])
                 return
         else:
             try:
-                element = json.load(filename)
+                element = json.load(f)
             except json.decoder.JSONDecodeError as e:
                 print(f"JSONDecodeError: Error loading JSON file: {filename}")
                 print(str(e))
@@ -34,10 +34,15 @@ setuptools.setup(
              'lcdump=lcheapo.lcdump:main',
              'lccut=lcheapo.lccut:main',
              'lcinfo=lcheapo.lcinfo:main',
+             'lcverify=lcheapo.lcverify:main',
              'lcheader=lcheapo.lcheader:main',
              'lcplot=lcheapo.lcplot:main',
              'lc2SDS_py=lcheapo.lc2SDS:main',
              'lc2ms_py=lcheapo.lc2ms:main',
+             'lc2npy=lcheapo.lc2npy:main',
+             'lctest=lcheapo.lctest:main',
+             'lcsynth=lcheapo.lcsynth:main',
+             'lcdetect=lcheapo.lcdetect:main',
              'lc_examples=lcheapo.lcputexamples:main'
          ]
     },
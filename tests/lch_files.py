@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Create small LCHEAPO files for the tests
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from lcheapo.lcheapo_utils import LCDiskHeader, LCDataBlock
+
+
+def write_test_lch(fname, n_chans=4, n_groups=2000, sample_rate=62.5,
+                   start=datetime(2019, 7, 20, 11, 0, 0, 8000)):
+    """
+    Write a small LCHEAPO file with a header and random 24-bit data
+
+    Returns:
+        data (:class:`numpy.ndarray`): written samples (n_chans, n_samples)
+    """
+    h = LCDiskHeader()
+    (h.writeBlock, h.writeByte, h.readBlock, h.readByte) = (0, 0, 0, 0)
+    (h.dirStart, h.dirSize, h.dirBlock, h.dirCount) = (8, 0, 8, 0)
+    (h.slowStart, h.slowSize, h.slowBlock, h.slowByte) = (0, 0, 0, 0)
+    (h.logStart, h.logSize, h.logBlock, h.logByte) = (0, 0, 0, 0)
+    (h.dataStart, h.diskNumber) = (16, 0)
+    (h.softwareVersion, h.description) = ('9.08a', 'test file')
+    (h.sampleRate, h.startChannel, h.numberOfChannels) = (
+        int(sample_rate), 0, n_chans)
+    (h.slowDataRate, h.slowStartChannel, h.slowNumberOfChannels) = (0, 0, 0)
+    (h.dataType, h.diskSize, h.ramSize, h.numberOfWindows) = (2, 0, 8, 0)
+    rng = np.random.default_rng(42)
+    data = rng.integers(-2**23 + 1, 2**23 - 1, (n_chans, n_groups * 166),
+                        dtype=np.int32)
+    raw = data.astype('>i4').view('u1').reshape(n_chans, n_groups, 166, 4)
+    block = LCDataBlock()
+    (block.blockFlag, block.numberOfSamples, block.U1, block.U2) = (
+        73, 166, 3, 166)
+    msec_per_block = int(166 / sample_rate * 1000)
+    with open(fname, 'wb') as fp:
+        fp.write(b'\x00' * 512 * h.dataStart)
+        h.seekHeaderPosition(fp)
+        h.writeHeader(fp)
+        block.seekBlock(fp, h.dataStart)
+        for g in range(n_groups):
+            block.changeTime(start + timedelta(milliseconds=g*msec_per_block))
+            for c in range(n_chans):
+                block.muxChannel = c
+                block.data = raw[c, g, :, 1:].tobytes()
+                block.writeBlock(fp)
+    return data
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Functions to test batch plotting
+"""
+import pickle
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+import numpy as np
+
+from lcheapo.batch_plot import PlotSpec, new_figure, render_all
+
+
+def render_line(filename, x, y):
+    fig = new_figure(figsize=(3, 2))
+    fig.add_subplot().plot(x, y)
+    fig.savefig(filename)
+
+
+class TestBatchPlot(unittest.TestCase):
+    """
+    Test suite for batch plotting
+    """
+    def test_render_all(self):
+        """ Specs are rendered in this process or in workers """
+        with tempfile.TemporaryDirectory() as tmp:
+            for jobs in (1, 2):
+                specs = [PlotSpec(render_line, Path(tmp) / f'{jobs}_{i}.png',
+                                  x=np.arange(10), y=np.arange(10) * i)
+                         for i in range(4)]
+                pickle.dumps(specs)
+                with redirect_stdout(StringIO()) as out:
+                    done = render_all(specs, jobs=jobs)
+                self.assertEqual(sorted(done),
+                                 sorted(s.filename for s in specs))
+                self.assertIn('[4/4]', out.getvalue())
+                for s in specs:
+                    with open(s.filename, 'rb') as fp:
+                        self.assertEqual(fp.read(4), b'\x89PNG')
+
+
+if __name__ == '__main__':
+    unittest.main()
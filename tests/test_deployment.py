@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Functions to test reading deployments split over several LCHEAPO files
+"""
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from lcheapo.deployment import Deployment, TIME_BLOCKS
+from lcheapo.lcheapo_utils import BLOCK_SIZE
+from lcheapo.lcread import read as lcread
+from lcheapo.lcscan import BLOCK_DTYPE
+from lch_files import write_test_lch
+
+DATA_START = 16  # first data block of write_test_lch() files
+
+
+class TestDeployment(unittest.TestCase):
+    """
+    Test suite for Deployment
+    """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name)
+        self.full = self.path / 'FULL.raw.lch'
+        self.data = write_test_lch(self.full, n_groups=1000)
+        self.raw = self.full.read_bytes()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, name, first_block, last_block=None):
+        """ Write blocks [first_block, last_block) of the full file """
+        end = None if last_block is None else last_block * BLOCK_SIZE
+        (self.path / name).write_bytes(
+            self.raw[first_block * BLOCK_SIZE:end])
+        return self.path / name
+
+    def test_continuous(self):
+        """ Windows across a file boundary match the unsplit file """
+        split = DATA_START + 4 * 400
+        files = [self._write('A.raw.lch', 0, split),
+                 self._write('B.raw.lch', split)]
+        d = Deployment(files)
+        self.assertEqual(d.file_offsets.tolist(), [0, 400 * 166, 1000 * 166])
+        _, data = d.get_data()
+        np.testing.assert_array_equal(data, self.data)
+        start = d.starttime + 1000.3
+        st = d.read(start, start + 200, responses=False)
+        st_lch = lcread(str(self.full), start, start + 200,
+                        obs_type='SPOBS2')
+        self.assertEqual(len(st), 4)
+        for tr, tr_lch in zip(st, st_lch):
+            self.assertEqual(tr.id, tr_lch.id)
+            self.assertEqual(tr.stats.starttime, tr_lch.stats.starttime)
+            np.testing.assert_array_equal(tr.data, tr_lch.data)
+        chunks = list(d.iter_streams(start, 500, chunk_blocks=50))
+        self.assertEqual(chunks[1][0].stats.starttime,
+                         chunks[0][0].stats.endtime + 1 / d.sampling_rate)
+        np.testing.assert_array_equal(
+            np.concatenate([c[2].data for c in chunks]),
+            d.read(start, 500, responses=False)[2].data)
+
+    def test_header_file(self):
+        """ The '.header.' file gives the header, whatever its position """
+        split = DATA_START + 4 * 300
+        files = [self._write('D1.lch', DATA_START, split),
+                 self._write('H.header.lch', 0, DATA_START),
+                 self._write('D2.lch', split)]
+        d = Deployment(files)
+        self.assertEqual([f.name for f in d.files], ['D1.lch', 'D2.lch'])
+        np.testing.assert_array_equal(d.get_data()[1], self.data)
+
+    def test_gap(self):
+        """ Traces are split where a file does not continue the previous """
+        split = DATA_START + 4 * 400 + 2  # the second file loses a group
+        d = Deployment([self._write('A.raw.lch', 0, split),
+                        self._write('B.raw.lch', split)])
+        st = d.read(responses=False)
+        self.assertEqual(len(st), 8)
+        self.assertAlmostEqual(st[4].stats.starttime - st[0].stats.endtime,
+                               (166 + 1) / d.sampling_rate)
+
+    def test_invalid_time(self):
+        """ A file's start time is taken from its first valid block time """
+        start = Deployment([self.full]).starttime
+        blocks = np.memmap(self.full, dtype=BLOCK_DTYPE, mode='r+',
+                           offset=DATA_START * BLOCK_SIZE)
+        blocks['month'][0] = 13
+        blocks.flush()
+        self.assertEqual(Deployment([self.full]).starttime, start)
+        blocks['month'][:4 * TIME_BLOCKS] = 13
+        blocks.flush()
+        del blocks
+        with self.assertRaises(ValueError):
+            Deployment([self.full])
+
+
+def suite():
+    return unittest.makeSuite(TestDeployment, 'test')
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Functions to test the STA/LTA detector
+"""
+import tempfile
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from obspy import read_events
+from obspy.signal.trigger import recursive_sta_lta, classic_sta_lta
+
+from lcheapo.deployment import Deployment
+from lcheapo.lcdetect import (StaLta, detect, coincidence, write_csv,
+                              write_quakeml)
+from lcheapo.lcscan import map_blocks
+from lcheapo.lcsynth import write_synthetic
+
+BURST_BLOCKS = (3000, 3008)  # block groups containing the burst
+
+
+class TestLCDetect(unittest.TestCase):
+    """
+    Test suite for lcdetect
+    """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_stalta(self):
+        """ Chunked ratios match obspy's whole-trace functions """
+        rng = np.random.default_rng(0)
+        x = rng.normal(size=(2, 5000)) * 100
+        x[:, 3000:3100] *= 20
+        for method, func in (('recursive', recursive_sta_lta),
+                             ('classic', classic_sta_lta)):
+            stalta = StaLta(2, 100., sta=0.5, lta=5., method=method)
+            ratio = np.concatenate([stalta.process(c) for c in
+                                    np.array_split(x, 7, axis=1)], axis=1)
+            self.assertTrue(np.all(ratio[:, :500] == 0))
+            np.testing.assert_allclose(ratio[1, 500:],
+                                       func(x[1], 50, 500)[500:], rtol=1e-4)
+
+    def _burst_file(self, fname, g0, g1, **kwargs):
+        """
+        Write a 4-channel synthetic file with a burst in block groups
+        [g0, g1)
+        """
+        info = write_synthetic(fname, n_chans=4, sample_rate=125, **kwargs)
+        blocks = map_blocks(fname, info['data_start'])
+        blocks = np.memmap(fname, dtype=blocks.dtype, mode='r+',
+                           offset=info['data_start'] * 512,
+                           shape=blocks.shape)
+        if g0 < 0:
+            g0, g1 = g0 + len(blocks) // 4, g1 + len(blocks) // 4
+        rng = np.random.default_rng(1)
+        loud = rng.integers(-2**22, 2**22, (4 * (g1 - g0), 166))
+        blocks['data'][4 * g0:4 * g1] = (
+            loud.astype('>i4').view('u1').reshape(-1, 166, 4)[..., 1:]
+            .reshape(-1, 498))
+        blocks.flush()
+        return info
+
+    def test_detect(self):
+        """ A burst on all channels is one event, whatever the chunks """
+        fname = self.path / 'SYNTH.raw.lch'
+        g0, g1 = BURST_BLOCKS
+        self._burst_file(fname, g0, g1, duration=6000.)
+        d = Deployment([fname])
+        triggers = detect(d, sta=1, lta=20, on=5, off=1.5,
+                          chunk_blocks=100)
+        self.assertEqual(len(triggers), 4)
+        burst_time = d.sample_time(g0 * 166)
+        for t in triggers:
+            self.assertLess(abs(t['on_time'] - burst_time), 1)
+        self.assertEqual(detect(d, sta=1, lta=20, on=5, off=1.5,
+                                chunk_blocks=3333), triggers)
+        events = coincidence(triggers, 4)
+        self.assertEqual(len(events), 1)
+        write_csv(triggers, self.path / 'triggers.csv')
+        lines = (self.path / 'triggers.csv').read_text().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(lines[0].startswith('seed_id,on_time'))
+        write_quakeml(events, self.path / 'events.xml')
+        catalog = read_events(str(self.path / 'events.xml'))
+        self.assertEqual(len(catalog[0].picks), 4)
+
+    def test_gap(self):
+        """ Triggers end at a gap between files, even inside a chunk """
+        first = self.path / 'A.raw.lch'
+        self._burst_file(first, -6, 0, duration=6000.)
+        second = self.path / 'B.raw.lch'
+        info = write_synthetic(second, n_chans=4, sample_rate=125,
+                               duration=6000.,
+                               starttime=datetime(2022, 1, 1, 4))
+        # Following files have no header
+        second.write_bytes(
+            second.read_bytes()[info['data_start'] * 512:])
+        d = Deployment([first, second])
+        self.assertEqual(len(d.files), 2)
+        gap_index = int(d.file_offsets[1])
+        triggers = detect(d, sta=1, lta=20, on=5, off=1.5)
+        self.assertNotEqual(gap_index % (2048 * 166), 0)
+        self.assertEqual(len(triggers), 4)
+        for t in triggers:
+            self.assertLessEqual(t['off_time'], d.sample_time(gap_index - 1)
+                                 + 1 / d.sampling_rate)
+        self.assertEqual(detect(d, sta=1, lta=20, on=5, off=1.5,
+                                chunk_blocks=100), triggers)
+
+
+def suite():
+    return unittest.makeSuite(TestLCDetect, 'test')
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
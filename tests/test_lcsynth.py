@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Functions to test the synthetic LCHEAPO file generator
+"""
+import re
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from lcheapo.lcheapo_utils import LCDataBlock, LCDiskHeader, BLOCK_SIZE
+from lcheapo.lcscan import read_directory
+from lcheapo.lcsynth import write_synthetic
+
+
+class TestLCSynth(unittest.TestCase):
+    """
+    Test suite for lcsynth
+    """
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_lcfix_counts(self):
+        """ lcfix finds exactly the faults that were written """
+        fname = 'SYNTH.raw.lch'
+        info = write_synthetic(self.path / fname, duration=10000.,
+                               faults=dict(bug1=5, bug1a=1, bug2=2, bug3=1,
+                                           time_tear=1))
+        self.assertEqual(len(info['faults']['bug3']), 1)
+        subprocess.run([sys.executable, '-c',
+                        'from lcheapo.lcfix import main; main()',
+                        '--dryrun', '-i', str(self.path), '-o',
+                        str(self.path), fname],
+                       check=True, capture_output=True)
+        log = (self.path / 'SYNTH.fix.txt').read_text()
+        m = re.search(r'Overall: \d+ files, (\d+) BUG1s, (\d+) BUG2s, '
+                      r'(\d+) BUG3s, (\d+) Time Tears', log)
+        self.assertIsNotNone(m, log)
+        expected = info['expected']
+        self.assertEqual([int(x) for x in m.groups()],
+                         [expected['bug1'], expected['bug2'],
+                          expected['bug3'], expected['time_tear']])
+
+    def test_lcfix_headerless(self):
+        """ lcfix's directory ends at the last block of a headerless file """
+        info = write_synthetic(self.path / 'SYNTH.raw.lch', duration=3000.)
+        raw = (self.path / 'SYNTH.raw.lch').read_bytes()
+        data_start = info['data_start']
+        (self.path / 'SYNTH.header.lch').write_bytes(
+            raw[:data_start * BLOCK_SIZE])
+        # Starts with channel 2 and 3 blocks, which lcfix skips
+        (self.path / 'SYNTH.0001.lch').write_bytes(
+            raw[(data_start + 2) * BLOCK_SIZE:])
+        subprocess.run([sys.executable, '-c',
+                        'from lcheapo.lcfix import main; main()',
+                        '-i', str(self.path), '-o', str(self.path / 'out'),
+                        'SYNTH.header.lch', 'SYNTH.0001.lch'],
+                       check=True, capture_output=True)
+        out_file, = (self.path / 'out').glob('*.fix.lch')
+        with open(out_file, 'rb') as fp:
+            header = LCDiskHeader()
+            header.readHeader(fp)
+            entries = read_directory(fp, header.dirStart, header.dirCount)
+        last = entries[-1]
+        self.assertEqual(last['blockNumber'] + last['numBlocks'],
+                         out_file.stat().st_size // BLOCK_SIZE)
+
+    def test_blocks(self):
+        """ Header and data blocks are read back by lcheapo_utils """
+        fname = self.path / 'SYNTH.raw.lch'
+        info = write_synthetic(fname, n_chans=2, sample_rate=62,
+                               duration=60.)
+        with open(fname, 'rb') as fp:
+            header = LCDiskHeader()
+            header.seekHeaderPosition(fp)
+            header.readHeader(fp)
+            self.assertEqual(header.numberOfChannels, 2)
+            self.assertEqual(header.dataStart, info['data_start'])
+            self.assertEqual(header.writeBlock,
+                             info['data_start'] + info['n_blocks'])
+            block = LCDataBlock()
+            for i in range(info['n_blocks']):
+                block.seekBlock(fp, info['data_start'] + i)
+                block.readBlock(fp)
+                self.assertEqual(block.muxChannel, i % 2)
+                self.assertEqual(block.blockFlag, 73)
+                self.assertEqual(block.numberOfSamples, 166)
+
+
+def suite():
+    return unittest.makeSuite(TestLCSynth, 'test')
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Functions to test the lctest runner
+"""
+import tempfile
+import unittest
+import warnings
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+import numpy as np
+from obspy import UTCDateTime
+
+from lcheapo.lcread import read as lcread
+from lcheapo.lctest import ReadCache, plot_stages, run, _merge_windows
+from lch_files import write_test_lch
+
+START = UTCDateTime('2019-07-20T11:00:00.008')
+
+
+def make_root(files):
+    """
+    Return an lctest configuration with 10 plots of two instruments
+    """
+    times = [str(START + t) for t in (600, 610, 620)]
+    return {
+        'input': {'datafiles': [
+            {'name': str(f), 'obs_type': 'SPOBS2', 'station': f'STA{i:d}'}
+            for i, f in enumerate(files)]},
+        'output': {'show': False, 'filebase': None},
+        'plot_globals': {'stack': {'offset_before.s': 0.5,
+                                   'offset_after.s': 1.5},
+                         'spectra': {'window_length.s': 50}},
+        'plots': {
+            'time_series': [
+                {'description': f'Series {i:d}', 'select': {'station': '*'},
+                 'start_time': str(START + 100 * i),
+                 'end_time': str(START + 100 * i + 300)}
+                for i in range(4)],
+            'spectra': [
+                {'description': 'Entire', 'select': {'component': '3'},
+                 'start_time': None, 'end_time': None},
+                {'description': 'Separate', 'overlay': False,
+                 'start_time': str(START + 200),
+                 'end_time': str(START + 800)}],
+            'stack': [
+                {'description': 'Taps', 'components': ['3'], 'times': times,
+                 'plot_span': True},
+                {'description': 'Taps 1', 'components': ['1'],
+                 'times': times}],
+            'particle_motion': [
+                {'description': f'Jump {i:d}', 'component_x': '2',
+                 'component_y': '1', 'times': times,
+                 'particle_offset_before.s': 0,
+                 'particle_offset_after.s': 0.5,
+                 'offset_before.s': 1, 'offset_after.s': 2}
+                for i in range(2)]}}
+
+
+class TestLCTest(unittest.TestCase):
+    """
+    Test suite for lctest
+    """
+    def setUp(self):
+        warnings.simplefilter('ignore', UserWarning)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name)
+        self.files = [self.path / f'INST{i:d}.raw.lch' for i in range(2)]
+        for f in self.files:
+            write_test_lch(f, n_groups=400)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_read_cache(self):
+        """ Each file is read once, slices match direct reads """
+        datafiles = [{'name': str(self.files[0]), 'obs_type': 'SPOBS2',
+                      'station': sta} for sta in ('A', 'B')]
+        cache = ReadCache(datafiles)
+        for start in (100, 300, 900):
+            cache.request(START + start, START + start + 200)
+        with redirect_stdout(StringIO()):
+            self.assertEqual(cache.load(), 1)
+            st = cache.get(START + 310, START + 400, select={'station': 'B'})
+            direct = lcread(str(self.files[0]), START + 310, START + 400,
+                            station='B', obs_type='SPOBS2')
+        self.assertEqual(len(st), 4)
+        for tr, tr_direct in zip(st, direct):
+            self.assertEqual(tr.id, tr_direct.id)
+            self.assertEqual(tr.stats.starttime, tr_direct.stats.starttime)
+            np.testing.assert_array_equal(tr.data, tr_direct.data)
+        cache = ReadCache(datafiles, max_gap=0)
+        for start in (100, 300, 900):
+            cache.request(START + start, START + start + 200)
+        with redirect_stdout(StringIO()):
+            self.assertEqual(cache.load(), 2)
+        self.assertEqual(_merge_windows([(5, 6), (0, 2), (1, 3)]),
+                         [(0, 3), (5, 6)])
+
+    def test_run(self):
+        """ 10 plots of 2 instruments make 2 reads """
+        root = make_root(self.files)
+        self.assertEqual(len(plot_stages(root)), 10)
+        with redirect_stdout(StringIO()) as out:
+            files = run(root, str(self.path / 'out' / 'test'), jobs=2,
+                        verbose=True)
+        self.assertIn('ReadCache(2 files, 2 reads)', out.getvalue())
+        # 4 time series, 2 spectra, 2 stacks * 2 stations + 1 span,
+        # 2 particle motions * 2 stations
+        self.assertEqual(len(files), 15)
+        for f in files:
+            self.assertTrue(Path(f).is_file())
+        self.assertTrue(any('_span_' in f for f in files))
+
+
+def suite():
+    return unittest.makeSuite(TestLCTest, 'test')
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
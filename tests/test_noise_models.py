@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Functions to test the noise models
+"""
+import unittest
+
+import numpy as np
+
+from lcheapo import noise_models
+from lcheapo.noise_models import (PetersonNoiseModel, BrownNoiseModel,
+                                  two_pole_HP, LPAB)
+
+
+class TestNoiseModels(unittest.TestCase):
+    """
+    Test suite for noise models
+    """
+    def test_peterson(self):
+        """ Peterson models at the knots, as periods and frequencies """
+        periods = np.array([x[0] for x in LPAB])
+        low, high = PetersonNoiseModel(periods)
+        np.testing.assert_allclose(
+            low, [x[1] + x[2] * np.log10(x[0]) for x in LPAB])
+        self.assertAlmostEqual(high[0], -91.5, places=2)
+        freqs = 1 / periods[::-1]
+        low_f, _ = PetersonNoiseModel(freqs, as_freqs=True)
+        np.testing.assert_allclose(low_f, low[::-1])
+        low, _ = PetersonNoiseModel([0.01, 1.])
+        self.assertTrue(np.isnan(low[0]))
+        with self.assertRaises(AssertionError):
+            PetersonNoiseModel([10., 1.])
+
+    def test_cache_and_batches(self):
+        """ Curves are cached per grid, 2-D grids are evaluated per row """
+        periods = np.logspace(-1, 4, 200)
+        curves = BrownNoiseModel(periods)
+        self.assertIs(BrownNoiseModel(periods.copy()), curves)
+        self.assertIsNot(PetersonNoiseModel(periods)[0], curves[0])
+        self.assertFalse(curves[0].flags.writeable)
+        self.assertLessEqual(len(noise_models._cache),
+                             noise_models.MAX_CACHED)
+        grids = np.vstack((periods, periods * 2))
+        low, high = BrownNoiseModel(grids)
+        self.assertEqual(low.shape, grids.shape)
+        np.testing.assert_array_equal(low[1], BrownNoiseModel(periods * 2)[0])
+        np.testing.assert_array_equal(high[0], curves[1])
+
+    def test_two_pole_HP(self):
+        """ High-pass correction: 0 dB well above the corner """
+        periods = np.array([0.1, 1., 100., 1000.])
+        correction = two_pole_HP(periods, 0.01, 1.)
+        self.assertEqual(correction.shape, periods.shape)
+        self.assertAlmostEqual(correction[0], 0., places=2)
+        self.assertGreater(correction[-1], 20.)
+
+
+if __name__ == '__main__':
+    unittest.main()
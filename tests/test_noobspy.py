@@ -13,8 +13,16 @@ import filecmp
 import inspect
 import difflib
 import json
+import subprocess
+from datetime import datetime
 from pathlib import Path
 
+import numpy as np
+
+from lch_files import write_test_lch
+from lcheapo.lcheapo_utils import LCDiskHeader, LCDirEntry
+from lcheapo.lcscan import read_directory, read_headers, header_times
+
 
 class TestLCHEAPOMethods(unittest.TestCase):
     """
@@ -163,6 +171,50 @@ class TestLCHEAPOMethods(unittest.TestCase):
             str(Path(self.test_path) / new_outfname))
         Path(new_outfname).unlink()
 
+    def test_lcfix_directory(self):
+        """
+        Test lcfix's directory rebuild (BUG3 and added entries)
+        """
+        sub = self.path / 'lcfix_dir'
+        sub.mkdir(exist_ok=True)
+        fname = self.path / 'DIR.raw.lch'
+        write_test_lch(fname, n_groups=8000)
+        # Give the file a 2-entry directory with BUG3 lengths
+        with open(fname, 'r+b') as fp:
+            h = LCDiskHeader()
+            h.readHeader(fp)
+            h.dirSize, h.dirCount = 64, 2
+            h.seekHeaderPosition(fp)
+            h.writeHeader(fp)
+            d = LCDirEntry()
+            d.seekBlock(fp, h.dirStart)
+            for k in range(2):
+                d.changeTime(datetime(2019, 7, 20, 10, 0, k))
+                (d.blockNumber, d.recordLength, d.sampleRate, d.numBlocks,
+                 d.flag, d.muxChannel) = (16 + k*14336, 512, 62, 16384, 1, 0)
+                d.writeDirEntry(fp)
+        cmd = f'lcfix -d {self.path} -o lcfix_dir DIR.raw.lch'
+        subprocess.run(cmd, shell=True, capture_output=True, check=True)
+        with open(sub / 'DIR.fix.lch', 'rb') as fp:
+            h = LCDiskHeader()
+            h.readHeader(fp)
+            entries = read_directory(fp, h.dirStart, 4)
+        self.assertEqual(h.dirCount, 3)
+        self.assertEqual(entries['blockNumber'][:3].tolist(),
+                         [16, 14352, 28688])
+        self.assertEqual(entries['numBlocks'][:3].tolist(),
+                         [14336, 14336, 32015 - 28688 + 1])
+        self.assertEqual(entries['blockNumber'][3], 0)
+        block_times = [header_times(read_headers(sub / 'DIR.fix.lch', b, 1))
+                       for b in (16, 14352, 28688)]
+        np.testing.assert_array_equal(header_times(entries[:3]),
+                                      np.concatenate(block_times))
+        self.assertEqual(entries['recordLength'][2], 512)
+        for f in sub.iterdir():
+            f.unlink()
+        sub.rmdir()
+        fname.unlink()
+
     def test_lccut(self):
         """
         Test lccut
@@ -229,6 +281,126 @@ class TestLCHEAPOMethods(unittest.TestCase):
         Path(outfname).unlink()
         Path('process-steps.json').unlink()
 
+    def test_lcverify(self):
+        """
+        Test lcverify on a file with corrupted blocks
+        """
+        fname = self.path / 'VERIFY.raw.lch'
+        write_test_lch(fname, n_groups=500)
+        # Write CRCs of the good file
+        cmd = f'lcverify -d {self.path} --write_crc -f json VERIFY.raw.lch'
+        out = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        self.assertEqual(out.returncode, 0)
+        report = json.loads(out.stdout)[0]
+        self.assertEqual(report['n_blocks'], 2000)
+        self.assertEqual(sum(report['counts'].values()), 0)
+        # Corrupt the file: bad channel, all-zero data and a bad month
+        with open(fname, 'r+b') as fp:
+            fp.seek(100 * 512 + 9)      # block 84: muxChannel
+            fp.write(b'\x07')
+            fp.seek(200 * 512 + 14)     # block 184: data
+            fp.write(b'\x00' * 498)
+            fp.seek(300 * 512 + 6)      # block 284: month
+            fp.write(b'\x0d')
+        cmd = f'lcverify -d {self.path} --check_crc -f json VERIFY.raw.lch'
+        out = subprocess.run(cmd, shell=True, capture_output=True, text=True)
+        self.assertEqual(out.returncode, 2)
+        report = json.loads(out.stdout)[0]
+        self.assertEqual(report['counts']['bad_mux'], 1)
+        self.assertEqual(report['first_bad_blocks']['bad_mux'], [100])
+        self.assertEqual(report['counts']['zero_data'], 1)
+        self.assertEqual(report['first_bad_blocks']['zero_data'], [200])
+        self.assertEqual(report['first_bad_blocks']['bad_time'], [300])
+        self.assertEqual(report['crc_check']['mismatched'], 3)
+        self.assertEqual(report['crc_check']['first_mismatched'],
+                         [100, 200, 300])
+        steps = json.loads((self.path / 'process-steps.json').read_text())
+        self.assertEqual(steps['steps'][0]['application']['name'],
+                         'lcverify')
+        fname.unlink()
+        (self.path / 'VERIFY.raw.lch.crc32.npz').unlink()
+        (self.path / 'process-steps.json').unlink()
+
+    def test_lcinfo_batch(self):
+        """
+        Test lcinfo's parallel, recursive mode
+        """
+        sub = self.path / 'lcinfo_batch'
+        (sub / 'sta2').mkdir(parents=True, exist_ok=True)
+        write_test_lch(sub / 'STA1.raw.lch', n_groups=200)
+        write_test_lch(sub / 'sta2' / 'STA2.raw.lch', n_groups=100)
+        # Add a time tear by appending a later file's data blocks
+        write_test_lch(sub / 'later.lch', n_groups=100,
+                       start=datetime(2019, 7, 20, 12, 0, 0))
+        with open(sub / 'STA1.raw.lch', 'ab') as fp:
+            fp.write((sub / 'later.lch').read_bytes()[16*512:])
+        (sub / 'later.lch').unlink()
+        # Add an isolated time error (second of channel 0 block #50)
+        with open(sub / 'sta2' / 'STA2.raw.lch', 'r+b') as fp:
+            fp.seek((16 + 4 * 50) * 512 + 2)
+            fp.write(b'\x3b')
+        cmd = f'lcinfo -d {self.path} -r lcinfo_batch -j 2 -f json -t'
+        out = subprocess.run(cmd, shell=True, capture_output=True, text=True,
+                             check=True)
+        infos = json.loads(out.stdout)
+        self.assertEqual([Path(x['file']).name for x in infos],
+                         ['STA1.raw.lch', 'STA2.raw.lch'])
+        self.assertEqual(infos[0]['n_channels'], 4)
+        self.assertEqual(infos[0]['sample_rate'], 62.5)
+        self.assertEqual(infos[0]['start_time'], '2019-07-20T11:00:00.008000')
+        self.assertEqual(infos[0]['end_time'], '2019-07-20T12:04:25.600000')
+        self.assertEqual(infos[0]['n_blocks'], 1200)
+        self.assertEqual(infos[0]['time_tears'], 1)
+        self.assertEqual(infos[0]['isolated_time_errors'], 0)
+        self.assertEqual(infos[1]['time_tears'], 0)
+        self.assertEqual(infos[1]['isolated_time_errors'], 1)
+        cmd = f'lcinfo -d {self.path} -r lcinfo_batch -f csv'
+        out = subprocess.run(cmd, shell=True, capture_output=True, text=True,
+                             check=True)
+        self.assertEqual(out.stdout.splitlines()[0],
+                         'file,has_header,n_channels,sample_rate,start_time,'
+                         'end_time,duration_s,n_blocks,error')
+        for f in sub.rglob('*.lch'):
+            f.unlink()
+        (sub / 'sta2').rmdir()
+        sub.rmdir()
+
+    def test_lcdump_bulk(self):
+        """
+        Test lcdump's formats and export on a 2-channel file
+        """
+        fname = self.path / 'DUMP.raw.lch'
+        write_test_lch(fname, n_chans=2, n_groups=100)
+        cmd = f'lcdump {fname} 16 3'
+        out = subprocess.run(cmd, shell=True, capture_output=True, text=True,
+                             check=True)
+        self.assertEqual(out.stdout.splitlines(), [
+            '      16: 19/07/20-11:00:00.008  F073 CH00  166 samps U1=003 '
+            'U2=166',
+            '      17: 19/07/20-11:00:00.008  F073 CH01  166 samps U1=003 '
+            'U2=166',
+            '      18: 19/07/20-11:00:02.664  F073 CH00  166 samps U1=003 '
+            'U2=166'])
+        # Time verification must use the file's number of channels
+        cmd = f'lcdump -f 3 {fname} 16 200'
+        out = subprocess.run(cmd, shell=True, capture_output=True, text=True,
+                             check=True)
+        lines = out.stdout.splitlines()
+        self.assertEqual(len(lines), 203)
+        self.assertEqual(lines[-1], '     215:  1 | 2019/07/20-11:04:22.952 '
+                                    '| 2019/07/20-11:04:22.952 |    0.000')
+        export = self.path / 'DUMP.npy'
+        cmd = f'lcdump -x {export} {fname} 16 200'
+        subprocess.run(cmd, shell=True, check=True)
+        headers = np.load(export)
+        self.assertEqual(len(headers), 200)
+        self.assertEqual(headers['block'][-1], 215)
+        self.assertEqual(headers['time'][-1],
+                         np.datetime64('2019-07-20T11:04:22.952'))
+        self.assertTrue(np.all(headers['muxChannel'] == np.arange(200) % 2))
+        fname.unlink()
+        export.unlink()
+
 
 def suite():
     return unittest.makeSuite(TestLCHEAPOMethods, 'test')
@@ -8,19 +8,28 @@ Functions to test the lcheapo functions
 # from future.builtins import *  # NOQA @UnusedWildImport
 
 import os
+from datetime import datetime
 from pathlib import Path
 import unittest
 import filecmp
 import inspect
 import difflib
-# import json
+import json
 import glob
 import subprocess
+import tempfile
 
 from lcheapo.lcread import read as lcread, band_code_sps
 from lcheapo.yaml_json import validate
 from lcheapo.lc2SDS import _adjust_leapseconds, _leap_correct
+from lcheapo.lc2npy import convert as lc2npy_convert, NpyArchive
+from lcheapo.lc2ms import convert as lc2ms_convert
+from lcheapo.lcscan import BLOCK_DTYPE
+from obspy import read as obspy_read
 from obspy.core import UTCDateTime
+import numpy as np
+
+from lch_files import write_test_lch
 
 
 class TestAllMethods(unittest.TestCase):
@@ -127,16 +136,105 @@ class TestAllMethods(unittest.TestCase):
         self.path.joinpath('test.lch').unlink()
         self.path.joinpath('process-steps.json').unlink()
         
+    def test_lc2npy(self):
+        """ test conversion to and reading from NumPy archives """
+        lch_file = self.path / 'TEST.raw.lch'
+        data = write_test_lch(lch_file)
+        for compression in ('none', 'zlib'):
+            archive = lc2npy_convert(lch_file, self.path, station='TEST',
+                                     chunk_blocks=100,
+                                     compression=compression)
+            npy = NpyArchive(archive)
+            self.assertEqual(npy.starttime,
+                             UTCDateTime('2019-07-20T11:00:00.008'))
+            # Whole archive
+            _, arch_data = npy.get_data()
+            np.testing.assert_array_equal(arch_data, data)
+            # Window crossing chunks, compared to lcread
+            start, end = npy.starttime + 250.3, npy.starttime + 400
+            st_npy = npy.read(start, end)
+            st_lch = lcread(str(lch_file), start, end, station='TEST',
+                            obs_type='SPOBS2')
+            self.assertEqual(len(st_npy), 4)
+            for tr_npy, tr_lch in zip(st_npy, st_lch):
+                self.assertEqual(tr_npy.id, tr_lch.id)
+                self.assertEqual(tr_npy.stats.starttime,
+                                 tr_lch.stats.starttime)
+                np.testing.assert_array_equal(tr_npy.data, tr_lch.data)
+            for f in archive.iterdir():
+                f.unlink()
+            archive.rmdir()
+        # Invalid block times: the first chunk's time is taken from a later
+        # block, the second chunk's from the first chunk
+        starttimes = npy.chunk_starttimes
+        blocks = np.memmap(lch_file, dtype=BLOCK_DTYPE, mode='r+',
+                           offset=16 * 512)
+        blocks['month'][0] = 13
+        blocks['month'][400:800] = 13
+        blocks.flush()
+        del blocks
+        npy = NpyArchive(lc2npy_convert(lch_file, self.path,
+                                        chunk_blocks=100))
+        np.testing.assert_array_equal(npy.chunk_starttimes, starttimes)
+        # No complete block group
+        lch_file.write_bytes(lch_file.read_bytes()[:18 * 512])
+        with self.assertRaises(ValueError):
+            lc2npy_convert(lch_file, self.path)
+        for f in npy.path.iterdir():
+            f.unlink()
+        npy.path.rmdir()
+        lch_file.unlink()
+
     # TESTS TO ADD:
     # def test_lcplot(self):
     #   """
     #   Verify that the plot is what we expect
     #   """
 
-    # def test_lc2ms(self):
-    #   """
-    #   Verify that the output miniSEED file is as expected
-    #   """
+    def test_lc2ms(self):
+        """ test streamed miniSEED conversion, with hourly files """
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            data = {}
+            for name, start in (('A', datetime(2019, 7, 20, 11, 30)),
+                                ('B', datetime(2019, 7, 21, 0, 0))):
+                data[name] = write_test_lch(tmp / f'{name}.raw.lch',
+                                            n_groups=1000, start=start)
+            files = lc2ms_convert(tmp / 'A.raw.lch', tmp / 'ms',
+                                  rollover='hour', chunk_blocks=300)
+            # 1000 blocks of 2.656 s from 11:30: 11:30, 12:00 files
+            self.assertEqual(len(files), 8)
+            st = obspy_read(str(tmp / 'ms' / '*.mseed'))
+            st.merge()
+            st_lch = lcread(str(tmp / 'A.raw.lch'), 0, 0, obs_type='SPOBS2')
+            for tr_lch, chan_data in zip(st_lch, data['A']):
+                tr = st.select(id=tr_lch.id)[0]
+                self.assertEqual(tr.stats.starttime, tr_lch.stats.starttime)
+                np.testing.assert_array_equal(tr.data, chan_data)
+            for f in files:
+                tr = obspy_read(str(tmp / 'ms' / f))[0]
+                self.assertEqual(tr.stats.starttime.minute % 60,
+                                 0 if '1200' in f else 30)
+            # All input files' outputs are recorded
+            cmd = (f'lc2ms_py -d {tmp} -o out --rollover day '
+                   'A.raw.lch B.raw.lch')
+            subprocess.run(cmd, shell=True, check=True,
+                           capture_output=True)
+            steps = json.loads((tmp / 'out' / 'process-steps.json')
+                               .read_text())['steps']
+            out_files = steps[-1]['execution']['parameters']['output_files']
+            self.assertEqual(len(out_files), 8)
+            self.assertEqual({f.split('_')[1][:8] for f in out_files},
+                             {'20190720', '20190721'})
+            # An invalid first block time is skipped
+            blocks = np.memmap(tmp / 'A.raw.lch', dtype=BLOCK_DTYPE,
+                               mode='r+', offset=16 * 512, shape=(8,))
+            blocks['month'][0] = 13
+            blocks.flush()
+            del blocks
+            files = lc2ms_convert(tmp / 'A.raw.lch', tmp / 'ms2')
+            tr = obspy_read(str(tmp / 'ms2' / files[0]))[0]
+            self.assertEqual(tr.stats.starttime, st_lch[0].stats.starttime)
 
     # def test_lc2SDS(self):
     #   """
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Functions to test the hot-path instrumentation
+"""
+import json
+import tempfile
+import unittest
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+from lcheapo import profiling
+from lcheapo.lcread import read as lcread
+from lch_files import write_test_lch
+
+
+class TestProfiling(unittest.TestCase):
+    """
+    Test suite for profiling
+    """
+    def tearDown(self):
+        profiling.enable(False)
+
+    def test_disabled(self):
+        """ Nothing is wrapped or counted when profiling is off """
+        self.assertIs(profiling.instrument('decode', len), len)
+        with profiling.stage('decode', 10) as timer:
+            timer.nbytes = 20
+        profiling.add('decode', 1.)
+        self.assertEqual(profiling.report()['stages'], {})
+
+    def test_stages(self):
+        """ Nested stages, bytes and calls """
+        profiling.enable()
+        timed_len = profiling.instrument('decode', len, 8)
+        with profiling.stage('outer') as timer:
+            for _ in range(3):
+                timed_len('abc')
+            timer.nbytes = 100
+        stages = profiling.report()['stages']
+        self.assertEqual(stages['decode']['calls'], 3)
+        self.assertEqual(stages['decode']['bytes'], 24)
+        self.assertEqual(stages['outer']['bytes'], 100)
+        self.assertAlmostEqual(stages['outer']['seconds'],
+                               stages['outer']['self_seconds']
+                               + stages['decode']['seconds'])
+
+    def test_lcread(self):
+        """ lcread stages and the --profile report """
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = Path(tmp) / 'TEST.raw.lch'
+            write_test_lch(fname, n_groups=100)
+            parser = ArgumentParser()
+            profiling.add_arguments(parser)
+            args = parser.parse_args(['--profile', str(Path(tmp) / 'p.json')])
+
+            @profiling.profile_main
+            def main():
+                profiling.start(args)
+                lcread(str(fname), starttime=0, endtime=0,
+                       obs_type='SPOBS2')
+
+            with redirect_stdout(StringIO()):
+                main()
+            self.assertFalse(profiling.ENABLED)
+            stages = json.loads((Path(tmp) / 'p.json').read_text())['stages']
+        self.assertEqual(stages['block_read']['bytes'] % 512, 0)
+        self.assertGreaterEqual(stages['block_read']['bytes'], 399 * 512)
+        self.assertEqual(stages['decode']['calls'], 4)
+        self.assertEqual(stages['response_load']['calls'], 4)
+        for name in ('header_read', 'trace_build'):
+            self.assertIn(name, stages)
+
+
+def suite():
+    return unittest.makeSuite(TestProfiling, 'test')
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Functions to test sds_tools.sds_ppsds
+"""
+import json
+import tempfile
+import unittest
+import warnings
+from argparse import Namespace
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+
+import numpy as np
+from obspy import Trace, UTCDateTime
+from obspy.clients.filesystem.sds import Client
+from obspy.core.inventory import Inventory, Network, Station, Channel
+from obspy.core.inventory.response import Response
+
+from lcheapo.batch_plot import PlotSpec, render_all
+from lcheapo.sds_tools import sds_ppsds
+
+START = UTCDateTime(2022, 1, 1)
+NSLC = 'XX.STA..LHZ'
+
+
+def make_inventory():
+    response = Response.from_paz(
+        [0j, 0j], [-0.037 + 0.037j, -0.037 - 0.037j], 1500.,
+        input_units='M/S', output_units='COUNTS')
+    channels = [Channel(code, '', 0, 0, 0, 0, sample_rate=1.,
+                        start_date=START, end_date=START + 3 * 86400,
+                        response=response)
+                for code in ('LHZ', 'LH1')]
+    sta = Station('STA', 0, 0, 0, channels=channels)
+    return Inventory([Network('XX', stations=[sta])])
+
+
+def write_day(sds_dir, day, seed=0, channel='LHZ'):
+    rng = np.random.default_rng(seed)
+    t = START + day * 86400
+    tr = Trace(rng.standard_normal(86400).astype(np.int32) * 1000 + 1,
+               header=dict(network='XX', station='STA', channel=channel,
+                           sampling_rate=1., starttime=t))
+    path = Path(sds_dir) / f'{t.year}/XX/STA/{channel}.D'
+    path.mkdir(parents=True, exist_ok=True)
+    tr.write(str(path / f'XX.STA..{channel}.D.{t.year}.{t.julday:03d}'),
+             format='MSEED')
+
+
+class TestSDSPPSDs(unittest.TestCase):
+    """
+    Test suite for sds_ppsds
+    """
+    def setUp(self):
+        warnings.simplefilter('ignore')
+        self.tmp = tempfile.TemporaryDirectory()
+        self.sds_dir = Path(self.tmp.name) / 'SDS'
+        self.inv_file = str(Path(self.tmp.name) / 'inv.xml')
+        self.inv = make_inventory()
+        self.inv.write(self.inv_file, format='STATIONXML')
+        self.args = Namespace(maxdays=3, skipdays=0, jobs=1, readahead=2,
+                              sds_dir=str(self.sds_dir),
+                              inv_file=self.inv_file,
+                              state_dir=str(Path(self.tmp.name) / 'state'))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _run(self):
+        manifest = sds_ppsds._read_manifest(self.args.state_dir)
+        with redirect_stdout(StringIO()):
+            ppsd, manifest[NSLC] = sds_ppsds._makePPSD(
+                Client(str(self.sds_dir)), self.inv, NSLC, self.args,
+                manifest.get(NSLC))
+        sds_ppsds._write_manifest(self.args.state_dir, manifest)
+        return ppsd, manifest[NSLC]
+
+    def test_incremental(self):
+        """ Only new or modified day files are processed """
+        write_day(self.sds_dir, 0)
+        ppsd, manifest = self._run()
+        self.assertEqual(len(manifest[str(START)]), 1)
+        n_first = len(ppsd.times_processed)
+        self.assertGreater(n_first, 0)
+        self.assertTrue((Path(self.args.state_dir) / f'{NSLC}.npz').exists())
+        with open(Path(self.args.state_dir) / sds_ppsds.MANIFEST_FILE) as fp:
+            self.assertEqual(json.load(fp), {NSLC: manifest})
+
+        # Nothing new: state is reloaded, nothing is added
+        ppsd, manifest = self._run()
+        self.assertEqual(len(ppsd.times_processed), n_first)
+
+        # A new day is added to the saved state
+        write_day(self.sds_dir, 1, seed=1)
+        ppsd, manifest = self._run()
+        self.assertEqual(len(manifest[str(START + 86400)]), 2)
+        self.assertGreater(len(ppsd.times_processed), n_first)
+
+        # Plots, from the saved state
+        spec = sds_ppsds._ppsd_plot_spec(ppsd, NSLC, self.tmp.name,
+                                         self.args.state_dir)
+        self.assertIn('npz_file', spec.kwargs)
+        periods, mode = ppsd.get_mode()
+        specs = [spec, PlotSpec(sds_ppsds._plot_compare_channel,
+                                Path(self.tmp.name) / 'LHZ.PSDs.png',
+                                periods=periods, psds={NSLC: mode},
+                                channel='LHZ')]
+        for filename in render_all(specs, verbose=False):
+            self.assertTrue(Path(filename).exists())
+
+        # Same result as from scratch
+        self.args.state_dir = ''
+        scratch, _ = self._run()
+        np.testing.assert_array_equal(ppsd.current_histogram,
+                                      scratch.current_histogram)
+
+    def test_jobs(self):
+        """ Parallel jobs give the sequential PPSDs """
+        for day in (0, 1):
+            write_day(self.sds_dir, day, seed=day)
+            write_day(self.sds_dir, day, seed=day + 10, channel='LH1')
+        nslcs = [NSLC, 'XX.STA..LH1']
+        results = {}
+        for jobs in (1, 2):
+            self.args.jobs = jobs
+            self.args.state_dir = str(Path(self.tmp.name) / f'state{jobs}')
+            manifest = {}
+            with redirect_stdout(StringIO()) as out:
+                for nslc, ppsd, manifest[nslc] in sds_ppsds._iter_ppsds(
+                        Client(str(self.sds_dir)), self.inv, nslcs,
+                        self.args, {}):
+                    results[(jobs, nslc)] = ppsd
+            self.assertIn('[2/2]', out.getvalue())
+            self.assertEqual(sorted(manifest), sorted(nslcs))
+        for nslc in nslcs:
+            np.testing.assert_array_equal(
+                results[(2, nslc)].current_histogram,
+                results[(1, nslc)].current_histogram)
+
+    def test_inventory_index(self):
+        """ Indexed NSLC dates, epochs and matching """
+        sta = self.inv[0][0]
+        epoch = sta.channels[0].copy()
+        epoch.start_date, epoch.end_date = START - 86400, START
+        lh1 = sta.channels[1]
+        lh1.start_date, lh1.end_date = START + 10 * 86400, None
+        sta.channels.append(epoch)
+        with redirect_stdout(StringIO()) as out:
+            index = sds_ppsds._index_inventory(self.inv, verbose=True)
+        # Date fallbacks are reported once per NSLC
+        self.assertEqual(out.getvalue(),
+                         'XX.STA..LH1: Channel end_date not found, using '
+                         'Network end_date\n')
+        self.assertEqual(sorted(index), ['XX.STA..LH1', NSLC])
+        self.assertEqual(sds_ppsds._inv_nslc_date_range(index, NSLC),
+                         (START - 86400, START + 3 * 86400))
+        start, end, cha = index['XX.STA..LH1']
+        self.assertEqual(start, START + 10 * 86400)
+        self.assertGreater(end, START + 10 * 86400)
+        self.assertIs(cha, lh1)
+        with self.assertRaises(ValueError):
+            sds_ppsds._inv_nslc_date_range(index, 'XX.STA..BHZ')
+        args = Namespace(stations='ST?', channels='*Z')
+        self.assertEqual(sds_ppsds._inv_get_nslc(index, args), [NSLC])
+        with redirect_stdout(StringIO()):
+            shared = sds_ppsds._get_shared_nslcs(
+                [NSLC, 'XX.OTHER..LHZ'], [NSLC, 'XX.STA..LH1', NSLC])
+        self.assertEqual(shared, [NSLC])
+
+    def test_prefetch(self):
+        """ Read-ahead keeps the order and reads each item once """
+        reads = []
+
+        def read(x):
+            reads.append(x)
+            return 2 * x
+        for readahead in (0, 1, 3, 10):
+            reads.clear()
+            self.assertEqual(
+                list(sds_ppsds._prefetch(read, range(5), readahead)),
+                [(x, 2 * x) for x in range(5)])
+            self.assertEqual(sorted(reads), list(range(5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
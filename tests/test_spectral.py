@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Functions to test the spectral functions
+"""
+import tempfile
+import threading
+import unittest
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import scipy.signal as ssig
+from obspy import Stream, Trace, UTCDateTime
+from obspy.core.inventory.response import Response
+
+from lcheapo import spectral
+from lcheapo.spectral import (CrossSpectralMatrix, WelchAccumulator,
+                              ResponseCache, PSDs, Coherences,
+                              TransferFunction, TransferFunctions,
+                              CoherentNoiseRemover)
+
+
+def make_stream(n_samples=100 * 1200, sampling_rate=100., seed=0):
+    """
+    Return a 4-channel stream with a signal common to the first three
+    channels and a linear trend
+    """
+    rng = np.random.default_rng(seed)
+    common = rng.standard_normal(n_samples)
+    traces = []
+    for gain, chan in zip((1, 2, 0.5, 0), 'ZNEH'):
+        data = (gain * common + rng.standard_normal(n_samples)
+                + 0.001 * np.arange(n_samples))
+        traces.append(Trace(data, header=dict(
+            sampling_rate=sampling_rate, channel='BH' + chan,
+            starttime=UTCDateTime(2020, 1, 1))))
+    return Stream(traces)
+
+
+class TestSpectralMethods(unittest.TestCase):
+    """
+    Test suite for spectral calculations
+    """
+    def setUp(self):
+        warnings.simplefilter('ignore', UserWarning)  # No responses
+        self.st = make_stream()
+
+    def test_cross_spectral_matrix(self):
+        """ Cross-spectral matrix gives the same results as scipy """
+        csm = CrossSpectralMatrix.calc(self.st, window_length=100)
+        nfft = csm.nfft
+        self.assertEqual(nfft, 16384)
+        kwargs = dict(nperseg=nfft, noverlap=int(0.75 * nfft),
+                      detrend='linear')
+        for i, tr in enumerate(self.st):
+            f, p = ssig.welch(tr.data, 100., **kwargs)
+            np.testing.assert_allclose(csm.freqs, f)
+            np.testing.assert_allclose(csm.data[i, i].real, p, rtol=1e-10)
+            np.testing.assert_allclose(csm.psd(i).data, p[1:], rtol=1e-10)
+        f, pxy = ssig.csd(self.st[0].data, self.st[1].data, 100., **kwargs)
+        np.testing.assert_allclose(csm.data[0, 1], pxy, rtol=1e-10)
+        np.testing.assert_allclose(csm.data[1, 0], pxy.conj(), rtol=1e-10)
+        cohers = csm.coherences()
+        self.assertEqual(len(cohers.cohers), 6)
+        self.assertEqual(cohers.num_windows, 26)
+        for coh in cohers.cohers:
+            i, j = coh.chan_nums
+            _, c = ssig.coherence(self.st[i].data, self.st[j].data, 100.,
+                                  **kwargs)
+            np.testing.assert_allclose(coh.data, c[1:], atol=1e-10)
+
+    def test_welch_accumulator(self):
+        """ Chunked and merged accumulators give the batch result """
+        csm = CrossSpectralMatrix.calc(self.st, window_length=100)
+        acc = WelchAccumulator(4, csm.nfft, 100.)
+        t = self.st[0].stats.starttime
+        for start in range(0, 1200, 70):
+            acc.add(self.st.slice(t + start, t + start + 69.99))
+        chunked = acc.result()
+        self.assertEqual(chunked.num_windows, csm.num_windows)
+        self.assertEqual(chunked.endtime, csm.endtime)
+        np.testing.assert_allclose(chunked.data, csm.data, rtol=1e-10)
+        with self.assertRaises(ValueError):
+            acc.add(self.st.slice(t + 10, t + 20))
+
+        data = np.array([tr.data for tr in self.st])
+        merged = WelchAccumulator(4, csm.nfft, 100.)
+        parts = merged.partitions(data.shape[1], 3)
+        self.assertEqual(len(parts), 3)
+        for first, last in parts:
+            part = WelchAccumulator(4, csm.nfft, 100.)
+            part.add(data[:, first:last])
+            merged += part
+        self.assertEqual(merged.num_windows, csm.num_windows)
+        np.testing.assert_allclose(merged.result().data, csm.data,
+                                   rtol=1e-10)
+
+    def test_response_cache(self):
+        """ Cached responses are evaluated once and give the same PSDs """
+        response = Response.from_paz(
+            [0j, 0j], [-0.037 + 0.037j, -0.037 - 0.037j], 1500.,
+            input_units='M/S', output_units='COUNTS')
+        for tr in self.st:
+            tr.stats.response = response
+        csm = CrossSpectralMatrix.calc(self.st, window_length=100)
+        cache = ResponseCache()
+        spectral.response_cache, old_cache = cache, spectral.response_cache
+        try:
+            psds = csm.psds()
+        finally:
+            spectral.response_cache = old_cache
+        self.assertEqual((cache.misses, cache.hits, len(cache)), (1, 3, 1))
+        resp, _ = response.get_evalresp_response(t_samp=0.01, nfft=csm.nfft,
+                                                 output='VEL')
+        w = 2 * np.pi * csm.freqs[1:]
+        np.testing.assert_allclose(
+            psds.PSDs[2].data,
+            w**2 * csm.data[2, 2, 1:].real / np.abs(resp[1:])**2)
+        self.assertEqual(psds.PSDs[0].units, "dB ref 1 (m/s^2)^2/Hz")
+        # Bounded size
+        small = ResponseCache(max_bytes=100000)
+        for nfft in (1024, 2048, 4096, 8192):
+            small.get(response, nfft, 100.)
+        self.assertEqual(len(small), 1)
+        # On-disk store
+        with tempfile.TemporaryDirectory() as store:
+            ResponseCache(store=store).get(response, 1024, 100.)
+            self.assertEqual(len(list(Path(store).glob('*.npz'))), 1)
+            stored = ResponseCache(store=store)
+            r, f = stored.get(response, 1024, 100.)
+            self.assertEqual(stored.misses, 1)
+            r0, f0 = response.get_evalresp_response(0.01, 1024, 'VEL')
+            np.testing.assert_array_equal(r, r0)
+            np.testing.assert_array_equal(f, f0)
+        # Two threads missing on the same response store it once
+        cache = ResponseCache()
+        barrier = threading.Barrier(2)
+
+        def load(key):
+            barrier.wait()
+            return None
+        cache._load = load
+        with ThreadPoolExecutor(2) as executor:
+            results = list(executor.map(
+                lambda _: cache.get(response, 1024, 100.), range(2)))
+        self.assertEqual((cache.misses, len(cache)), (2, 1))
+        self.assertIs(results[0], results[1])
+        self.assertEqual(cache._nbytes, sum(x.nbytes for x in results[0]))
+
+    def test_workers(self):
+        """ Parallel calculations give the sequential results """
+        csm = CrossSpectralMatrix.calc(self.st, window_length=100)
+        csm_3 = CrossSpectralMatrix.calc(self.st, window_length=100,
+                                         workers=3)
+        np.testing.assert_allclose(csm_3.data, csm.data, rtol=1e-10)
+        psds = PSDs.calc(self.st, window_length=100)
+        psds_3 = PSDs.calc(self.st, window_length=100, workers=3)
+        for p, p_3 in zip(psds.PSDs, psds_3.PSDs):
+            self.assertIs(p.stats, p_3.stats)
+            np.testing.assert_array_equal(p.data, p_3.data)
+        cohers = Coherences.calc(self.st, window_length=100, workers=3)
+        np.testing.assert_allclose(cohers.cohers[0].data,
+                                   csm.coherence(0, 1)[1:], rtol=1e-10)
+        # Incompatible channels
+        st = self.st.copy()
+        st[1].data = st[1].data[:-100]
+        with self.assertRaises(ValueError):
+            Coherences.calc(st, window_length=100)
+
+    def test_transfer_functions(self):
+        """ Transfer functions of all pairs, from one cross-spectral matrix """
+        csm = CrossSpectralMatrix.calc(self.st, window_length=100)
+        xfs = TransferFunctions.calc(csm, ['N', 'E'], ['Z', 'H'])
+        self.assertEqual(len(xfs), 4)
+        kwargs = dict(nperseg=csm.nfft, noverlap=int(0.75 * csm.nfft),
+                      detrend='linear')
+        _, pxx = ssig.welch(self.st[1].data, 100., **kwargs)
+        _, pxy = ssig.csd(self.st[1].data, self.st[0].data, 100., **kwargs)
+        xf = xfs.XFs[0]
+        self.assertEqual((xf.drive_stats.channel, xf.resp_stats.channel),
+                         ('BHN', 'BHZ'))
+        np.testing.assert_allclose(xf.data, pxy[1:] / pxx[1:], rtol=1e-10)
+        # Z = common + noise, N = 2 * common + noise
+        self.assertAlmostEqual(np.median(np.abs(xf.data)), 0.4, delta=0.02)
+        self.assertGreater(xf.gooddata.mean(), 0.8)
+        self.assertLess(xfs.XFs[1].gooddata.mean(), 0.2)  # N -> H
+        xf = TransferFunction.calc(csm, 'Z', 'N', noisechan='driving')
+        self.assertAlmostEqual(np.median(np.abs(xf.data)), 2.5, delta=0.1)
+        with self.assertRaises(ValueError):
+            TransferFunction.calc(csm, 'X', 'Z')
+        # Plots are written next to outfile
+        with tempfile.TemporaryDirectory() as tmp:
+            xfs.plot(outfile=Path(tmp) / 'xf.png')
+            self.assertEqual(sorted(p.name for p in Path(tmp).iterdir()),
+                             ['xf_BHH_BHE.png', 'xf_BHH_BHN.png',
+                              'xf_BHZ_BHE.png', 'xf_BHZ_BHN.png'])
+
+    def test_remove_coherent(self):
+        """ Removing a coherent channel gives the conditioned spectra """
+        csm = CrossSpectralMatrix.calc(self.st, window_length=100)
+        cleaned = csm.remove_coherent('N')
+        self.assertEqual([s.channel for s in cleaned.stats],
+                         ['BHZ', 'BHE', 'BHH'])
+        g = csm.data[:, :, 1:]
+        np.testing.assert_allclose(
+            cleaned.data[0, 0, 1:].real,
+            g[0, 0].real - np.abs(g[1, 0])**2 / g[1, 1].real, rtol=1e-8)
+        # Z and E are only coherent through N
+        both = csm.remove_coherent(['N', 'E'])
+        self.assertLess(np.median(cleaned.coherence(0, 1)[1:]), 0.1)
+        np.testing.assert_allclose(np.median(both.data[0, 0, 1:].real),
+                                   np.median(cleaned.data[0, 0, 1:].real),
+                                   rtol=0.1)
+
+    def test_coherent_noise_remover(self):
+        """ Per-window cleaning gives cleaned PSDs and time series """
+        csm = CrossSpectralMatrix.calc(self.st, window_length=100)
+        remover = CoherentNoiseRemover.from_csm(csm, 'N')
+        self.assertEqual(remover.others, [0, 2, 3])
+        np.testing.assert_allclose(remover.csm(self.st).data,
+                                   csm.remove_coherent('N').data,
+                                   rtol=1e-8, atol=1e-12)
+        psds = remover.psds(self.st)
+        self.assertEqual([p.stats.channel for p in psds.PSDs],
+                         ['BHZ', 'BHE', 'BHH'])
+        # Z = common + noise, N = 2 * common + noise: cleaned variance 1.2
+        original = self.st[0].data.copy()
+        cleaned = remover.clean_stream(self.st)
+        self.assertEqual(len(cleaned), 3)
+        self.assertEqual(cleaned[0].stats.npts, self.st[0].stats.npts)
+        self.assertAlmostEqual(np.var(ssig.detrend(cleaned[0].data)), 1.2,
+                               delta=0.1)
+        np.testing.assert_array_equal(self.st[0].data, original)
+        # Nothing to remove: the time series are reconstructed
+        remover.transfer[:] = 0
+        for tr, i in zip(remover.clean_stream(self.st), remover.others):
+            np.testing.assert_allclose(tr.data, self.st[i].data, atol=1e-9)
+
+    def test_float32(self):
+        """ Single precision is close to double, input data unchanged """
+        st = self.st.copy()
+        for tr in st:
+            tr.data = np.round(tr.data * 1000).astype(np.int32)
+        originals = [tr.data.copy() for tr in st]
+        csm = CrossSpectralMatrix.calc(st, window_length=100)
+        csm_32 = CrossSpectralMatrix.calc(st, window_length=100,
+                                          dtype=np.float32)
+        self.assertEqual(csm_32.data.dtype, np.complex128)
+        for i in range(4):
+            np.testing.assert_allclose(csm_32.data[i, i], csm.data[i, i],
+                                       rtol=1e-3)
+        psds = PSDs.calc(st, window_length=100)
+        psds_32 = PSDs.calc(st, window_length=100, dtype=np.float32)
+        for p, p_32 in zip(psds.PSDs, psds_32.PSDs):
+            np.testing.assert_allclose(p_32.data, p.data, rtol=1e-3)
+        cohers_32 = Coherences.calc(st, window_length=100, dtype=np.float32)
+        np.testing.assert_allclose(cohers_32.cohers[0].data,
+                                   csm.coherence(0, 1)[1:], atol=1e-4)
+        for tr, data in zip(st, originals):
+            self.assertEqual(tr.data.dtype, np.int32)
+            np.testing.assert_array_equal(tr.data, data)
+
+
+def suite():
+    return unittest.makeSuite(TestSpectralMethods, 'test')
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Functions to test the yaml/json caches
+"""
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from lcheapo import yaml_json
+from lcheapo.yaml_json import (load_yaml_json, read_yaml_json, validate,
+                               clear_caches, DEFAULT_SCHEMA)
+
+LCTEST = """input:
+    datafiles:
+        - {name: "a.lch", obs_type: "SPOBS2", station: "STA"}
+output: {show: false, filebase: null}
+plots:
+    time_series:
+        - {description: "all", start_time: null, end_time: null}
+"""
+
+
+class TestYAMLJSON(unittest.TestCase):
+    """
+    Test suite for yaml_json
+    """
+    def setUp(self):
+        clear_caches()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.file = Path(self.tmp.name) / 'test.lctest.yaml'
+        self.file.write_text(LCTEST)
+
+    def tearDown(self):
+        clear_caches()
+        self.tmp.cleanup()
+
+    def _parses(self, parse):
+        """ Number of times the instance file was parsed """
+        return sum(c.args[0] == str(self.file) for c in parse.call_args_list)
+
+    def test_document_cache(self):
+        """ Documents are parsed once per modification, returned as copies """
+        with mock.patch.object(yaml_json, '_parse_yaml_json',
+                               wraps=yaml_json._parse_yaml_json) as parse:
+            for _ in range(5):
+                root, _ = load_yaml_json(str(self.file))
+                root['output']['show'] = True
+            self.assertEqual(self._parses(parse), 1)
+            self.assertFalse(read_yaml_json(str(self.file))['output']['show'])
+            stat = self.file.stat()
+            self.file.write_text(LCTEST.replace('STA', 'STB'))
+            os.utime(self.file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+            root, _ = load_yaml_json(str(self.file))
+            self.assertEqual(self._parses(parse), 2)
+            self.assertEqual(root['input']['datafiles'][0]['station'], 'STB')
+
+    def test_validator_cache(self):
+        """ The schema is loaded once, valid files are validated once """
+        v = yaml_json._schema_validator(DEFAULT_SCHEMA)
+        self.assertIs(yaml_json._schema_validator(DEFAULT_SCHEMA), v)
+        with mock.patch.object(yaml_json, 'read_yaml_json',
+                               wraps=yaml_json.read_yaml_json) as read:
+            with redirect_stdout(StringIO()) as out:
+                for _ in range(3):
+                    self.assertTrue(validate(str(self.file)))
+            self.assertEqual(read.call_count, 1)
+        self.assertEqual(out.getvalue().count('OK'), 3)
+
+    def test_schema_refs(self):
+        """ A change in a $ref'd schema file invalidates the caches """
+        tmp = Path(self.tmp.name)
+        schema = tmp / 'main.schema.json'
+        schema.write_text('{"$ref": "sub.schema.json#/definitions/root"}')
+        sub = tmp / 'sub.schema.json'
+        sub.write_text('{"definitions": {"root": {"type": "object"}}}')
+        with redirect_stdout(StringIO()) as out:
+            validate(str(self.file), schema_file=str(schema))
+        self.assertTrue(out.getvalue().endswith('OK\n'))
+        v = yaml_json._schema_validator(schema)
+        stat = sub.stat()
+        sub.write_text('{"definitions": {"root": {"type": "array"}}}')
+        os.utime(sub, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertIsNot(yaml_json._schema_validator(schema), v)
+        with redirect_stdout(StringIO()) as out:
+            validate(str(self.file), schema_file=str(schema))
+        self.assertIn('FAILED', out.getvalue())
+
+
+def suite():
+    return unittest.makeSuite(TestYAMLJSON, 'test')
+
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')